@@ -7,9 +7,11 @@ from observation_portal.common import mixins
 
 
 class PondBlockFilter(mixins.CustomIsoDateTimeFilterMixin, django_filters.FilterSet):
-    site = django_filters.MultipleChoiceFilter(choices=configdb.get_site_tuples())
-    observatory = django_filters.MultipleChoiceFilter(choices=configdb.get_enclosure_tuples(), field_name='enclosure')
-    telescope = django_filters.MultipleChoiceFilter(choices=configdb.get_telescope_tuples())
+    site = django_filters.MultipleChoiceFilter(choices=lambda: configdb.get_site_tuples())
+    observatory = django_filters.MultipleChoiceFilter(
+        choices=lambda: configdb.get_enclosure_tuples(), field_name='enclosure'
+    )
+    telescope = django_filters.MultipleChoiceFilter(choices=lambda: configdb.get_telescope_tuples())
     start_after = django_filters.IsoDateTimeFilter(
         field_name='start',
         lookup_expr='gte',
@@ -45,7 +47,7 @@ class PondBlockFilter(mixins.CustomIsoDateTimeFilterMixin, django_filters.Filter
         lookup_expr='exact'
     )
     instrument_class = django_filters.ChoiceFilter(
-        choices=configdb.get_instrument_type_tuples(),
+        choices=lambda: configdb.get_instrument_type_tuples(),
         field_name='configuration_statuses__configuration__instrument_type'
     )
     canceled = django_filters.BooleanFilter(method='filter_canceled')
@@ -1,4 +1,9 @@
+import hashlib
+import json
 import logging
+import os
+import threading
+import time
 from typing import Union
 from collections import namedtuple, defaultdict
 
@@ -6,9 +11,24 @@ import requests
 from django.core.cache import caches
 from django.utils.translation import ugettext as _
 from django.conf import settings
+from django.dispatch import Signal
+
+from observation_portal.common.metrics import (
+    FETCH_DURATION, FETCH_PAYLOAD_SIZE, PARSE_DURATION, FETCHES, CACHE_REQUESTS, STALE_FALLBACKS
+)
 
 logger = logging.getLogger(__name__)
 
+CONFIGDB_ERROR_MSG = _((
+    'ConfigDB connection is currently down, please wait a few minutes and try again. If this problem '
+    'persists then please contact support.'
+))
+CONFIGDB_CACHE_TIMEOUT = 900  # seconds
+CONFIGDB_STALE_RETRY_TIMEOUT = 60  # seconds
+
+# Sent with the ConfigDBDiff of the sites data when a refresh finds that the data has changed
+configdb_changed = Signal(providing_args=['diff'])
+
 
 class ConfigDBException(Exception):
     """Raise on error retrieving or processing configuration data."""
@@ -23,45 +43,485 @@ class TelescopeKey(namedtuple('TelescopeKey', ['site', 'enclosure', 'telescope']
         return '.'.join(s for s in [self.site, self.enclosure, self.telescope] if s)
 
 
+def _without_key(data: dict, key: str) -> dict:
+    return {k: v for k, v in data.items() if k != key}
+
+
+class ConfigDBDiff(object):
+    """Summary of what changed between two snapshots of the ConfigDB sites data.
+
+    Attributes:
+        telescopes: Keys of the telescopes that were added, removed, or whose location details changed
+        instrument_types: Instrument types whose instruments changed, or that are on a changed telescope
+        overheads: Instrument types whose overheads changed
+        sites: Codes of the sites that are affected by any of the changes
+    """
+    def __init__(self, telescopes: set = None, instrument_types: set = None, overheads: set = None,
+                 sites: set = None):
+        self.telescopes = telescopes or set()
+        self.instrument_types = instrument_types or set()
+        self.overheads = overheads or set()
+        self.sites = sites or set()
+
+    def __bool__(self):
+        return bool(self.telescopes or self.instrument_types or self.overheads)
+
+    def __repr__(self):
+        return (
+            f'ConfigDBDiff(telescopes={self.telescopes!r}, instrument_types={self.instrument_types!r}, '
+            f'overheads={self.overheads!r}, sites={self.sites!r})'
+        )
+
+
+InstrumentLocation = namedtuple(
+    'InstrumentLocation', ['site', 'enclosure', 'telescope', 'state', 'instrument_type', 'telescope_key']
+)
+
+
+class ConfigDBSnapshot(object):
+    """Pre-indexed view of the ConfigDB sites data.
+
+    The snapshot is built once per refresh of the sites data, and holds indexes of sites, telescopes and instruments
+    so that lookups do not need to walk the nested site/enclosure/telescope/instrument structure. The snapshot must
+    be treated as read only.
+
+    Parameters:
+        site_data: ConfigDB sites data
+        version: Version identifier of the sites data the snapshot was built from
+    """
+    def __init__(self, site_data: list, version: str = None):
+        self.version = version
+        self.sites = {}
+        self.telescopes = {}
+        self.instruments = []
+        self.instruments_by_type = defaultdict(list)
+        self.instruments_by_code = defaultdict(list)
+        self.instruments_by_telescope = defaultdict(list)
+        self.instrument_locations = []
+        self._telescope_keys_lower = {}
+        self._telescope_names = {}
+        self._memo = {}
+        for site in site_data:
+            self.sites[site['code']] = site
+            for enclosure in site['enclosure_set']:
+                for telescope in enclosure['telescope_set']:
+                    telescope_key = TelescopeKey(site=site['code'], enclosure=enclosure['code'],
+                                                 telescope=telescope['code'])
+                    self.telescopes[telescope_key] = {'site': site, 'enclosure': enclosure, 'telescope': telescope}
+                    self._telescope_keys_lower.setdefault(
+                        TelescopeKey(*(code.lower() for code in telescope_key)), telescope_key
+                    )
+                    self._telescope_names.setdefault(telescope['name'].strip().lower(), telescope['name'].strip())
+                    for instrument in telescope['instrument_set']:
+                        instrument['telescope_key'] = telescope_key
+                        instrument['telescope_name'] = telescope['name'].strip().lower()
+                        self.instruments.append(instrument)
+                        self.instruments_by_type[instrument['science_camera']['camera_type']['code'].upper()].append(
+                            instrument
+                        )
+                        self.instruments_by_code[instrument['code'].upper()].append(instrument)
+                        self.instruments_by_telescope[telescope_key].append(instrument)
+                        split_string = instrument['__str__'].lower().split('.')
+                        self.instrument_locations.append(InstrumentLocation(
+                            site=split_string[0], enclosure=split_string[1], telescope=split_string[2],
+                            state=instrument['state'].upper(),
+                            instrument_type=instrument['science_camera']['camera_type']['code'].upper(),
+                            telescope_key=telescope_key
+                        ))
+        # Freeze the indexes so that missing keys do not add entries
+        self.instruments_by_type.default_factory = None
+        self.instruments_by_code.default_factory = None
+        self.instruments_by_telescope.default_factory = None
+
+    def get_telescope_key(self, site_code: str, enclosure_code: str, telescope_code: str) -> Union[None, TelescopeKey]:
+        """Get the key of a telescope, matching the codes case insensitively."""
+        return self._telescope_keys_lower.get(
+            TelescopeKey(site_code.lower(), enclosure_code.lower(), telescope_code.lower())
+        )
+
+    def get_raw_telescope_name(self, telescope_name: str) -> Union[None, str]:
+        """Get the telescope name as it is stored in ConfigDB, matching case insensitively."""
+        return self._telescope_names.get(telescope_name.strip().lower())
+
+    def get_instruments_of_type(self, instrument_type: str) -> list:
+        return self.instruments_by_type.get(instrument_type.upper(), [])
+
+    def get_instruments_with_code(self, instrument_code: str) -> list:
+        return self.instruments_by_code.get(instrument_code.upper(), [])
+
+    def get_instrument_locations(self, location: dict, exclude_states: list) -> list:
+        """Get the normalized locations of the instruments matching a location.
+
+        Parameters:
+            location: Dictionary of the location, with class, site, enclosure, and telescope fields
+            exclude_states: Instrument states to leave out
+        Returns:
+            Matching instrument locations
+        """
+        site = location.get('site', '').lower()
+        enclosure = location.get('enclosure', '').lower()
+        telescope_class = location.get('telescope_class', '').lower()
+        telescope = location.get('telescope', '').lower()
+        return [
+            instrument_location for instrument_location in self.instrument_locations
+            if instrument_location.state not in exclude_states
+            and site in instrument_location.site
+            and enclosure in instrument_location.enclosure
+            and telescope_class in instrument_location.telescope
+            and telescope in instrument_location.telescope
+        ]
+
+    def get_telescope_details(self, telescope_key: TelescopeKey) -> dict:
+        """Get the site, enclosure and telescope fields of a telescope, without the nested sets below them."""
+        telescope = self.telescopes[telescope_key]
+        return {
+            'site': _without_key(telescope['site'], 'enclosure_set'),
+            'enclosure': _without_key(telescope['enclosure'], 'telescope_set'),
+            'telescope': _without_key(telescope['telescope'], 'instrument_set')
+        }
+
+    def get_instrument_type_details(self) -> dict:
+        """Get the instruments and the overhead related fields of each instrument type.
+
+        Returns:
+            Dictionary of instrument type to the instruments of that type, and to the fields its overheads depend on
+        """
+        instrument_type_details = {}
+        for instrument_type, instruments in self.instruments_by_type.items():
+            instrument_type_details[instrument_type] = {
+                'instruments': sorted(
+                    (str(instrument['telescope_key']), instrument['code'], instrument['state'].upper())
+                    for instrument in instruments
+                ),
+                'overheads': [
+                    (instrument['science_camera'], self.get_telescope_details(instrument['telescope_key'])['telescope'])
+                    for instrument in instruments
+                ]
+            }
+        return instrument_type_details
+
+    def diff(self, previous: 'ConfigDBSnapshot') -> ConfigDBDiff:
+        """Find what changed since a previous snapshot.
+
+        Parameters:
+            previous: Snapshot to compare against
+        Returns:
+            The changes between the previous snapshot and this one
+        """
+        telescopes = {
+            telescope_key for telescope_key in set(self.telescopes) | set(previous.telescopes)
+            if telescope_key not in self.telescopes or telescope_key not in previous.telescopes
+            or self.get_telescope_details(telescope_key) != previous.get_telescope_details(telescope_key)
+        }
+        details = self.get_instrument_type_details()
+        previous_details = previous.get_instrument_type_details()
+        instrument_types = set()
+        overheads = set()
+        for instrument_type in set(details) | set(previous_details):
+            current = details.get(instrument_type, {})
+            before = previous_details.get(instrument_type, {})
+            if current.get('overheads') != before.get('overheads'):
+                overheads.add(instrument_type)
+            on_changed_telescope = any(
+                instrument['telescope_key'] in telescopes
+                for snapshot in [self, previous] for instrument in snapshot.get_instruments_of_type(instrument_type)
+            )
+            if current.get('instruments') != before.get('instruments') or on_changed_telescope:
+                instrument_types.add(instrument_type)
+        sites = {telescope_key.site for telescope_key in telescopes}
+        for snapshot in [self, previous]:
+            for instrument_type in instrument_types:
+                sites.update(
+                    instrument['telescope_key'].site for instrument in snapshot.get_instruments_of_type(instrument_type)
+                )
+        return ConfigDBDiff(telescopes=telescopes, instrument_types=instrument_types, overheads=overheads, sites=sites)
+
+    def memoize(self, key: tuple, compute):
+        """Return a value derived from the snapshot, computing it only the first time it is requested.
+
+        Memoized values live as long as the snapshot, so they are invalidated whenever the sites data changes. The
+        returned values are shared and must be treated as read only.
+
+        Parameters:
+            key: Key identifying the computation and its arguments
+            compute: Function with no arguments that computes the value
+        Returns:
+            The memoized value
+        """
+        try:
+            return self._memo[key]
+        except KeyError:
+            value = self._memo[key] = compute()
+            return value
+
+
+class ConfigDBRefresher(threading.Thread):
+    """Daemon thread that refreshes cached ConfigDB data ahead of its expiry.
+
+    Parameters:
+        interval: Seconds between refreshes, should be shorter than the cache timeout
+    """
+    def __init__(self, interval: float):
+        super().__init__(name='configdb-refresher', daemon=True)
+        self.interval = interval
+        self.resources = set()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            for resource in list(self.resources):
+                try:
+                    ConfigDB.refresh_configdb_data(resource, max_age=self.interval)
+                except ConfigDBException as e:
+                    logger.warning(repr(e))
+
+    def stop(self):
+        self._stopped.set()
+
+
 class ConfigDB(object):
     """Class to retrieve and process configuration data."""
+    _refresher = None
+    _refresher_lock = threading.Lock()
+
+    def __init__(self):
+        self._snapshot = None
+
+    @staticmethod
+    def _fetch_configdb_data(resource: str, last_good: dict = None) -> dict:
+        """Fetch configuration data from ConfigDB, bypassing the cache.
+
+        If a previous copy of the data is given, the request is made conditional on the data having changed
+        since then, in which case an unchanged response returns the previous copy.
+
+        Parameters:
+            resource: ConfigDB endpoint
+            last_good: Previously fetched copy of the data
+        Raises:
+            ConfigDBException: If the data could not be retrieved
+        Returns:
+            Data retrieved, with its version and the validators used to make conditional requests
+        """
+        headers = {}
+        if last_good:
+            if last_good.get('etag'):
+                headers['If-None-Match'] = last_good['etag']
+            if last_good.get('last_modified'):
+                headers['If-Modified-Since'] = last_good['last_modified']
+        try:
+            with FETCH_DURATION.labels('configdb', resource).time():
+                r = requests.get(settings.CONFIGDB_URL + f'/{resource}/', headers=headers)
+                r.raise_for_status()
+        except (requests.exceptions.RequestException, requests.exceptions.HTTPError) as e:
+            FETCHES.labels('configdb', resource, 'error').inc()
+            msg = f'{e.__class__.__name__}: {CONFIGDB_ERROR_MSG}'
+            raise ConfigDBException(msg)
+        if r.status_code == 304 and last_good:
+            FETCHES.labels('configdb', resource, 'not_modified').inc()
+            return dict(last_good, fetched=time.time())
+        FETCH_PAYLOAD_SIZE.labels('configdb', resource).observe(len(r.content))
+        try:
+            with PARSE_DURATION.labels('configdb', resource).time():
+                data = r.json()['results']
+        except KeyError:
+            FETCHES.labels('configdb', resource, 'error').inc()
+            raise ConfigDBException(CONFIGDB_ERROR_MSG)
+        FETCHES.labels('configdb', resource, 'ok').inc()
+        return {
+            'data': data,
+            'version': hashlib.md5(r.content).hexdigest(),
+            'etag': r.headers.get('ETag'),
+            'last_modified': r.headers.get('Last-Modified'),
+            'fetched': time.time()
+        }
+
+    @staticmethod
+    def _load_configdb_snapshot_file(last_good: dict = None) -> dict:
+        """Load the sites data from the local snapshot file instead of fetching it from ConfigDB.
+
+        The file holds a ConfigDB sites response, like common/test_data/configdb.json. It is only read again when
+        its modification time or size changes.
+
+        Parameters:
+            last_good: Previously loaded copy of the data
+        Raises:
+            ConfigDBException: If the file could not be read or parsed
+        Returns:
+            Record of the data along with its version
+        """
+        path = settings.CONFIGDB_SNAPSHOT_FILE
+        try:
+            stat = os.stat(path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if last_good and last_good.get('signature') == signature:
+                FETCHES.labels('configdb_snapshot_file', 'sites', 'not_modified').inc()
+                return dict(last_good, fetched=time.time())
+            with FETCH_DURATION.labels('configdb_snapshot_file', 'sites').time():
+                with open(path, 'rb') as snapshot_file:
+                    content = snapshot_file.read()
+            FETCH_PAYLOAD_SIZE.labels('configdb_snapshot_file', 'sites').observe(len(content))
+            with PARSE_DURATION.labels('configdb_snapshot_file', 'sites').time():
+                data = json.loads(content)['results']
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            FETCHES.labels('configdb_snapshot_file', 'sites', 'error').inc()
+            raise ConfigDBException(f'Could not load ConfigDB snapshot file {path}: {e!r}')
+        FETCHES.labels('configdb_snapshot_file', 'sites', 'ok').inc()
+        return {
+            'data': data,
+            'version': hashlib.md5(content).hexdigest(),
+            'signature': signature,
+            'fetched': time.time()
+        }
+
+    @staticmethod
+    def _get_shared_cache():
+        """Return the cache shared between processes, or None if there is no shared cache configured."""
+        if settings.CONFIGDB_SHARED_CACHE:
+            return caches[settings.CONFIGDB_SHARED_CACHE]
+        return None
+
+    @staticmethod
+    def refresh_configdb_data(resource: str, max_age: float = None):
+        """Update the cached configuration data.
+
+        The data is taken from the shared cache if another process has recently fetched it, and it is no older than
+        max_age seconds, otherwise it is fetched from ConfigDB and stored in the shared cache. If ConfigDB cannot be
+        reached, fall back on the last good copy of the data, which is cached for a short time before retrying. When
+        newly fetched data differs from the last good copy, the configdb_changed signal is sent.
+
+        If CONFIGDB_SNAPSHOT_FILE is set, the sites data is loaded from that file instead, and is checked for changes
+        every CONFIGDB_SNAPSHOT_FILE_CHECK_INTERVAL seconds.
+
+        Parameters:
+            resource: ConfigDB endpoint
+            max_age: Maximum age in seconds of data taken from the shared cache, used by the background refresher so
+                that it renews the shared copy instead of reusing it until it expires
+        Raises:
+            ConfigDBException: If the data could not be retrieved and there is no previous copy to fall back on
+        Returns:
+            Data retrieved
+        """
+        from_file = resource == 'sites' and bool(settings.CONFIGDB_SNAPSHOT_FILE)
+        # Every process reads the local snapshot file itself, there is nothing to share
+        shared_cache = None if from_file else ConfigDB._get_shared_cache()
+        shared_cache_key = f'configdb.{resource}'
+        record = shared_cache.get(shared_cache_key) if shared_cache else None
+        if record is not None and max_age is not None and time.time() - record['fetched'] >= max_age:
+            record = None
+        # Only the process that fetches new data notifies about changes to it
+        last_good = None
+        if record is not None:
+            CACHE_REQUESTS.labels('configdb', resource, 'shared_hit').inc()
+        else:
+            last_good = caches['locmem'].get(f'{resource}.no_expire')
+            if last_good is None and shared_cache:
+                last_good = shared_cache.get(f'{shared_cache_key}.no_expire')
+            try:
+                if from_file:
+                    record = ConfigDB._load_configdb_snapshot_file(last_good)
+                else:
+                    record = ConfigDB._fetch_configdb_data(resource, last_good)
+            except ConfigDBException as e:
+                if last_good is None:
+                    raise
+                logger.warning(repr(e))
+                STALE_FALLBACKS.labels('configdb', resource).inc()
+                caches['locmem'].set(resource, last_good['data'], CONFIGDB_STALE_RETRY_TIMEOUT)
+                caches['locmem'].set(f'{resource}.version', last_good['version'], CONFIGDB_STALE_RETRY_TIMEOUT)
+                return last_good['data']
+            if shared_cache:
+                shared_cache.set(shared_cache_key, record, CONFIGDB_CACHE_TIMEOUT)
+                shared_cache.set(f'{shared_cache_key}.no_expire', record, None)
+        caches['locmem'].set(f'{resource}.no_expire', record)
+        # Cache the results along with a version of the data used to detect when it changes. Data taken from the
+        # shared cache expires at the same time as the shared copy.
+        if from_file:
+            timeout = settings.CONFIGDB_SNAPSHOT_FILE_CHECK_INTERVAL
+        else:
+            timeout = max(CONFIGDB_CACHE_TIMEOUT - (time.time() - record['fetched']), CONFIGDB_STALE_RETRY_TIMEOUT)
+        caches['locmem'].set(resource, record['data'], timeout)
+        caches['locmem'].set(f'{resource}.version', record['version'], timeout)
+        if last_good is not None and last_good['version'] != record['version']:
+            ConfigDB._notify_changes(resource, last_good['data'], record['data'])
+        return record['data']
+
+    @staticmethod
+    def _notify_changes(resource: str, previous_data: list, data: list):
+        """Send the configdb_changed signal with the changes found in the sites data.
+
+        Receivers use the signal to invalidate the cached values that depend on the data that changed. Errors raised
+        by receivers are logged so that they do not prevent the refresh of the data.
+        """
+        if resource != 'sites':
+            return
+        diff = ConfigDBSnapshot(data).diff(ConfigDBSnapshot(previous_data))
+        if not diff:
+            return
+        logger.info(f'ConfigDB sites data changed: {diff!r}')
+        for receiver, response in configdb_changed.send_robust(sender=ConfigDB, diff=diff):
+            if isinstance(response, Exception):
+                logger.error(f'Error handling ConfigDB changes in {receiver}: {response!r}')
+
+    @classmethod
+    def start_background_refresh(cls, resource: str):
+        """Start refreshing a resource in a background thread of this process, if not already started."""
+        with cls._refresher_lock:
+            if cls._refresher is None:
+                cls._refresher = ConfigDBRefresher(settings.CONFIGDB_REFRESH_INTERVAL)
+                cls._refresher.start()
+            cls._refresher.resources.add(resource)
+
+    @classmethod
+    def stop_background_refresh(cls):
+        with cls._refresher_lock:
+            if cls._refresher is not None:
+                cls._refresher.stop()
+                cls._refresher = None
 
     @staticmethod
     def _get_configdb_data(resource: str):
         """Return all configuration data.
 
         Return all data from ConfigDB at the given endpoint. Check first if the data is already cached, and
-        if so, return that.
+        if so, return that. When background refresh is enabled, the cached data is renewed ahead of its expiry
+        so that it does not need to be fetched within the request.
 
         Parameters:
             resource: ConfigDB endpoint
         Returns:
             Data retrieved
         """
-        error_message = _((
-            'ConfigDB connection is currently down, please wait a few minutes and try again. If this problem '
-            'persists then please contact support.'
-        ))
         data = caches['locmem'].get(resource)
         if not data:
-            try:
-                r = requests.get(settings.CONFIGDB_URL + f'/{resource}/')
-                r.raise_for_status()
-            except (requests.exceptions.RequestException, requests.exceptions.HTTPError) as e:
-                msg = f'{e.__class__.__name__}: {error_message}'
-                raise ConfigDBException(msg)
-            try:
-                data = r.json()['results']
-            except KeyError:
-                raise ConfigDBException(error_message)
-            # Cache the results for 15 minutes.
-            caches['locmem'].set(resource, data, 900)
+            CACHE_REQUESTS.labels('configdb', resource, 'miss').inc()
+            data = ConfigDB.refresh_configdb_data(resource)
+        else:
+            CACHE_REQUESTS.labels('configdb', resource, 'hit').inc()
+        if settings.CONFIGDB_BACKGROUND_REFRESH:
+            ConfigDB.start_background_refresh(resource)
         return data
 
     def get_site_data(self):
         """Return ConfigDB sites data."""
         return self._get_configdb_data('sites')
 
+    def get_snapshot(self) -> ConfigDBSnapshot:
+        """Return the pre-indexed snapshot of the ConfigDB sites data.
+
+        The snapshot is rebuilt only when the version of the cached sites data changes, or when the version of the
+        data is not known.
+
+        Returns:
+            Snapshot of the sites data
+        """
+        version = caches['locmem'].get('sites.version')
+        snapshot = self._snapshot
+        if snapshot is None or version is None or snapshot.version != version:
+            site_data = self.get_site_data()
+            snapshot = ConfigDBSnapshot(site_data, caches['locmem'].get('sites.version'))
+            self._snapshot = snapshot
+        return snapshot
+
     def get_sites_with_instrument_type_and_location(
         self, instrument_type: str = '', site_code: str = '', enclosure_code: str = '', telescope_code: str = '',
         only_schedulable: bool = True
@@ -91,175 +551,152 @@ class ConfigDB(object):
         return site_details
 
     def get_site_tuples(self, include_blank=False):
-        site_data = self.get_site_data()
-        sites = [(site['code'], site['code']) for site in site_data]
+        sites = [(site_code, site_code) for site_code in self.get_snapshot().sites]
         if include_blank:
             sites.append(('', ''))
         return sites
 
     def get_enclosure_tuples(self, include_blank=False):
-        enclosure_set = set()
-        site_data = self.get_site_data()
-        for site in site_data:
-            for enclosure in site['enclosure_set']:
-                enclosure_set.add(enclosure['code'])
-
+        enclosure_set = {telescope_key.enclosure for telescope_key in self.get_snapshot().telescopes}
         enclosures = [(enclosure, enclosure) for enclosure in enclosure_set]
         if include_blank:
             enclosures.append(('', ''))
         return enclosures
 
     def get_telescope_tuples(self, include_blank=False):
-        telescope_set = set()
-        site_data = self.get_site_data()
-        for site in site_data:
-            for enclosure in site['enclosure_set']:
-                for telescope in enclosure['telescope_set']:
-                    telescope_set.add(telescope['code'])
-
+        telescope_set = {telescope_key.telescope for telescope_key in self.get_snapshot().telescopes}
         telescopes = [(telescope, telescope) for telescope in telescope_set]
         if include_blank:
             telescopes.append(('', ''))
         return telescopes
 
     def get_telescope_class_tuples(self):
-        telescope_classes = set()
-        for site in self.get_site_data():
-            for enclosure in site['enclosure_set']:
-                for telescope in enclosure['telescope_set']:
-                    telescope_classes.add(telescope['code'][:-1])
+        telescope_classes = {telescope_key.telescope[:-1] for telescope_key in self.get_snapshot().telescopes}
         return [(telescope_class, telescope_class) for telescope_class in telescope_classes]
 
     def get_telescope_name_tuples(self):
-        telescope_names = set()
-        for site in self.get_site_data():
-            for enclosure in site['enclosure_set']:
-                for telescope in enclosure['telescope_set']:
-                    telescope_names.add(telescope['name'].strip().lower())
+        telescope_names = {
+            details['telescope']['name'].strip().lower() for details in self.get_snapshot().telescopes.values()
+        }
         return [(telescope_name, telescope_name) for telescope_name in telescope_names]
 
     def get_instrument_type_tuples(self):
-        instrument_types = set()
-        for site in self.get_site_data():
-            for enclosure in site['enclosure_set']:
-                for telescope in enclosure['telescope_set']:
-                    for instrument in telescope['instrument_set']:
-                        instrument_types.add(instrument['science_camera']['camera_type']['code'].upper())
+        instrument_types = set(self.get_snapshot().instruments_by_type.keys())
         return [(instrument_type, instrument_type) for instrument_type in instrument_types]
 
     def get_instrument_name_tuples(self):
-        instrument_names = set()
-        for site in self.get_site_data():
-            for enclosure in site['enclosure_set']:
-                for telescope in enclosure['telescope_set']:
-                    for instrument in telescope['instrument_set']:
-                        instrument_names.add(instrument['code'].lower())
+        instrument_names = {instrument['code'].lower() for instrument in self.get_snapshot().instruments}
         return [(instrument_name, instrument_name) for instrument_name in instrument_names]
 
     def get_configuration_type_tuples(self):
         configuration_types = set()
-        for instrument in self.get_instruments():
+        for instrument in self.get_snapshot().instruments:
             for config_type in instrument['science_camera']['camera_type']['configuration_types']:
                 configuration_types.add(config_type.upper())
         return [(config_type, config_type) for config_type in configuration_types]
 
     def get_raw_telescope_name(self, telescope_name):
-        for site in self.get_site_data():
-            for enclosure in site['enclosure_set']:
-                for telescope in enclosure['telescope_set']:
-                    if telescope['name'].strip().lower() == telescope_name.strip().lower():
-                        return telescope['name'].strip()
-        return telescope_name
+        raw_telescope_name = self.get_snapshot().get_raw_telescope_name(telescope_name)
+        return raw_telescope_name if raw_telescope_name is not None else telescope_name
 
     def get_instruments_at_location(self, site_code, enclosure_code, telescope_code, only_schedulable=False):
+        snapshot = self.get_snapshot()
+        telescope_key = snapshot.get_telescope_key(site_code, enclosure_code, telescope_code)
+        if not only_schedulable:
+            telescope_instruments = self.get_active_instrument_index()['telescopes'].get(telescope_key, {})
+            return {'names': set(telescope_instruments.get('names', ())),
+                    'types': set(telescope_instruments.get('types', ()))}
         instrument_names = set()
         instrument_types = set()
-        for site in self.get_site_data():
-            if site['code'].lower() == site_code.lower():
-                for enclosure in site['enclosure_set']:
-                    if enclosure['code'].lower() == enclosure_code.lower():
-                        for telescope in enclosure['telescope_set']:
-                            if telescope['code'].lower() == telescope_code.lower():
-                                for instrument in telescope['instrument_set']:
-                                    if (
-                                            only_schedulable and self.is_schedulable(instrument)
-                                            or (not only_schedulable and self.is_active(instrument))
-                                    ):
-                                        instrument_names.add(instrument['code'].lower())
-                                        instrument_types.add(
-                                            instrument['science_camera']['camera_type']['code'].lower()
-                                        )
+        for instrument in snapshot.instruments_by_telescope.get(telescope_key, []):
+            if self.is_schedulable(instrument):
+                instrument_names.add(instrument['code'].lower())
+                instrument_types.add(
+                    instrument['science_camera']['camera_type']['code'].lower()
+                )
         return {'names': instrument_names, 'types': instrument_types}
 
+    def get_active_instrument_index(self) -> dict:
+        """Get an index of the active instruments, used to validate many instrument and guider choices at once.
+
+        The index is built in a single pass over the instruments and is memoized on the snapshot, so it must be
+        treated as read only. All names and types in the index are lower case.
+
+        Returns:
+            Dictionary with 'telescopes', mapping the key of each telescope to the 'names' and 'types' of its
+            instruments and to the science camera names of each instrument type ('names_by_type'), and with
+            'guiders', mapping each instrument name to its 'default' guider and the set of 'valid' guiders
+        """
+        return self.get_snapshot().memoize(('active_instrument_index',), self._get_active_instrument_index)
+
+    def _get_active_instrument_index(self) -> dict:
+        telescopes = {}
+        guiders = {}
+        for instrument in self.get_snapshot().instruments:
+            if not self.is_active(instrument):
+                continue
+            instrument_name = instrument['code'].lower()
+            instrument_type = instrument['science_camera']['camera_type']['code'].lower()
+            telescope_instruments = telescopes.setdefault(
+                instrument['telescope_key'], {'names': set(), 'types': set(), 'names_by_type': {}}
+            )
+            telescope_instruments['names'].add(instrument_name)
+            telescope_instruments['types'].add(instrument_type)
+            telescope_instruments['names_by_type'].setdefault(instrument_type, set()).add(
+                instrument['science_camera']['code'].lower()
+            )
+            instrument_guiders = guiders.setdefault(
+                instrument_name, {'default': instrument['autoguider_camera']['code'].lower(), 'valid': set()}
+            )
+            instrument_guiders['valid'].add(instrument['autoguider_camera']['code'].lower())
+            if instrument['science_camera']['camera_type']['allow_self_guiding']:
+                instrument_guiders['valid'].add(instrument_name)
+        return {'telescopes': telescopes, 'guiders': guiders}
+
     def get_telescopes_with_instrument_type_and_location(
             self, instrument_type='', site_code='', enclosure_code='', telescope_code='', only_schedulable=True
     ):
-        site_data = self.get_site_data()
+        snapshot = self.get_snapshot()
         telescope_details = {}
-        for site in site_data:
-            if not site_code or site_code == site['code']:
-                for enclosure in site['enclosure_set']:
-                    if not enclosure_code or enclosure_code == enclosure['code']:
-                        for telescope in enclosure['telescope_set']:
-                            if not telescope_code or telescope_code == telescope['code']:
-                                code = '.'.join([telescope['code'], enclosure['code'], site['code']])
-                                for instrument in telescope['instrument_set']:
-                                    if (self.is_schedulable(instrument) or
-                                            (not only_schedulable and self.is_active(instrument))):
-                                        camera_type = instrument['science_camera']['camera_type']['code']
-                                        if not instrument_type or instrument_type.upper() == camera_type.upper():
-                                            if code not in telescope_details:
-                                                telescope_details[code] = {
-                                                    'latitude': telescope['lat'],
-                                                    'longitude': telescope['long'],
-                                                    'horizon': telescope['horizon'],
-                                                    'altitude': site['elevation'],
-                                                    'ha_limit_pos': telescope['ha_limit_pos'],
-                                                    'ha_limit_neg': telescope['ha_limit_neg'],
-                                                    'zenith_blind_spot': telescope['zenith_blind_spot']
-                                                }
+        instruments = snapshot.get_instruments_of_type(instrument_type) if instrument_type else snapshot.instruments
+        for instrument in instruments:
+            telescope_key = instrument['telescope_key']
+            if (
+                    (not site_code or site_code == telescope_key.site)
+                    and (not enclosure_code or enclosure_code == telescope_key.enclosure)
+                    and (not telescope_code or telescope_code == telescope_key.telescope)
+                    and (self.is_schedulable(instrument) or (not only_schedulable and self.is_active(instrument)))
+            ):
+                code = '.'.join([telescope_key.telescope, telescope_key.enclosure, telescope_key.site])
+                if code not in telescope_details:
+                    site = snapshot.telescopes[telescope_key]['site']
+                    telescope = snapshot.telescopes[telescope_key]['telescope']
+                    telescope_details[code] = {
+                        'latitude': telescope['lat'],
+                        'longitude': telescope['long'],
+                        'horizon': telescope['horizon'],
+                        'altitude': site['elevation'],
+                        'ha_limit_pos': telescope['ha_limit_pos'],
+                        'ha_limit_neg': telescope['ha_limit_neg'],
+                        'zenith_blind_spot': telescope['zenith_blind_spot']
+                    }
         return telescope_details
 
     def is_valid_instrument_type(self, instrument_type):
-        for site in self.get_site_data():
-            for enclosure in site['enclosure_set']:
-                for telescope in enclosure['telescope_set']:
-                    for instrument in telescope['instrument_set']:
-                        if (
-                                instrument_type.upper() == instrument['science_camera']['camera_type']['code'].upper()
-                                and self.is_active(instrument)
-                        ):
-                            return True
-        return False
+        instruments = self.get_snapshot().get_instruments_of_type(instrument_type)
+        return any(self.is_active(instrument) for instrument in instruments)
 
     def is_valid_instrument(self, instrument_name):
-        for site in self.get_site_data():
-            for enclosure in site['enclosure_set']:
-                for telescope in enclosure['telescope_set']:
-                    for instrument in telescope['instrument_set']:
-                        if instrument_name.upper() == instrument['code'].upper() and self.is_active(instrument):
-                            return True
-        return False
+        instruments = self.get_snapshot().get_instruments_with_code(instrument_name)
+        return any(self.is_active(instrument) for instrument in instruments)
 
     def get_instruments(self, exclude_states=None):
         if not exclude_states:
             exclude_states = []
-        site_data = self.get_site_data()
-        instruments = []
-        for site in site_data:
-            for enclosure in site['enclosure_set']:
-                for telescope in enclosure['telescope_set']:
-                    for instrument in telescope['instrument_set']:
-                        if instrument['state'].upper() not in exclude_states:
-                            telescope_key = TelescopeKey(
-                                site=site['code'],
-                                enclosure=enclosure['code'],
-                                telescope=telescope['code']
-                            )
-                            instrument['telescope_key'] = telescope_key
-                            instrument['telescope_name'] = telescope['name'].strip().lower()
-                            instruments.append(instrument)
-        return instruments
+        return [
+            instrument for instrument in self.get_snapshot().instruments
+            if instrument['state'].upper() not in exclude_states
+        ]
 
     def get_instrument_types_per_telescope(self, location: dict = None, only_schedulable: bool = False) -> dict:
         """Get a set of available instrument types per telescope.
@@ -269,23 +706,25 @@ class ConfigDB(object):
         Returns:
             Available instrument types
         """
-        if not location:
-            location = {}
-        exclude_states = ['DISABLED']
-        if only_schedulable:
-            exclude_states = ['DISABLED', 'ENABLED', 'MANUAL', 'COMMISSIONING', 'STANDBY']
+        telescope_instrument_types = self.get_snapshot().memoize(
+            self._get_location_memo_key('instrument_types_per_telescope', location, only_schedulable),
+            lambda: self._get_instrument_types_per_telescope(location, only_schedulable)
+        )
+        # Callers are free to modify the result, so hand out a copy of the memoized value
+        return {
+            telescope_key: list(instrument_types)
+            for telescope_key, instrument_types in telescope_instrument_types.items()
+        }
+
+    def _get_instrument_types_per_telescope(self, location: dict = None, only_schedulable: bool = False) -> dict:
         telescope_instrument_types = {}
-        for instrument in self.get_instruments(exclude_states=exclude_states):
-            split_string = instrument['__str__'].lower().split('.')
-            if (location.get('site', '').lower() in split_string[0]
-                    and location.get('enclosure', '').lower() in split_string[1]
-                    and location.get('telescope_class', '').lower() in split_string[2]
-                    and location.get('telescope', '').lower() in split_string[2]):
-                if instrument['telescope_key'] not in telescope_instrument_types:
-                    telescope_instrument_types[instrument['telescope_key']] = []
-                instrument_type = instrument['science_camera']['camera_type']['code'].upper()
-                if instrument_type not in telescope_instrument_types[instrument['telescope_key']]:
-                    telescope_instrument_types[instrument['telescope_key']].append(instrument_type)
+        instrument_locations = self.get_snapshot().get_instrument_locations(
+            location or {}, self._get_excluded_states(only_schedulable)
+        )
+        for instrument_location in instrument_locations:
+            instrument_types = telescope_instrument_types.setdefault(instrument_location.telescope_key, [])
+            if instrument_location.instrument_type not in instrument_types:
+                instrument_types.append(instrument_location.instrument_type)
         return telescope_instrument_types
 
     def get_instrument_names(
@@ -301,16 +740,9 @@ class ConfigDB(object):
         Returns:
             Available instrument names
         """
-        instrument_names = set()
-        for instrument in self.get_instruments(exclude_states=['DISABLED', ]):
-            if (
-                    instrument['telescope_key'].site.lower() == site_code.lower()
-                    and instrument['telescope_key'].enclosure.lower() == enclosure_code.lower()
-                    and instrument['telescope_key'].telescope.lower() == telescope_code.lower()
-                    and instrument['science_camera']['camera_type']['code'].lower() == instrument_type.lower()
-            ):
-                instrument_names.add(instrument['science_camera']['code'].lower())
-        return instrument_names
+        telescope_key = self.get_snapshot().get_telescope_key(site_code, enclosure_code, telescope_code)
+        telescope_instruments = self.get_active_instrument_index()['telescopes'].get(telescope_key, {})
+        return set(telescope_instruments.get('names_by_type', {}).get(instrument_type.lower(), ()))
 
     def get_instrument_types_per_telescope_name(self, exclude_states=None) -> dict:
         """Get a set of instrument types.
@@ -341,16 +773,15 @@ class ConfigDB(object):
         if only_schedulable:
             exclude_states = ['DISABLED', 'ENABLED', 'MANUAL', 'COMMISSIONING', 'STANDBY']
         instrument_telescopes = set()
-        for instrument in self.get_instruments(exclude_states=exclude_states):
-            if instrument['science_camera']['camera_type']['code'].upper() == instrument_type:
+        for instrument in self.get_snapshot().instruments_by_type.get(instrument_type, []):
+            if instrument['state'].upper() not in exclude_states:
                 instrument_telescopes.add(instrument['telescope_key'])
         return instrument_telescopes
 
     def get_configuration_types(self, instrument_type):
         configuration_types = set()
-        for instrument in self.get_instruments():
-            if instrument_type.upper() == instrument['science_camera']['camera_type']['code'].upper():
-                configuration_types.update(instrument['science_camera']['camera_type']['configuration_types'])
+        for instrument in self.get_snapshot().get_instruments_of_type(instrument_type):
+            configuration_types.update(instrument['science_camera']['camera_type']['configuration_types'])
         return configuration_types
 
     def get_optical_elements(self, instrument_type: str) -> dict:
@@ -363,13 +794,14 @@ class ConfigDB(object):
         """
         optical_elements = defaultdict(list)
         optical_elements_tracker = defaultdict(set)
-        for instrument in self.get_instruments(exclude_states=['DISABLED', ]):
-            if instrument_type.upper() == instrument['science_camera']['camera_type']['code'].upper():
-                for optical_element_group in instrument['science_camera']['optical_element_groups']:
-                    for element in optical_element_group['optical_elements']:
-                        if element['code'] not in optical_elements_tracker[optical_element_group['type']]:
-                            optical_elements_tracker[optical_element_group['type']].add(element['code'])
-                            optical_elements[optical_element_group['type']].append(element)
+        for instrument in self.get_snapshot().get_instruments_of_type(instrument_type):
+            if not self.is_active(instrument):
+                continue
+            for optical_element_group in instrument['science_camera']['optical_element_groups']:
+                for element in optical_element_group['optical_elements']:
+                    if element['code'] not in optical_elements_tracker[optical_element_group['type']]:
+                        optical_elements_tracker[optical_element_group['type']].add(element['code'])
+                        optical_elements[optical_element_group['type']].append(element)
         return optical_elements
 
     def get_modes_by_type(self, instrument_type: str, mode_type: str = '') -> dict:
@@ -381,17 +813,16 @@ class ConfigDB(object):
         Returns:
             Available modes by type
         """
-        for instrument in self.get_instruments():
-            if instrument_type.upper() == instrument['science_camera']['camera_type']['code'].upper():
-                if not mode_type:
-                    return {
-                        mode_group['type']: mode_group
-                        for mode_group in instrument['science_camera']['camera_type']['mode_types']
-                    }
-                else:
-                    for mode_group in instrument['science_camera']['camera_type']['mode_types']:
-                        if mode_group['type'] == mode_type:
-                            return {mode_type: mode_group}
+        for instrument in self.get_snapshot().get_instruments_of_type(instrument_type):
+            if not mode_type:
+                return {
+                    mode_group['type']: mode_group
+                    for mode_group in instrument['science_camera']['camera_type']['mode_types']
+                }
+            else:
+                for mode_group in instrument['science_camera']['camera_type']['mode_types']:
+                    if mode_group['type'] == mode_type:
+                        return {mode_type: mode_group}
         return {}
 
     def get_mode_with_code(self, instrument_type, code, mode_type=''):
@@ -467,33 +898,28 @@ class ConfigDB(object):
         return None
 
     def get_default_acceptability_threshold(self, instrument_type):
-        for instrument in self.get_instruments():
-            if instrument_type.upper() == instrument['science_camera']['camera_type']['code'].upper():
-                return instrument['science_camera']['camera_type']['default_acceptability_threshold']
+        for instrument in self.get_snapshot().get_instruments_of_type(instrument_type):
+            return instrument['science_camera']['camera_type']['default_acceptability_threshold']
 
     def get_max_rois(self, instrument_type):
-        for instrument in self.get_instruments():
-            if instrument_type.upper() == instrument['science_camera']['camera_type']['code'].upper():
-                return instrument['science_camera']['camera_type']['max_rois']
+        for instrument in self.get_snapshot().get_instruments_of_type(instrument_type):
+            return instrument['science_camera']['camera_type']['max_rois']
 
     def get_ccd_size(self, instrument_type):
-        for instrument in self.get_instruments():
-            if instrument_type.upper() == instrument['science_camera']['camera_type']['code'].upper():
-                return {
-                    'x': instrument['science_camera']['camera_type']['pixels_x'],
-                    'y': instrument['science_camera']['camera_type']['pixels_y']
-                }
+        for instrument in self.get_snapshot().get_instruments_of_type(instrument_type):
+            return {
+                'x': instrument['science_camera']['camera_type']['pixels_x'],
+                'y': instrument['science_camera']['camera_type']['pixels_y']
+            }
 
     def get_instrument_type_full_name(self, instrument_type):
-        for instrument in self.get_instruments():
-            if instrument_type.upper() == instrument['science_camera']['camera_type']['code'].upper():
-                return instrument['science_camera']['camera_type']['name']
+        for instrument in self.get_snapshot().get_instruments_of_type(instrument_type):
+            return instrument['science_camera']['camera_type']['name']
         return instrument_type
 
     def get_instrument_type_telescope_class(self, instrument_type):
-        for instrument in self.get_instruments():
-            if instrument_type.upper() == instrument['science_camera']['camera_type']['code'].upper():
-                return instrument['__str__'].split('.')[2][0:3]
+        for instrument in self.get_snapshot().get_instruments_of_type(instrument_type):
+            return instrument['__str__'].split('.')[2][0:3]
         return instrument_type[0:3]
 
     def get_instrument_types(self, location: dict, only_schedulable: bool = False) -> set:
@@ -504,41 +930,48 @@ class ConfigDB(object):
         Returns:
             Available instrument_types (i.e. 1M0-SCICAM-SBIG, etc.)
         """
-        instrument_types = set()
-        exclude_states = ['DISABLED']
+        instrument_types = self.get_snapshot().memoize(
+            self._get_location_memo_key('instrument_types', location, only_schedulable),
+            lambda: frozenset(
+                instrument_location.instrument_type for instrument_location in
+                self.get_snapshot().get_instrument_locations(location, self._get_excluded_states(only_schedulable))
+            )
+        )
+        return set(instrument_types)
+
+    @staticmethod
+    def _get_excluded_states(only_schedulable: bool) -> list:
         if only_schedulable:
-            exclude_states = ['DISABLED', 'ENABLED', 'MANUAL', 'COMMISSIONING', 'STANDBY']
-        for instrument in self.get_instruments(exclude_states=exclude_states):
-            split_string = instrument['__str__'].lower().split('.')
-            if (location.get('site', '').lower() in split_string[0]
-                    and location.get('enclosure', '').lower() in split_string[1]
-                    and location.get('telescope_class', '').lower() in split_string[2]
-                    and location.get('telescope', '').lower() in split_string[2]):
-                instrument_types.add(instrument['science_camera']['camera_type']['code'].upper())
-        return instrument_types
+            return ['DISABLED', 'ENABLED', 'MANUAL', 'COMMISSIONING', 'STANDBY']
+        return ['DISABLED']
+
+    @staticmethod
+    def _get_location_memo_key(name: str, location: dict, only_schedulable: bool) -> tuple:
+        location = location or {}
+        return (name, only_schedulable) + tuple(
+            location.get(field, '').lower() for field in ['site', 'enclosure', 'telescope_class', 'telescope']
+        )
 
     def get_guider_for_instrument_name(self, instrument_name):
-        instruments = self.get_instruments(exclude_states=['DISABLED'])
-        for instrument in instruments:
-            if instrument['code'].lower() == instrument_name.lower():
-                return instrument['autoguider_camera']['code'].lower()
-        raise ConfigDBException(_(f'Instrument not found: {instrument_name}'))
+        instrument_guiders = self.get_active_instrument_index()['guiders'].get(instrument_name.lower())
+        if instrument_guiders is None:
+            raise ConfigDBException(_(f'Instrument not found: {instrument_name}'))
+        return instrument_guiders['default']
 
     def is_valid_guider_for_instrument_name(self, instrument_name, guide_camera_name):
-        instruments = self.get_instruments(exclude_states=['DISABLED'])
-        for instrument in instruments:
-            if instrument['code'].upper() == instrument_name.upper():
-                if instrument['autoguider_camera']['code'].lower() == guide_camera_name.lower():
-                    return True
-                elif instrument['science_camera']['camera_type']['allow_self_guiding'] and guide_camera_name.lower() == instrument_name.lower():
-                    return True
-        return False
+        instrument_guiders = self.get_active_instrument_index()['guiders'].get(instrument_name.lower())
+        return instrument_guiders is not None and guide_camera_name.lower() in instrument_guiders['valid']
 
     def get_exposure_overhead(self, instrument_type, binning, readout_mode=''):
+        return self.get_snapshot().memoize(
+            ('exposure_overhead', instrument_type.upper(), binning, readout_mode.lower() if readout_mode else ''),
+            lambda: self._get_exposure_overhead(instrument_type, binning, readout_mode)
+        )
+
+    def _get_exposure_overhead(self, instrument_type, binning, readout_mode=''):
         # using the instrument type, build an instrument with the correct configdb parameters
-        for instrument in self.get_instruments():
-            if instrument['science_camera']['camera_type']['code'].upper() == instrument_type.upper():
-                camera_type = instrument['science_camera']['camera_type']
+        for instrument in self.get_snapshot().get_instruments_of_type(instrument_type):
+            camera_type = instrument['science_camera']['camera_type']
 
         modes_by_type = self.get_modes_by_type(instrument_type, mode_type='readout')
         if 'readout' in modes_by_type:
@@ -568,35 +1001,37 @@ class ConfigDB(object):
         Returns:
             Request overheads
         """
-        site_data = self.get_site_data()
+        return self.get_snapshot().memoize(
+            ('request_overheads', instrument_type.upper()), lambda: self._get_request_overheads(instrument_type)
+        )
+
+    def _get_request_overheads(self, instrument_type: str) -> dict:
+        snapshot = self.get_snapshot()
         modes_by_type = self.get_modes_by_type(instrument_type)
-        for site in site_data:
-            for enclosure in site['enclosure_set']:
-                for telescope in enclosure['telescope_set']:
-                    for instrument in telescope['instrument_set']:
-                        camera_type = instrument['science_camera']['camera_type']
-                        if camera_type['code'].upper() == instrument_type.upper():
-                            return {
-                                'instrument_change_overhead': telescope['instrument_change_overhead'],
-                                'slew_rate': telescope['slew_rate'],
-                                'minimum_slew_overhead': telescope['minimum_slew_overhead'],
-                                'maximum_slew_overhead': telescope.get('maximum_slew_overhead', 0.0),
-                                'config_change_overhead': camera_type['config_change_time'],
-                                'default_acquisition_exposure_time': camera_type['acquire_exposure_time'],
-                                'acquisition_overheads': {
-                                    am['code']: am['overhead']
-                                    for am in modes_by_type['acquisition']['modes']
-                                } if 'acquisition' in modes_by_type else {},
-                                'guiding_overheads': {
-                                    gm['code']: gm['overhead']
-                                    for gm in modes_by_type['guiding']['modes']
-                                } if 'guiding' in modes_by_type else {},
-                                'front_padding': camera_type['front_padding'],
-                                'optical_element_change_overheads': {
-                                    oeg['type']: oeg['element_change_overhead']
-                                    for oeg in instrument['science_camera']['optical_element_groups']
-                                }
-                            }
+        for instrument in snapshot.get_instruments_of_type(instrument_type):
+            telescope = snapshot.telescopes[instrument['telescope_key']]['telescope']
+            camera_type = instrument['science_camera']['camera_type']
+            return {
+                'instrument_change_overhead': telescope['instrument_change_overhead'],
+                'slew_rate': telescope['slew_rate'],
+                'minimum_slew_overhead': telescope['minimum_slew_overhead'],
+                'maximum_slew_overhead': telescope.get('maximum_slew_overhead', 0.0),
+                'config_change_overhead': camera_type['config_change_time'],
+                'default_acquisition_exposure_time': camera_type['acquire_exposure_time'],
+                'acquisition_overheads': {
+                    am['code']: am['overhead']
+                    for am in modes_by_type['acquisition']['modes']
+                } if 'acquisition' in modes_by_type else {},
+                'guiding_overheads': {
+                    gm['code']: gm['overhead']
+                    for gm in modes_by_type['guiding']['modes']
+                } if 'guiding' in modes_by_type else {},
+                'front_padding': camera_type['front_padding'],
+                'optical_element_change_overheads': {
+                    oeg['type']: oeg['element_change_overhead']
+                    for oeg in instrument['science_camera']['optical_element_groups']
+                }
+            }
         raise ConfigDBException(f'Instrument type {instrument_type} not found in configdb.')
 
     @staticmethod
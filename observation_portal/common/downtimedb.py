@@ -1,4 +1,9 @@
+import hashlib
+import json
+import time
 import requests
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
 from django.core.cache import caches
 from django.utils.translation import ugettext as _
 from django.conf import settings
@@ -7,66 +12,215 @@ import logging
 from time_intervals.intervals import Intervals
 from datetime import datetime
 
+from observation_portal.common.metrics import (
+    FETCH_DURATION, FETCH_PAYLOAD_SIZE, PARSE_DURATION, FETCHES, CACHE_REQUESTS, STALE_FALLBACKS
+)
+
 logger = logging.getLogger(__name__)
 
 DOWNTIMEDB_ERROR_MSG = _(("DowntimeDB connection is currently down, cannot update downtime information. "
                           "Using the last known value."))
 DOWNTIME_DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+DOWNTIME_CACHE_TIMEOUT = 900  # seconds
+DOWNTIME_STALE_RETRY_TIMEOUT = 60  # seconds
+# Query parameter used to only fetch the downtime records that were modified after a given time
+DOWNTIMEDB_MODIFIED_AFTER_PARAM = 'modified_after'
 
 
 class DowntimeDBException(Exception):
     pass
 
 
+def _parse_downtime_date(value: str) -> datetime:
+    if len(value) == 20 and value[4] == '-' and value[7] == '-' and value[10] == 'T' and value[19] == 'Z':
+        try:
+            # Much faster than strptime for the dates in the DOWNTIME_DATE_FORMAT
+            return datetime(
+                int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                int(value[11:13]), int(value[14:16]), int(value[17:19]), tzinfo=timezone.utc
+            )
+        except ValueError:
+            pass
+    return datetime.strptime(value, DOWNTIME_DATE_FORMAT).replace(tzinfo=timezone.utc)
+
+
+class DowntimeStore(object):
+    """Downtime intervals of each telescope resource, indexed by time.
+
+    Overlapping downtimes of a resource are merged, leaving disjoint intervals sorted by time, so that the
+    downtime overlapping a window of time is found with a binary search. The store must be treated as read only.
+
+    Parameters:
+        raw_downtime_intervals: Downtime periods as returned by DowntimeDB
+        version: Version identifier of the downtime data the store was built from
+    """
+    def __init__(self, raw_downtime_intervals: list, version: str = None):
+        self.version = version
+        intervals_by_resource = defaultdict(list)
+        for interval in raw_downtime_intervals:
+            resource = '.'.join([interval['telescope'], interval['observatory'], interval['site']])
+            intervals_by_resource[resource].append(
+                (_parse_downtime_date(interval['start']), _parse_downtime_date(interval['end']))
+            )
+        self._starts = {}
+        self._ends = {}
+        for resource, intervals in intervals_by_resource.items():
+            intervals.sort()
+            starts = []
+            ends = []
+            for start, end in intervals:
+                if ends and start <= ends[-1]:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+            self._starts[resource] = starts
+            self._ends[resource] = ends
+
+    @property
+    def resources(self) -> list:
+        return list(self._starts.keys())
+
+    def get_intervals(self, resource: str, start: datetime = None, end: datetime = None) -> list:
+        """Get the downtime intervals of a resource that overlap a window of time.
+
+        Naive window bounds are taken to be in UTC, in which case the downtime intervals are returned naive as well.
+
+        Parameters:
+            resource: Telescope resource, in the form telescope.enclosure.site
+            start: Start of the window, or None for no lower bound
+            end: End of the window, or None for no upper bound
+        Returns:
+            List of (start, end) tuples of downtime, sorted by time
+        """
+        naive = any(bound is not None and timezone.is_naive(bound) for bound in (start, end))
+        if start is not None and timezone.is_naive(start):
+            start = start.replace(tzinfo=timezone.utc)
+        if end is not None and timezone.is_naive(end):
+            end = end.replace(tzinfo=timezone.utc)
+        starts = self._starts.get(resource, [])
+        ends = self._ends.get(resource, [])
+        first = bisect_right(ends, start) if start is not None else 0
+        last = bisect_left(starts, end) if end is not None else len(starts)
+        intervals = zip(starts[first:last], ends[first:last])
+        if naive:
+            return [(interval_start.replace(tzinfo=None), interval_end.replace(tzinfo=None))
+                    for interval_start, interval_end in intervals]
+        return list(intervals)
+
+    def get_version(self, resource: str, start: datetime = None, end: datetime = None) -> str:
+        """Get a version identifier of the downtime of a resource that overlaps a window of time.
+
+        The version only changes when the downtime within the window changes, so it can be used to key cached
+        values that have that downtime removed.
+        """
+        return hashlib.md5(repr(self.get_intervals(resource, start, end)).encode()).hexdigest()
+
+    def get_intervalset(self, resource: str, start: datetime = None, end: datetime = None) -> Intervals:
+        return Intervals(self.get_intervals(resource, start, end))
+
+
 class DowntimeDB(object):
+    _store = None
+
     @staticmethod
-    def _get_downtime_data():
-        ''' Gets all the data from downtimedb
+    def _get_downtime_data(modified_after: str = None):
+        ''' Gets all the data from downtimedb, or only the data modified after the given time
         :return: list of dictionaries of downtime periods in time order (default)
         '''
+        params = {DOWNTIMEDB_MODIFIED_AFTER_PARAM: modified_after} if modified_after else None
         try:
-            r = requests.get(settings.DOWNTIMEDB_URL)
-            r.raise_for_status()
+            with FETCH_DURATION.labels('downtimedb', 'downtime').time():
+                r = requests.get(settings.DOWNTIMEDB_URL, params=params)
+                r.raise_for_status()
         except (requests.exceptions.RequestException, requests.exceptions.HTTPError) as e:
+            FETCHES.labels('downtimedb', 'downtime', 'error').inc()
             msg = "{}: {}".format(e.__class__.__name__, DOWNTIMEDB_ERROR_MSG)
             raise DowntimeDBException(msg)
 
-        return r.json()
+        FETCH_PAYLOAD_SIZE.labels('downtimedb', 'downtime').observe(len(r.content))
+        FETCHES.labels('downtimedb', 'downtime', 'ok').inc()
+        with PARSE_DURATION.labels('downtimedb', 'downtime').time():
+            return r.json()
 
     @staticmethod
-    def _order_downtime_by_resource(raw_downtime_intervals):
-        ''' Puts the raw downtime interval sets into a dictionary by resource
-        '''
-        downtime_intervals = {}
-        for interval in raw_downtime_intervals:
-            resource = '.'.join([interval['telescope'], interval['observatory'], interval['site']])
-            if resource not in downtime_intervals:
-                downtime_intervals[resource] = []
-            start = datetime.strptime(interval['start'], DOWNTIME_DATE_FORMAT).replace(tzinfo=timezone.utc)
-            end = datetime.strptime(interval['end'], DOWNTIME_DATE_FORMAT).replace(tzinfo=timezone.utc)
-            downtime_intervals[resource].append({'type': 'start', 'time': start})
-            downtime_intervals[resource].append({'type': 'end', 'time': end})
+    def _sync_downtime_data() -> list:
+        """Get all the downtime records, only fetching the records modified since the last sync when possible.
 
-        for resource in downtime_intervals:
-            downtime_intervals[resource] = Intervals(downtime_intervals[resource])
+        With incremental sync enabled, a copy of the downtime records is kept in the shared cache along with a
+        watermark, the latest modification time of the records. Subsequent syncs only fetch the records modified
+        after the watermark and merge them into the copy. Deleted records are only noticed by a full resync, which
+        happens every DOWNTIMEDB_FULL_SYNC_INTERVAL seconds, or whenever the records cannot be synced incrementally.
 
-        return downtime_intervals
+        Raises:
+            DowntimeDBException: If the data could not be retrieved
+        Returns:
+            List of the downtime records, ordered by id when synced incrementally
+        """
+        if not settings.DOWNTIMEDB_INCREMENTAL_SYNC:
+            return DowntimeDB._get_downtime_data()
+        shared_cache = caches[settings.DOWNTIMEDB_SYNC_CACHE]
+        sync = shared_cache.get('downtimedb.sync')
+        now = time.time()
+        if sync is None or not sync['watermark'] or now - sync['full_sync'] > settings.DOWNTIMEDB_FULL_SYNC_INTERVAL:
+            raw_downtime_intervals = DowntimeDB._get_downtime_data()
+            sync = {'records': {}, 'watermark': None, 'full_sync': now}
+            FETCHES.labels('downtimedb', 'downtime', 'full_sync').inc()
+        else:
+            raw_downtime_intervals = DowntimeDB._get_downtime_data(modified_after=sync['watermark'])
+            FETCHES.labels('downtimedb', 'downtime', 'incremental_sync').inc()
+        if any('id' not in record or not record.get('modified') for record in raw_downtime_intervals):
+            # The records cannot be merged by id or be synced from a watermark, so always fetch them all
+            return raw_downtime_intervals
+        for record in raw_downtime_intervals:
+            sync['records'][record['id']] = record
+        watermarks = [record['modified'] for record in raw_downtime_intervals]
+        if sync['watermark']:
+            watermarks.append(sync['watermark'])
+        sync['watermark'] = max(watermarks, default=None)
+        shared_cache.set('downtimedb.sync', sync, None)
+        return [sync['records'][record_id] for record_id in sorted(sync['records'])]
+
+    @staticmethod
+    def _get_downtime_version(raw_downtime_intervals: list) -> str:
+        return hashlib.md5(json.dumps(raw_downtime_intervals, sort_keys=True).encode()).hexdigest()
+
+    @classmethod
+    def get_downtime_store(cls) -> DowntimeStore:
+        """Get the store of downtime intervals per telescope resource.
+
+        The store is kept for the life of the process. DowntimeDB is checked for changes every 15 minutes, and the
+        store is only rebuilt when the downtime data has changed. If DowntimeDB cannot be reached, the previous
+        store is used and the check is retried after a minute.
+
+        Returns:
+            Store of the downtime intervals
+        """
+        version = caches['locmem'].get('downtime_store.version')
+        store = cls._store
+        if store is not None and version is not None and store.version == version:
+            CACHE_REQUESTS.labels('downtimedb', 'downtime', 'hit').inc()
+            return store
+        CACHE_REQUESTS.labels('downtimedb', 'downtime', 'miss').inc()
+        try:
+            raw_downtime_intervals = cls._sync_downtime_data()
+        except DowntimeDBException as e:
+            logger.warning(repr(e))
+            if store is None:
+                return DowntimeStore([])
+            STALE_FALLBACKS.labels('downtimedb', 'downtime').inc()
+            caches['locmem'].set('downtime_store.version', store.version, DOWNTIME_STALE_RETRY_TIMEOUT)
+            return store
+        version = cls._get_downtime_version(raw_downtime_intervals)
+        if store is None or store.version != version:
+            store = cls._store = DowntimeStore(raw_downtime_intervals, version)
+        caches['locmem'].set('downtime_store.version', version, DOWNTIME_CACHE_TIMEOUT)
+        return store
 
     @staticmethod
     def get_downtime_intervals():
         ''' Returns dictionary of IntervalSets of downtime intervals per telescope resource. Caches the data and will
             attempt to update the cache every 15 minutes, but fallback on using previous downtime list otherwise.
         '''
-        downtime_intervals = caches['locmem'].get('downtime_intervals', [])
-        if not downtime_intervals:
-            # If the cache has expired, attempt to update the downtime intervals
-            try:
-                data = DowntimeDB._get_downtime_data()
-                downtime_intervals = DowntimeDB._order_downtime_by_resource(data)
-                caches['locmem'].set('downtime_intervals', downtime_intervals, 900)
-                caches['locmem'].set('downtime_intervals.no_expire', downtime_intervals)
-            except DowntimeDBException as e:
-                downtime_intervals = caches['locmem'].get('downtime_intervals.no_expire', [])
-                logger.warning(repr(e))
-
-        return downtime_intervals
+        downtime_store = DowntimeDB.get_downtime_store()
+        return {resource: downtime_store.get_intervalset(resource) for resource in downtime_store.resources}
@@ -0,0 +1,42 @@
+from rest_framework import serializers
+
+
+class LazyChoiceField(serializers.ChoiceField):
+    """ChoiceField whose choices may be given as a callable, for choices that are expensive to compute.
+
+    Choices that come from ConfigDB would otherwise be retrieved when the serializer class is defined, and again every
+    time the field is copied for a new serializer instance. A callable is only called the first time the field
+    validates or represents a value, or its choices are read, and its result is then set through the choices property.
+    """
+    _lazy_choices = None
+
+    def __init__(self, choices, **kwargs):
+        super().__init__(choices=[] if callable(choices) else choices, **kwargs)
+        if callable(choices):
+            self._lazy_choices = choices
+
+    def _resolve_choices(self):
+        if self._lazy_choices is not None:
+            lazy_choices, self._lazy_choices = self._lazy_choices, None
+            self.choices = lazy_choices()
+
+    @property
+    def choices(self):
+        self._resolve_choices()
+        return serializers.ChoiceField.choices.fget(self)
+
+    @choices.setter
+    def choices(self, choices):
+        serializers.ChoiceField.choices.fset(self, choices)
+
+    def to_internal_value(self, data):
+        self._resolve_choices()
+        return super().to_internal_value(data)
+
+    def to_representation(self, value):
+        self._resolve_choices()
+        return super().to_representation(value)
+
+    def iter_options(self):
+        self._resolve_choices()
+        return super().iter_options()
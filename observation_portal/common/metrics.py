@@ -0,0 +1,53 @@
+import os
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import (
+    Counter, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+)
+
+PAYLOAD_SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+# Metrics of the data retrieved from external services, labelled with the service and the resource retrieved
+FETCH_DURATION = Histogram(
+    'observation_portal_fetch_duration_seconds', 'Time taken to fetch data from an external service',
+    ['service', 'resource']
+)
+FETCH_PAYLOAD_SIZE = Histogram(
+    'observation_portal_fetch_payload_bytes', 'Size of the data fetched from an external service',
+    ['service', 'resource'], buckets=PAYLOAD_SIZE_BUCKETS
+)
+PARSE_DURATION = Histogram(
+    'observation_portal_parse_duration_seconds', 'Time taken to parse the data fetched from an external service',
+    ['service', 'resource']
+)
+FETCHES = Counter(
+    'observation_portal_fetches_total', 'Number of fetches from an external service, by result',
+    ['service', 'resource', 'result']
+)
+CACHE_REQUESTS = Counter(
+    'observation_portal_cache_requests_total', 'Number of lookups of cached external service data, by result',
+    ['service', 'resource', 'result']
+)
+STALE_FALLBACKS = Counter(
+    'observation_portal_stale_fallbacks_total',
+    'Number of times the last good copy of the data was used because the external service could not be reached',
+    ['service', 'resource']
+)
+
+
+def metrics_view(request):
+    """Expose the metrics to be scraped by Prometheus.
+
+    If the prometheus_multiproc_dir environment variable is set, the metrics of all the processes writing to that
+    directory are combined, otherwise only the metrics of the process serving the request are returned.
+
+    Only staff users and requests from the addresses in METRICS_ALLOWED_IPS may see the metrics.
+    """
+    if not request.user.is_staff and request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    registry = REGISTRY
+    if 'prometheus_multiproc_dir' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
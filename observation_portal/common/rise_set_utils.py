@@ -1,23 +1,59 @@
+import hashlib
+import json
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from math import cos, radians
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from datetime import datetime, timedelta
+from functools import lru_cache
 
+import numpy as np
 from time_intervals.intervals import Intervals
 from rise_set.astrometry import (
     make_ra_dec_target, make_satellite_target, make_hour_angle_target, make_minor_planet_target, mean_to_apparent,
-    make_comet_target, make_major_planet_target, angular_distance_between, date_to_tdb
+    make_comet_target, make_major_planet_target, angular_distance_between, date_to_tdb, apparent_planet_pos,
+    calc_apparent_sidereal_time, calculate_airmass_at_times
 )
 from rise_set.angle import Angle
 from rise_set.rates import ProperMotion
-from rise_set.visibility import Visibility
+from rise_set.utils import is_sidereal_target
+from rise_set.visibility import Visibility, set_airmass_limit
 from rise_set.moving_objects import MovingViolation
 from django.core.cache import cache
+from django.conf import settings
+from django.utils import timezone
 
 from observation_portal.common.configdb import configdb, ConfigDB
 from observation_portal.common.downtimedb import DowntimeDB
 from observation_portal.requestgroups.target_helpers import TARGET_TYPE_HELPER_MAP
 
+logger = logging.getLogger(__name__)
+
 HOURS_PER_DEGREES = 15.0
+SITE_DARK_INTERVALS_TIMEOUT = 86400 * 400  # seconds, long enough to cover the precomputed horizon
+SIDEREAL_SOLAR_DAY_RATIO = 1.002737909350
+# Spacing of the grid of times the constraints of targets are evaluated at when computing intervals in a batch
+BATCH_TIME_RESOLUTION = timedelta(minutes=1)
+# Length of time over which the position of the moon is taken to be fixed, the same as rise_set uses
+MOON_DISTANCE_CHUNK = timedelta(minutes=30)
+# Spacing of the times airmasses are calculated at
+AIRMASS_TIME_RESOLUTION = timedelta(minutes=10)
+# Number of airmasses calculated for each airmass returned when the number of airmasses returned is bounded
+AIRMASS_OVERSAMPLING = 4
+# Number of rise_set sites and Visibilities kept in memory for reuse
+RISE_SET_SITE_CACHE_SIZE = 64
+VISIBILITY_CACHE_SIZE = 256
+RISE_SET_TARGET_CACHE_SIZE = 4096
+
+# (worker count, executor) of the process pool used to compute rise_set intervals, created when first needed
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+# rise_set targets by the fields of the targets they were made from, least recently used first
+_rise_set_targets = OrderedDict()
+_rise_set_targets_lock = threading.Lock()
 
 
 def get_largest_interval(intervals_by_site):
@@ -29,11 +65,139 @@ def get_largest_interval(intervals_by_site):
     return largest_interval
 
 
+def get_rise_set_intervals_cache_key(target: dict, constraints: dict, site_detail: dict, day) -> str:
+    """Get the cache key of the rise_set intervals of a target at a site on a UTC day.
+
+    The key is a hash of everything the intervals are computed from, so the cached intervals are shared by all
+    requests with the same target and constraints, whether or not they have been saved and whatever their windows.
+    Unset target fields are left out so that the same target gets the same key whether it comes from a model or a
+    serializer.
+    """
+    content = json.dumps({
+        'target': {field: value for field, value in target.items() if value is not None},
+        'max_airmass': constraints['max_airmass'],
+        'min_lunar_distance': constraints['min_lunar_distance'],
+        'site': site_detail
+    }, sort_keys=True, default=str)
+    return 'rsi.{}.{}'.format(hashlib.sha1(content.encode()).hexdigest(), day.isoformat())
+
+
+def _get_window_days(window: dict) -> list:
+    first_day = window['start'].date()
+    last_day = (window['end'] - timedelta(microseconds=1)).date()
+    return [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+
+
+def _get_consecutive_days(days: list) -> list:
+    consecutive_days = []
+    for day in sorted(days):
+        if consecutive_days and consecutive_days[-1][-1] + timedelta(days=1) == day:
+            consecutive_days[-1].append(day)
+        else:
+            consecutive_days.append([day])
+    return consecutive_days
+
+
+def _split_intervals_by_day(intervals: list, days: list) -> dict:
+    intervals_by_day = {day: [] for day in days}
+    for start, end in intervals:
+        day = start.date()
+        while day <= end.date() and day <= days[-1]:
+            day_start = max(start, _get_utc_day_start(day))
+            day_end = min(end, _get_utc_day_start(day + timedelta(days=1)))
+            if day in intervals_by_day and day_start < day_end:
+                intervals_by_day[day].append((day_start, day_end))
+            day += timedelta(days=1)
+    return intervals_by_day
+
+
+def _join_intervals_by_day(intervals_by_day: dict, start, end) -> list:
+    # The intervals of each day are in UTC, so naive bounds are taken to be UTC and the intervals are returned naive
+    naive = timezone.is_naive(start)
+    if naive:
+        start = start.replace(tzinfo=timezone.utc)
+        end = end.replace(tzinfo=timezone.utc)
+    intervals = []
+    for day in sorted(intervals_by_day):
+        for interval_start, interval_end in intervals_by_day[day]:
+            interval_start = max(interval_start, start)
+            interval_end = min(interval_end, end)
+            if interval_start >= interval_end:
+                continue
+            if intervals and intervals[-1][1] == interval_start:
+                # Join up the parts of an interval that spans more than one day
+                intervals[-1] = (intervals[-1][0], interval_end)
+            else:
+                intervals.append((interval_start, interval_end))
+    if naive:
+        return [(interval_start.replace(tzinfo=None), interval_end.replace(tzinfo=None))
+                for interval_start, interval_end in intervals]
+    return intervals
+
+
+def _get_observable_intervals(site_detail: dict, target: dict, constraints: dict, first_day, last_day) -> list:
+    """Compute the observable intervals of a target at a site over a run of consecutive UTC days.
+
+    This runs in the rise_set process pool when one is configured, so it is only given picklable arguments.
+    """
+    visibility = get_rise_set_visibility(
+        _get_utc_day_start(first_day), _get_utc_day_start(last_day + timedelta(days=1)), site_detail
+    )
+    try:
+        return visibility.get_observable_intervals(
+            get_rise_set_target(target),
+            airmass=constraints['max_airmass'],
+            moon_distance=Angle(degrees=constraints['min_lunar_distance'])
+        )
+    except MovingViolation:
+        return []
+
+
+def _get_process_pool():
+    """Get the process pool used to compute rise_set intervals, or None if intervals are computed in-process."""
+    global _process_pool
+    workers = settings.RISE_SET_PROCESS_POOL_WORKERS
+    with _process_pool_lock:
+        if _process_pool is not None and _process_pool[0] != workers:
+            _process_pool[1].shutdown(wait=False)
+            _process_pool = None
+        if _process_pool is None and workers > 0:
+            _process_pool = (workers, ProcessPoolExecutor(max_workers=workers))
+        return _process_pool[1] if _process_pool else None
+
+
+def _reset_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool[1].shutdown(wait=False)
+            _process_pool = None
+
+
+def _compute_observable_intervals(tasks: list) -> list:
+    """Compute the observable intervals of each (site_detail, target, constraints, first_day, last_day) task.
+
+    The tasks are fanned out to the rise_set process pool if one is configured and there is more than one task,
+    otherwise they are computed one after the other.
+    """
+    pool = _get_process_pool() if len(tasks) > 1 else None
+    if pool is not None:
+        try:
+            return list(pool.map(_get_observable_intervals, *zip(*tasks)))
+        except BrokenProcessPool:
+            logger.warning('The rise_set process pool is broken, computing the intervals in-process instead')
+            _reset_process_pool()
+    return [_get_observable_intervals(*task) for task in tasks]
+
+
 # TODO: rewrite to handle multiple targets per request
 def get_rise_set_intervals_by_site(request: dict) -> dict:
     """Get rise_set intervals by site for a request
 
-    Computes the intervals only if they do not already exist in cache.
+    The intervals are cached for each UTC day at each site, and the intervals of each window are assembled from the
+    days it covers. Only the days that do not already exist in cache are computed, so windows that overlap, or that
+    cover days already computed for another request with the same target, do not compute the same day twice. The
+    missing days of all sites are computed together, in parallel if a rise_set process pool is configured.
 
     Parameters:
         request: The request for which to get the intervals
@@ -43,37 +207,79 @@ def get_rise_set_intervals_by_site(request: dict) -> dict:
     site_details = configdb.get_sites_with_instrument_type_and_location(
         instrument_type=request['configurations'][0]['instrument_type']
     )
+    target = request['configurations'][0]['target']
+    constraints = request['configurations'][0]['constraints']
+    days = sorted({day for window in request['windows'] for day in _get_window_days(window)})
+    cache_keys = {
+        (site, day): get_rise_set_intervals_cache_key(target, constraints, site_details[site], day)
+        for site in site_details for day in days
+    }
+    cached_intervals = cache.get_many(list(cache_keys.values()))
+    intervals_by_site_and_day = {
+        site_day: cached_intervals[cache_key] for site_day, cache_key in cache_keys.items()
+        if cache_key in cached_intervals
+    }
+    # There are no cached rise_set intervals for some days, so compute each run of consecutive missing days at each
+    # site now with a single visibility
+    runs = []
+    for site in site_details:
+        missing_days = [day for day in days if (site, day) not in intervals_by_site_and_day]
+        runs.extend((site, run) for run in _get_consecutive_days(missing_days))
+    if runs:
+        computed_intervals = {}
+        results = _compute_observable_intervals([
+            (site_details[site], target, constraints, run[0], run[-1]) for site, run in runs
+        ])
+        for (site, run), intervals in zip(runs, results):
+            for day, day_intervals in _split_intervals_by_day(intervals, run).items():
+                computed_intervals[(site, day)] = day_intervals
+        # cache for 30 days
+        cache.set_many(
+            {cache_keys[site_day]: intervals for site_day, intervals in computed_intervals.items()}, 86400 * 30
+        )
+        intervals_by_site_and_day.update(computed_intervals)
     intervals_by_site = {}
     for site in site_details:
-        intervals_by_site[site] = None
-        if request.get('id'):
-            cache_key = '{}.{}.rsi'.format(request['id'], site)
-            intervals_by_site[site] = cache.get(cache_key, None)
-
-        if intervals_by_site[site] is None:
-            # There is no cached rise_set intervals for this request and site, so recalculate it now
-            intervals_by_site[site] = []
-            rise_set_site = get_rise_set_site(site_details[site])
-            rise_set_target = get_rise_set_target(request['configurations'][0]['target'])
-            for window in request['windows']:
-                visibility = get_rise_set_visibility(rise_set_site, window['start'], window['end'], site_details[site])
-                try:
-                    intervals_by_site[site].extend(
-                        visibility.get_observable_intervals(
-                            rise_set_target,
-                            airmass=request['configurations'][0]['constraints']['max_airmass'],
-                            moon_distance=Angle(
-                                degrees=request['configurations'][0]['constraints']['min_lunar_distance']
-                            )
-                        )
-                    )
-                except MovingViolation:
-                    pass
-            if request.get('id'):
-                cache.set(cache_key, intervals_by_site[site], 86400 * 30)  # cache for 30 days
+        intervals_by_site[site] = []
+        for window in request['windows']:
+            intervals_by_site[site].extend(_join_intervals_by_day(
+                {day: intervals_by_site_and_day[(site, day)] for day in _get_window_days(window)},
+                window['start'], window['end']
+            ))
     return intervals_by_site
 
 
+def _get_cached_filtered_intervalsets(request_dict: dict, telescopes) -> tuple:
+    """Get the cached intervals with downtime removed of a request at each of the telescopes.
+
+    The intervals with downtime removed are cached per telescope along with the version of the downtime that
+    overlaps the windows of the request, so they are only recomputed for telescopes whose downtime changed. Requests
+    without an id are not cached.
+
+    Returns:
+        Tuple of the cache keys and the downtime versions by telescope, and the intervalsets of the telescopes with
+        up to date cached intervals
+    """
+    downtime_store = DowntimeDB.get_downtime_store()
+    windows = request_dict.get('windows') or [{'start': None, 'end': None}]
+    window_start = None if any(w['start'] is None for w in windows) else min(w['start'] for w in windows)
+    window_end = None if any(w['end'] is None for w in windows) else max(w['end'] for w in windows)
+    downtime_versions = {
+        telescope: downtime_store.get_version(telescope, window_start, window_end) for telescope in telescopes
+    }
+    cache_keys = {}
+    cached_intervals = {}
+    if request_dict.get('id'):
+        cache_keys = {telescope: '{}.{}.frsi'.format(request_dict['id'], telescope) for telescope in telescopes}
+        cached_intervals = cache.get_many(list(cache_keys.values()))
+    filtered_intervalsets_by_telescope = {}
+    for telescope, cache_key in cache_keys.items():
+        cached = cached_intervals.get(cache_key)
+        if cached is not None and cached['downtime_version'] == downtime_versions[telescope]:
+            filtered_intervalsets_by_telescope[telescope] = Intervals(cached['intervals'])
+    return cache_keys, downtime_versions, filtered_intervalsets_by_telescope
+
+
 def get_filtered_rise_set_intervals_by_site(request_dict, site='', is_staff=False):
     intervals = {}
     site = site if site else request_dict['location'].get('site', '')
@@ -88,15 +294,149 @@ def get_filtered_rise_set_intervals_by_site(request_dict, site='', is_staff=Fals
     if not telescope_details:
         return intervals
 
-    intervals_by_site = get_rise_set_intervals_by_site(request_dict)
-    intervalsets_by_telescope = intervals_by_site_to_intervalsets_by_telescope(
-        intervals_by_site, telescope_details.keys()
+    cache_keys, downtime_versions, filtered_intervalsets_by_telescope = _get_cached_filtered_intervalsets(
+        request_dict, telescope_details
     )
-    filtered_intervalsets_by_telescope = filter_out_downtime_from_intervalsets(intervalsets_by_telescope)
+    uncached_telescopes = [
+        telescope for telescope in telescope_details if telescope not in filtered_intervalsets_by_telescope
+    ]
+    if uncached_telescopes:
+        intervals_by_site = get_rise_set_intervals_by_site(request_dict)
+        intervalsets_by_telescope = intervals_by_site_to_intervalsets_by_telescope(
+            intervals_by_site, uncached_telescopes
+        )
+        uncached_intervalsets_by_telescope = filter_out_downtime_from_intervalsets(intervalsets_by_telescope)
+        filtered_intervalsets_by_telescope.update(uncached_intervalsets_by_telescope)
+        if cache_keys:
+            cache.set_many({
+                cache_keys[telescope]: {
+                    'downtime_version': downtime_versions[telescope], 'intervals': intervalset.toTupleList()
+                } for telescope, intervalset in uncached_intervalsets_by_telescope.items()
+            }, 86400 * 30)  # cache for 30 days, like the rise_set intervals
     filtered_intervals_by_site = intervalsets_by_telescope_to_intervals_by_site(filtered_intervalsets_by_telescope)
     return filtered_intervals_by_site
 
 
+def _get_batch_rise_set_intervals_cache_key(target: dict, constraints: dict, site_detail: dict, day) -> str:
+    """Get the cache key of the batch intervals of a target at a site on a UTC day.
+
+    The edges of the batch intervals are only as precise as the grid they are computed on, so they are cached apart
+    from the rise_set intervals, which are always used instead when they exist.
+    """
+    return 'b' + get_rise_set_intervals_cache_key(target, constraints, site_detail, day)
+
+
+def get_filtered_rise_set_intervals_by_site_for_requests(request_dicts: list, site: str = '') -> list:
+    """Get the rise_set intervals by site of many requests, with downtime filtered out.
+
+    This is the batch counterpart of get_filtered_rise_set_intervals_by_site for analytics over many requests. The
+    cached intervals with downtime removed of each request are used where they are up to date, and otherwise the
+    intervals of each UTC day are taken from the cached rise_set intervals of the day. The days that are in neither
+    are computed for all the targets observable at a site together with get_rise_set_intervals_for_targets, and are
+    cached apart from the rise_set intervals.
+
+    Parameters:
+        request_dicts: The requests for which to get the intervals
+        site: Only get the intervals at this site, if given
+    Returns:
+        List of the rise_set intervals by site of each request, in the same order as the requests
+    """
+    telescopes_by_request = []
+    filtered_intervalsets_by_request = []
+    requests_by_site = defaultdict(list)
+    for index, request_dict in enumerate(request_dicts):
+        instrument_type = request_dict['configurations'][0]['instrument_type']
+        telescope_details = configdb.get_telescopes_with_instrument_type_and_location(
+            instrument_type,
+            site if site else request_dict['location'].get('site', ''),
+            request_dict['location'].get('enclosure', ''),
+            request_dict['location'].get('telescope', '')
+        )
+        filtered_intervalsets_by_telescope = _get_cached_filtered_intervalsets(request_dict, telescope_details)[2]
+        uncached_telescopes = [
+            telescope for telescope in telescope_details if telescope not in filtered_intervalsets_by_telescope
+        ]
+        telescopes_by_request.append(uncached_telescopes)
+        filtered_intervalsets_by_request.append(filtered_intervalsets_by_telescope)
+        for site_code in {telescope.split('.')[2] for telescope in uncached_telescopes}:
+            requests_by_site[(site_code, instrument_type)].append(index)
+
+    intervals_by_site_by_request = [{} for _ in request_dicts]
+    for (site_code, instrument_type), indices in requests_by_site.items():
+        site_details = configdb.get_sites_with_instrument_type_and_location(
+            instrument_type=instrument_type, site_code=site_code
+        )
+        if site_code not in site_details:
+            for index in indices:
+                intervals_by_site_by_request[index][site_code] = []
+            continue
+        site_detail = site_details[site_code]
+        configurations = {index: request_dicts[index]['configurations'][0] for index in indices}
+        days_by_request = {
+            index: sorted({day for window in request_dicts[index]['windows'] for day in _get_window_days(window)})
+            for index in indices
+        }
+        cache_keys = {}
+        batch_cache_keys = {}
+        for index in indices:
+            target = configurations[index]['target']
+            constraints = configurations[index]['constraints']
+            for day in days_by_request[index]:
+                cache_keys[(index, day)] = get_rise_set_intervals_cache_key(target, constraints, site_detail, day)
+                batch_cache_keys[(index, day)] = _get_batch_rise_set_intervals_cache_key(
+                    target, constraints, site_detail, day
+                )
+        cached_intervals = cache.get_many(list(cache_keys.values()) + list(batch_cache_keys.values()))
+        intervals_by_request_and_day = {}
+        for request_day in cache_keys:
+            if cache_keys[request_day] in cached_intervals:
+                intervals_by_request_and_day[request_day] = cached_intervals[cache_keys[request_day]]
+            elif batch_cache_keys[request_day] in cached_intervals:
+                intervals_by_request_and_day[request_day] = cached_intervals[batch_cache_keys[request_day]]
+        # Compute each run of consecutive days that are missing for any of the requests, for all of the requests
+        # that are missing days of the run together
+        missing_days = {request_day[1] for request_day in cache_keys if request_day not in intervals_by_request_and_day}
+        computed_intervals = {}
+        for run in _get_consecutive_days(missing_days):
+            run_indices = [
+                index for index in indices
+                if any((index, day) in cache_keys and (index, day) not in intervals_by_request_and_day for day in run)
+            ]
+            intervals_by_target = get_rise_set_intervals_for_targets(
+                [(configurations[index]['target'], configurations[index]['constraints']) for index in run_indices],
+                site_code, _get_utc_day_start(run[0]), _get_utc_day_start(run[-1] + timedelta(days=1)), site_detail
+            )
+            for index, intervals in zip(run_indices, intervals_by_target):
+                for day, day_intervals in _split_intervals_by_day(intervals, run).items():
+                    if (index, day) in cache_keys and (index, day) not in intervals_by_request_and_day:
+                        computed_intervals[(index, day)] = day_intervals
+        if computed_intervals:
+            # cache for 30 days, like the rise_set intervals
+            cache.set_many(
+                {batch_cache_keys[request_day]: intervals for request_day, intervals in computed_intervals.items()},
+                86400 * 30
+            )
+            intervals_by_request_and_day.update(computed_intervals)
+        for index in indices:
+            intervals = []
+            for window in request_dicts[index]['windows']:
+                intervals.extend(_join_intervals_by_day(
+                    {day: intervals_by_request_and_day[(index, day)] for day in _get_window_days(window)},
+                    window['start'], window['end']
+                ))
+            intervals_by_site_by_request[index][site_code] = intervals
+
+    filtered_intervals_by_site_by_request = []
+    for intervals_by_site, telescopes, filtered_intervalsets_by_telescope in zip(
+            intervals_by_site_by_request, telescopes_by_request, filtered_intervalsets_by_request):
+        intervalsets_by_telescope = intervals_by_site_to_intervalsets_by_telescope(intervals_by_site, telescopes)
+        filtered_intervalsets_by_telescope.update(filter_out_downtime_from_intervalsets(intervalsets_by_telescope))
+        filtered_intervals_by_site_by_request.append(
+            intervalsets_by_telescope_to_intervals_by_site(filtered_intervalsets_by_telescope)
+        )
+    return filtered_intervals_by_site_by_request
+
+
 def intervalsets_by_telescope_to_intervals_by_site(intervalsets_by_telescope: dict) -> dict:
     """Convert rise_sets ordered by telescope to rise_set ordered by site. Also convert from intervalset
         to datetime tuple lists per site.
@@ -143,15 +483,18 @@ def filter_out_downtime_from_intervalsets(intervalsets_by_telescope: dict) -> di
     Returns:
         rise_set intervals by telescope with downtimes filtered out
     """
-    downtime_intervals = DowntimeDB.get_downtime_intervals()
+    downtime_store = DowntimeDB.get_downtime_store()
     filtered_intervalsets_by_telescope = {}
-    for telescope in intervalsets_by_telescope.keys():
-        if telescope not in downtime_intervals:
-            filtered_intervalsets_by_telescope[telescope] = intervalsets_by_telescope[telescope]
+    for telescope, intervalset in intervalsets_by_telescope.items():
+        # Only the downtime that overlaps the span of the intervals needs to be subtracted
+        intervals = intervalset.toTupleList()
+        downtime_intervals = []
+        if intervals:
+            downtime_intervals = downtime_store.get_intervals(telescope, intervals[0][0], intervals[-1][1])
+        if not downtime_intervals:
+            filtered_intervalsets_by_telescope[telescope] = intervalset
         else:
-            filtered_intervalsets_by_telescope[telescope] = intervalsets_by_telescope[telescope].subtract(
-                downtime_intervals[telescope]
-            )
+            filtered_intervalsets_by_telescope[telescope] = intervalset.subtract(Intervals(downtime_intervals))
     return filtered_intervalsets_by_telescope
 
 
@@ -177,7 +520,39 @@ def get_proper_motion(target_dict):
     return pm
 
 
+def _get_rise_set_target_key(target_dict):
+    # The extra params are not used to make rise_set targets, and are left out since they are not hashable
+    key = tuple(sorted((field, value) for field, value in target_dict.items() if field != 'extra_params'))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
 def get_rise_set_target(target_dict):
+    """Get the rise_set target of a target.
+
+    rise_set targets are kept in a bounded LRU keyed by the fields of the target, so a target that changes gets a new
+    rise_set target, and the same target is only converted once however many requests or configurations use it. The
+    returned rise_set target is shared, so it must not be modified.
+    """
+    key = _get_rise_set_target_key(target_dict)
+    if key is None:
+        return _make_rise_set_target(target_dict)
+    with _rise_set_targets_lock:
+        if key in _rise_set_targets:
+            _rise_set_targets.move_to_end(key)
+            return _rise_set_targets[key]
+    rise_set_target = _make_rise_set_target(target_dict)
+    with _rise_set_targets_lock:
+        _rise_set_targets[key] = rise_set_target
+        if len(_rise_set_targets) > RISE_SET_TARGET_CACHE_SIZE:
+            _rise_set_targets.popitem(last=False)
+    return rise_set_target
+
+
+def _make_rise_set_target(target_dict):
     # This is a hack to protect against poorly formatted or empty targets that are submitted directly.
     # TODO: Remove this check when target models are updated to handle when there is no target
     if (
@@ -277,36 +652,364 @@ def get_distance_between(rs_target_1: dict, rs_target_2: dict, start_time: datet
     return angular_distance_between(apparent_ra_1, apparent_dec_1, apparent_ra_2, apparent_dec_2)
 
 
-def get_rise_set_site(site_detail):
+@lru_cache(maxsize=RISE_SET_SITE_CACHE_SIZE)
+def _get_rise_set_site(latitude, longitude, horizon, ha_limit_neg, ha_limit_pos):
     return {
-        'latitude': Angle(degrees=site_detail['latitude']),
-        'longitude': Angle(degrees=site_detail['longitude']),
-        'horizon': Angle(degrees=site_detail['horizon']),
-        'ha_limit_neg': Angle(degrees=site_detail['ha_limit_neg'] * HOURS_PER_DEGREES),
-        'ha_limit_pos': Angle(degrees=site_detail['ha_limit_pos'] * HOURS_PER_DEGREES)
+        'latitude': Angle(degrees=latitude),
+        'longitude': Angle(degrees=longitude),
+        'horizon': Angle(degrees=horizon),
+        'ha_limit_neg': Angle(degrees=ha_limit_neg * HOURS_PER_DEGREES),
+        'ha_limit_pos': Angle(degrees=ha_limit_pos * HOURS_PER_DEGREES)
     }
 
 
-def get_rise_set_visibility(rise_set_site, start, end, site_detail):
+def get_rise_set_site(site_detail):
+    """Get the rise_set site of a site. The same site details give back the same, shared, rise_set site."""
+    return _get_rise_set_site(
+        site_detail['latitude'], site_detail['longitude'], site_detail['horizon'], site_detail['ha_limit_neg'],
+        site_detail['ha_limit_pos']
+    )
+
+
+@lru_cache(maxsize=VISIBILITY_CACHE_SIZE)
+def _get_visibility(latitude, longitude, horizon, ha_limit_neg, ha_limit_pos, zenith_blind_spot, twilight, start,
+                    end):
     return Visibility(
-        site=rise_set_site,
+        site=_get_rise_set_site(latitude, longitude, horizon, ha_limit_neg, ha_limit_pos),
         start_date=start,
         end_date=end,
-        horizon=site_detail['horizon'],
-        ha_limit_neg=site_detail['ha_limit_neg'],
-        ha_limit_pos=site_detail['ha_limit_pos'],
-        zenith_blind_spot=site_detail['zenith_blind_spot'],
-        twilight='nautical'
+        horizon=horizon,
+        ha_limit_neg=ha_limit_neg,
+        ha_limit_pos=ha_limit_pos,
+        zenith_blind_spot=zenith_blind_spot,
+        twilight=twilight
+    )
+
+
+def get_rise_set_visibility(start, end, site_detail):
+    """Get the rise_set Visibility of a site over a window of time.
+
+    Visibilities are kept in a bounded LRU keyed by the site details and the window, so the dark and moon intervals a
+    Visibility has already computed are reused by later calls for the same site and window, such as for other
+    requests in the same night. The rise_set site of the Visibility is the shared one for the site details.
+    """
+    return _get_visibility(
+        site_detail['latitude'], site_detail['longitude'], site_detail['horizon'], site_detail['ha_limit_neg'],
+        site_detail['ha_limit_pos'], site_detail['zenith_blind_spot'], 'nautical', start, end
     )
 
 
+def _get_site_detail_version(site_detail: dict) -> str:
+    return hashlib.md5(json.dumps(site_detail, sort_keys=True).encode()).hexdigest()
+
+
+def _get_utc_day_start(day):
+    return datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+
+
+def get_site_dark_intervals_by_day(site_code: str, first_day, last_day, site_detail: dict = None) -> dict:
+    """Get the dark intervals of a site for each UTC day in a range of days.
+
+    The dark intervals of each day are kept in a table in the cache, keyed by site, the version of the site details
+    and the day, so that looking up the nights of a site only reads from the table. Days missing from the table are
+    computed in one go and added to it.
+
+    Parameters:
+        site_code: Site for which to get the dark intervals
+        first_day: First UTC date of the range
+        last_day: Last UTC date of the range, included in the range
+        site_detail: Location details of the site, retrieved from ConfigDB if not given
+    Returns:
+        Dictionary of UTC date to the list of dark intervals clipped to that day, empty if the site does not exist
+    """
+    if site_detail is None:
+        site_details = configdb.get_sites_with_instrument_type_and_location(site_code=site_code)
+        if site_code not in site_details:
+            return {}
+        site_detail = site_details[site_code]
+    version = _get_site_detail_version(site_detail)
+    days = [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+    cache_keys = {day: 'dark_intervals.{}.{}.{}'.format(site_code, version, day.isoformat()) for day in days}
+    cached_intervals = cache.get_many(list(cache_keys.values()))
+    intervals_by_day = {
+        day: cached_intervals[cache_key] for day, cache_key in cache_keys.items() if cache_key in cached_intervals
+    }
+    missing_days = [day for day in days if day not in intervals_by_day]
+    if missing_days:
+        # Compute all the missing days with a single visibility, then split its dark intervals up by day
+        visibility = get_rise_set_visibility(
+            _get_utc_day_start(missing_days[0]), _get_utc_day_start(missing_days[-1] + timedelta(days=1)), site_detail
+        )
+        computed_intervals = _split_intervals_by_day(visibility.get_dark_intervals(), missing_days)
+        cache.set_many(
+            {cache_keys[day]: intervals for day, intervals in computed_intervals.items()}, SITE_DARK_INTERVALS_TIMEOUT
+        )
+        intervals_by_day.update(computed_intervals)
+    return intervals_by_day
+
+
 def get_site_rise_set_intervals(start, end, site_code):
-    site_details = configdb.get_sites_with_instrument_type_and_location(site_code=site_code)
-    if site_code in site_details:
+    intervals_by_day = get_site_dark_intervals_by_day(site_code, start.date(), end.date())
+    return _join_intervals_by_day(intervals_by_day, start, end)
+
+
+def precompute_site_dark_intervals(first_day, last_day):
+    """Fill in the table of dark intervals of every site for a range of UTC days."""
+    for site_code, site_detail in configdb.get_sites_with_instrument_type_and_location().items():
+        get_site_dark_intervals_by_day(site_code, first_day, last_day, site_detail)
+
+
+def _get_intervals_from_mask(mask, times: list) -> list:
+    """Convert a boolean mask over a grid of times to the list of intervals during which the mask is set.
+
+    Where the mask changes between two times of the grid, the edge of the interval is put halfway between them.
+    """
+    edges = np.flatnonzero(np.diff(np.concatenate(([False], mask, [False])).astype(np.int8)))
+    intervals = []
+    for first, last in zip(edges[::2], edges[1::2] - 1):
+        start = times[first] if first == 0 else times[first - 1] + (times[first] - times[first - 1]) / 2
+        end = times[last] if last == len(times) - 1 else times[last] + (times[last + 1] - times[last]) / 2
+        if start < end:
+            intervals.append((start, end))
+    return intervals
+
+
+def get_rise_set_intervals_for_targets(targets: list, site_code: str, start, end, site_detail: dict = None) -> list:
+    """Get the observable intervals of many targets at a site within a window of time.
+
+    The dark intervals of the site come from the table of dark intervals, and the sidereal time and the position of
+    the moon are computed once per night for all the targets. The constraints of the ICRS targets are then evaluated
+    together as arrays over a grid of times BATCH_TIME_RESOLUTION apart, so the edges of their intervals are only as
+    precise as the grid. Other types of targets are computed one at a time with rise_set.
+
+    Parameters:
+        targets: List of (target, constraints) tuples
+        site_code: Site for which to get the intervals
+        start: Start of the window
+        end: End of the window
+        site_detail: Location details of the site, retrieved from ConfigDB if not given
+    Returns:
+        List of the observable intervals of each target, in the same order as the targets
+    """
+    if site_detail is None:
+        site_details = configdb.get_sites_with_instrument_type_and_location(site_code=site_code)
+        if site_code not in site_details:
+            return [[] for _ in targets]
         site_detail = site_details[site_code]
-        rise_set_site = get_rise_set_site(site_detail)
-        v = get_rise_set_visibility(rise_set_site, start, end, site_detail)
+    rise_set_site = get_rise_set_site(site_detail)
+    rise_set_targets = [get_rise_set_target(target) for target, _ in targets]
+    intervals_by_target = [[] for _ in targets]
+    batched = []
+    for index, ((target, constraints), rise_set_target) in enumerate(zip(targets, rise_set_targets)):
+        if is_sidereal_target(rise_set_target):
+            batched.append(index)
+            continue
+        visibility = get_rise_set_visibility(start, end, site_detail)
+        try:
+            intervals_by_target[index] = visibility.get_observable_intervals(
+                rise_set_target,
+                airmass=constraints['max_airmass'],
+                moon_distance=Angle(degrees=constraints['min_lunar_distance'])
+            )
+        except MovingViolation:
+            pass
+    if not batched:
+        return intervals_by_target
+
+    # The apparent positions of the targets barely move within the window, so they are computed once at its middle
+    tdb = date_to_tdb(start + (end - start) / 2)
+    apparent_positions = [mean_to_apparent(rise_set_targets[index], tdb) for index in batched]
+    ra = np.array([ra.in_radians() for ra, _ in apparent_positions])[:, np.newaxis]
+    dec = np.array([dec.in_radians() for _, dec in apparent_positions])[:, np.newaxis]
+    min_altitude = np.array([
+        set_airmass_limit(targets[index][1]['max_airmass'], site_detail['horizon']) for index in batched
+    ])[:, np.newaxis]
+    min_moon_distance = np.array([targets[index][1]['min_lunar_distance'] for index in batched])[:, np.newaxis]
+    # The hour angle limits are flipped for sites in the southern hemisphere, as rise_set does
+    ha_limit_neg, ha_limit_pos = site_detail['ha_limit_neg'], site_detail['ha_limit_pos']
+    if site_detail['latitude'] < 0:
+        ha_limit_neg, ha_limit_pos = -site_detail['ha_limit_pos'], -site_detail['ha_limit_neg']
+    latitude = radians(site_detail['latitude'])
+    longitude = radians(site_detail['longitude'])
+
+    dark_intervals = _join_intervals_by_day(
+        get_site_dark_intervals_by_day(site_code, start.date(), end.date(), site_detail), start, end
+    )
+    step = BATCH_TIME_RESOLUTION.total_seconds()
+    for night_start, night_end in dark_intervals:
+        duration = (night_end - night_start).total_seconds()
+        offsets = np.append(np.arange(0, duration, step), duration)
+        times = [night_start + timedelta(seconds=offset) for offset in offsets]
+        sidereal_time = (
+            calc_apparent_sidereal_time(night_start).in_radians() + longitude
+            + offsets * 2 * np.pi * SIDEREAL_SOLAR_DAY_RATIO / 86400
+        )
+        hour_angle = np.mod(sidereal_time - ra + np.pi, 2 * np.pi) - np.pi
+        altitude = np.degrees(np.arcsin(np.clip(
+            np.sin(latitude) * np.sin(dec) + np.cos(latitude) * np.cos(dec) * np.cos(hour_angle), -1, 1
+        )))
+        observable = altitude >= min_altitude
+        hour_angle_hours = np.degrees(hour_angle) / HOURS_PER_DEGREES
+        observable &= (hour_angle_hours >= ha_limit_neg) & (hour_angle_hours <= ha_limit_pos)
+        if site_detail['zenith_blind_spot'] > 0:
+            observable &= 90 - altitude >= site_detail['zenith_blind_spot']
+        # The moon is checked at the start of each chunk of the night, as rise_set does
+        chunks = (offsets // MOON_DISTANCE_CHUNK.total_seconds()).astype(int)
+        moon_positions = [
+            apparent_planet_pos('moon', date_to_tdb(night_start + chunk * MOON_DISTANCE_CHUNK), rise_set_site)
+            for chunk in range(chunks[-1] + 1)
+        ]
+        moon_ra = np.array([moon_ra.in_radians() for moon_ra, _, _ in moon_positions])[chunks]
+        moon_dec = np.array([moon_dec.in_radians() for _, moon_dec, _ in moon_positions])[chunks]
+        moon_distance = np.degrees(np.arccos(np.clip(
+            np.sin(dec) * np.sin(moon_dec) + np.cos(dec) * np.cos(moon_dec) * np.cos(ra - moon_ra), -1, 1
+        )))
+        observable &= (moon_distance >= min_moon_distance) | (min_moon_distance <= 0.5)
+        for row, index in enumerate(batched):
+            intervals_by_target[index].extend(_get_intervals_from_mask(observable[row], times))
+    return intervals_by_target
+
+
+def _get_airmass_times(intervals: list, resolution: timedelta):
+    """Get the times every resolution from the start of each interval, as an array of naive UTC times."""
+    step = np.timedelta64(int(resolution.total_seconds()), 's')
+    times = [
+        np.arange(
+            np.datetime64(timezone.make_naive(start, timezone.utc) if timezone.is_aware(start) else start, 'us'),
+            np.datetime64(timezone.make_naive(end, timezone.utc) if timezone.is_aware(end) else end, 'us'),
+            step
+        ) for start, end in intervals
+    ]
+    return np.concatenate(times) if times else np.array([], dtype='datetime64[us]')
+
+
+def _get_bounded_airmass_resolution(intervals_by_site: dict, resolution: timedelta, max_points: int) -> timedelta:
+    """Coarsen the resolution so that no site has more than AIRMASS_OVERSAMPLING times max_points times."""
+    longest_duration = max(
+        [sum((end - start).total_seconds() for start, end in intervals) for intervals in intervals_by_site.values()],
+        default=0
+    )
+    minimum_seconds = longest_duration / (max_points * AIRMASS_OVERSAMPLING)
+    if minimum_seconds <= resolution.total_seconds():
+        return resolution
+    # Keep to whole minutes so that the times still line up with the minutes they are formatted to
+    return timedelta(minutes=int(np.ceil(minimum_seconds / 60)))
+
+
+def _downsample_keeping_minima(times, airmasses, max_points: int):
+    """Downsample to at most max_points, keeping the time with the lowest airmass in each of max_points buckets."""
+    if len(times) <= max_points:
+        return times, airmasses
+    buckets = np.arange(len(times)) * max_points // len(times)
+    order = np.lexsort((airmasses, buckets))
+    keep = np.sort(order[np.concatenate(([0], np.flatnonzero(np.diff(buckets[order])) + 1))])
+    return times[keep], airmasses[keep]
+
 
-        return v.get_dark_intervals()
+def _airmass_from_zenith_distance(zenith_distance):
+    # The same interpolation formula as slalib's sla_airmas, which rise_set uses
+    seczm1 = 1.0 / np.cos(np.minimum(1.52, np.abs(zenith_distance))) - 1.0
+    return 1.0 + seczm1 * (0.9981833 - seczm1 * (0.002875 + 0.0008083 * seczm1))
 
-    return []
+
+def _calculate_sidereal_airmasses(rise_set_target: dict, times_by_site: dict, site_details: dict) -> dict:
+    """Calculate the airmasses of a sidereal target at the times of all the sites at once.
+
+    The apparent position of the target is computed once at the middle of all the times, and the sidereal time is
+    extrapolated from the start of all the times, so all the sites are evaluated together as a single array.
+    Atmospheric refraction is not included.
+    """
+    all_times = np.concatenate(list(times_by_site.values()))
+    first_time, last_time = all_times.min(), all_times.max()
+    first_datetime = first_time.astype(datetime).replace(tzinfo=timezone.utc)
+    middle_datetime = first_datetime + (last_time - first_time).astype(timedelta) / 2
+    ra, dec = mean_to_apparent(rise_set_target, date_to_tdb(middle_datetime))
+    latitude = np.concatenate([
+        np.full(len(times), radians(site_details[site]['latitude'])) for site, times in times_by_site.items()
+    ])
+    longitude = np.concatenate([
+        np.full(len(times), radians(site_details[site]['longitude'])) for site, times in times_by_site.items()
+    ])
+    offsets = (all_times - first_time) / np.timedelta64(1, 's')
+    sidereal_time = (
+        calc_apparent_sidereal_time(first_datetime).in_radians() + longitude
+        + offsets * 2 * np.pi * SIDEREAL_SOLAR_DAY_RATIO / 86400
+    )
+    hour_angle = sidereal_time - ra.in_radians()
+    zenith_distance = np.arccos(np.clip(
+        np.sin(latitude) * np.sin(dec.in_radians())
+        + np.cos(latitude) * np.cos(dec.in_radians()) * np.cos(hour_angle), -1, 1
+    ))
+    airmasses = _airmass_from_zenith_distance(zenith_distance)
+    airmasses_by_site = {}
+    index = 0
+    for site, times in times_by_site.items():
+        airmasses_by_site[site] = airmasses[index:index + len(times)].tolist()
+        index += len(times)
+    return airmasses_by_site
+
+
+def get_airmasses_by_site(target: dict, intervals_by_site: dict, site_details: dict,
+                          resolution: timedelta = AIRMASS_TIME_RESOLUTION, max_points: int = None,
+                          compact: bool = False) -> dict:
+    """Get the airmass of a target every resolution within its intervals at each site.
+
+    The airmasses are cached by a hash of the target, the site details, the intervals and the resolution. The
+    airmasses of sidereal targets are calculated for all the sites together as arrays, those of other targets with
+    rise_set for each site. When max_points is given, the resolution is coarsened so that long windows only cost a
+    bounded number of calculations, and each site is downsampled to max_points keeping the lowest airmasses.
+
+    Parameters:
+        target: The target for which to get the airmasses
+        intervals_by_site: The intervals by site within which to get the airmasses
+        site_details: Location details of the sites, by site
+        resolution: Time between the airmasses
+        max_points: Maximum number of airmasses returned for each site, if given
+        compact: Return the times in seconds since the epoch rather than formatted to the minute
+    Returns:
+        Dictionary of site to the 'times' and 'airmasses' at those times, for each site with at least one time
+    """
+    if max_points:
+        resolution = _get_bounded_airmass_resolution(intervals_by_site, resolution, max_points)
+    content = json.dumps({
+        'target': {field: value for field, value in target.items() if value is not None},
+        'sites': {site: site_details[site] for site in intervals_by_site},
+        'intervals': intervals_by_site,
+        'resolution': resolution.total_seconds()
+    }, sort_keys=True, default=str)
+    cache_key = 'airmasses.{}'.format(hashlib.sha1(content.encode()).hexdigest())
+    airmasses_by_site = cache.get(cache_key)
+    if airmasses_by_site is None:
+        times_by_site = {}
+        for site, intervals in intervals_by_site.items():
+            times = _get_airmass_times(intervals, resolution)
+            if len(times) > 0:
+                times_by_site[site] = times
+        rise_set_target = get_rise_set_target(target)
+        if not times_by_site:
+            airmasses = {}
+        elif is_sidereal_target(rise_set_target):
+            airmasses = _calculate_sidereal_airmasses(rise_set_target, times_by_site, site_details)
+        else:
+            airmasses = {
+                site: calculate_airmass_at_times(
+                    times.astype(datetime).tolist(), rise_set_target, Angle(degrees=site_details[site]['latitude']),
+                    Angle(degrees=site_details[site]['longitude']), site_details[site]['altitude']
+                ) for site, times in times_by_site.items()
+            }
+        airmasses_by_site = {
+            site: {'times': times.astype('datetime64[s]').astype(np.int64).tolist(), 'airmasses': airmasses[site]}
+            for site, times in times_by_site.items()
+        }
+        cache.set(cache_key, airmasses_by_site, 86400 * 30)  # cache for 30 days, like the rise_set intervals
+
+    formatted_airmasses_by_site = {}
+    for site, site_airmasses in airmasses_by_site.items():
+        times = np.array(site_airmasses['times'], dtype=np.int64)
+        airmasses = np.array(site_airmasses['airmasses'])
+        if max_points:
+            times, airmasses = _downsample_keeping_minima(times, airmasses, max_points)
+        if not compact:
+            times = np.datetime_as_string(times.astype('datetime64[s]'), unit='m')
+        formatted_airmasses_by_site[site] = {'times': times.tolist(), 'airmasses': airmasses.tolist()}
+    return formatted_airmasses_by_site
@@ -1,8 +1,10 @@
 from django.conf import settings
 from elasticsearch import Elasticsearch
 from elasticsearch.exceptions import ConnectionError
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 from django.utils import timezone
+from django.core.cache import cache
 from copy import deepcopy
 from collections import OrderedDict
 from urllib3.exceptions import LocationValueError
@@ -16,6 +18,11 @@ from observation_portal.common.rise_set_utils import get_site_rise_set_intervals
 logger = logging.getLogger(__name__)
 
 ES_STRING_FORMATTER = "%Y-%m-%d %H:%M:%S"
+# Number of datums read from ElasticSearch in each scroll page
+ES_QUERY_SIZE = 10000
+# Time after the end of a UTC day after which its telescope states are taken to be final, and are cached
+TELESCOPE_STATES_SETTLE_TIME = timedelta(hours=1)
+TELESCOPE_STATES_TIMEOUT = 86400 * 400  # seconds
 
 
 class ElasticSearchException(Exception):
@@ -52,7 +59,8 @@ class TelescopeStates(object):
 
         self.start = start.replace(tzinfo=timezone.utc).replace(microsecond=0)
         self.end = end.replace(tzinfo=timezone.utc).replace(microsecond=0)
-        self.event_data = self._get_es_data(sites, telescopes)
+        self.sites = sites
+        self.telescopes = telescopes
 
     def _get_available_telescopes(self, location_dict=None):
         telescope_to_instruments = configdb.get_instrument_types_per_telescope(location=location_dict,
@@ -64,8 +72,13 @@ class TelescopeStates(object):
                                     any(inst in insts for inst in self.instrument_types)]
         return available_telescopes
 
-    def _get_es_data(self, sites, telescopes):
-        lower_query_time = min(self.start, timezone.now())
+    def _get_es_data(self, sites, telescopes, start, end):
+        """Generate the telescope state datums between start and end, sorted by telescope then by time.
+
+        The datums are read one scroll page at a time, so that only one page is held in memory however long the
+        queried range is.
+        """
+        lower_query_time = min(start, timezone.now())
         datum_query = {
             "query": {
                 "bool": {
@@ -80,7 +93,7 @@ class TelescopeStates(object):
                                 "timestamp": {
                                     # Retrieve documents 1 day back to ensure you get at least one datum per telescope.
                                     "gte": (lower_query_time - timedelta(days=1)).strftime(ES_STRING_FORMATTER),
-                                    "lte": self.end.strftime(ES_STRING_FORMATTER),
+                                    "lte": end.strftime(ES_STRING_FORMATTER),
                                     "format": "yyyy-MM-dd HH:mm:ss"
                                 }
                             }
@@ -99,38 +112,116 @@ class TelescopeStates(object):
                 }
             }
         }
-        event_data = []
-        query_size = 10000
-
         try:
             data = self.es.search(
-                index="mysql-telemetry-*", body=datum_query, size=query_size, scroll='1m',  # noqa
+                index="mysql-telemetry-*", body=datum_query, size=ES_QUERY_SIZE, scroll='1m',  # noqa
                 _source=['timestamp', 'telescope', 'observatory', 'site', 'value_string'],
                 sort=['site', 'observatory', 'telescope', 'timestamp']
             )
         except ConnectionError:
             raise ElasticSearchException
 
-        event_data.extend(data['hits']['hits'])
         total_events = data['hits']['total']
-        events_read = min(query_size, total_events)
         scroll_id = data.get('_scroll_id', 0)
-        while events_read < total_events:
-            data = self.es.scroll(scroll_id=scroll_id, scroll='1m') # noqa
-            scroll_id = data.get('_scroll_id', 0)
-            event_data.extend(data['hits']['hits'])
-            events_read += len(data['hits']['hits'])
-        return event_data
+        try:
+            yield from data['hits']['hits']
+            events_read = min(ES_QUERY_SIZE, total_events)
+            while events_read < total_events and data['hits']['hits']:
+                try:
+                    data = self.es.scroll(scroll_id=scroll_id, scroll='1m') # noqa
+                except ConnectionError:
+                    raise ElasticSearchException
+                scroll_id = data.get('_scroll_id', 0)
+                yield from data['hits']['hits']
+                events_read += len(data['hits']['hits'])
+        finally:
+            if scroll_id:
+                try:
+                    self.es.clear_scroll(scroll_id=scroll_id)
+                except ConnectionError:
+                    # The scroll expires on its own
+                    pass
 
     def get(self):
+        """Get the lumps of consecutive equal states of each telescope between start and end.
+
+        The lumps of each telescope are kept in the cache for each UTC day that ended at least
+        TELESCOPE_STATES_SETTLE_TIME ago, since the states of those days no longer change. Only the run of days that
+        are not in the cache is computed from ElasticSearch, so polling a recent range only queries the current day.
+        """
+        telescope_keys = [
+            tk for tk in self.available_telescopes if tk.site in self.sites and tk.telescope in self.telescopes
+        ]
+        first_day = self.start.date()
+        last_day = max(first_day, (self.end - timedelta(microseconds=1)).date())
+        days = [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+        cache_keys = {
+            (tk, day): 'telescope_states.{}.{}'.format(tk, day.isoformat()) for tk in telescope_keys for day in days
+        }
+        cached_lumps = cache.get_many(list(cache_keys.values()))
+        lumps_by_telescope_and_day = {
+            tk_day: cached_lumps[cache_key] for tk_day, cache_key in cache_keys.items() if cache_key in cached_lumps
+        }
+        missing_days = sorted({day for tk, day in cache_keys if (tk, day) not in lumps_by_telescope_and_day})
+        if missing_days:
+            # Compute all the days from the first to the last missing day with a single query
+            computed_start = _day_start(missing_days[0])
+            computed_end = _day_start(missing_days[-1] + timedelta(days=1))
+            computed_states = self._get_lumps_by_site(computed_start, computed_end)
+            computed_days = [day for day in days if missing_days[0] <= day <= missing_days[-1]]
+            computed_lumps = {}
+            for tk in telescope_keys:
+                for day in computed_days:
+                    computed_lumps[(tk, day)] = _clip_lumps(
+                        computed_states.get(tk, []), _day_start(day), _day_start(day + timedelta(days=1))
+                    )
+            settled_before = timezone.now() - TELESCOPE_STATES_SETTLE_TIME
+            cache.set_many({
+                cache_keys[(tk, day)]: lumps for (tk, day), lumps in computed_lumps.items()
+                if _day_start(day + timedelta(days=1)) <= settled_before
+            }, TELESCOPE_STATES_TIMEOUT)
+            lumps_by_telescope_and_day.update(computed_lumps)
+
+        telescope_states = {}
+        for tk in telescope_keys:
+            lumps = []
+            for day in days:
+                for lump in _clip_lumps(lumps_by_telescope_and_day[(tk, day)], self.start, self.end):
+                    if (lumps and lumps[-1]['end'] == lump['start'] and lumps[-1]['event_type'] == lump['event_type']
+                            and lumps[-1]['event_reason'] == lump['event_reason']):
+                        # Join up the parts of a lump that spans more than one day
+                        lumps[-1]['end'] = lump['end']
+                    else:
+                        lumps.append(lump)
+            if lumps:
+                telescope_states[tk] = lumps
+        return telescope_states
+
+    def _get_lumps_by_site(self, start, end):
+        """Get the lumps of all the sites, querying each site concurrently if a thread pool is configured.
+
+        The datums of different sites never share a lump, so the lumps of each site are built up separately and the
+        results merged, and the time taken is that of the slowest site rather than of all the sites together.
+        """
+        workers = min(settings.TELESCOPE_STATES_QUERY_THREADS, len(self.sites))
+        if workers <= 1:
+            return self._get_lumps(self.sites, start, end)
+        telescope_states = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for site_telescope_states in executor.map(lambda site: self._get_lumps([site], start, end), self.sites):
+                telescope_states.update(site_telescope_states)
+        return telescope_states
+
+    def _get_lumps(self, sites, start, end):
         telescope_states = {}
         current_lump = {'telescope': None}
 
-        for event in self.event_data:
+        # The lumps are built up as the datums are read, so the datums themselves are never all held in memory
+        for event in self._get_es_data(sites, self.telescopes, start, end):
             telcode = self._telescope(event['_source'])
             if telcode not in self.available_telescopes:
                 if current_lump['telescope']:
-                    self._save_lump(telescope_states, current_lump, self.end)
+                    self._save_lump(telescope_states, current_lump, start, end, end)
                     current_lump = {'telescope': None}
                 continue
 
@@ -138,31 +229,34 @@ class TelescopeStates(object):
             event_type, event_reason = self._categorize(event['_source'])
 
             if current_lump['telescope'] and telcode != current_lump['telescope']:
-                telescope_states = self._save_lump(telescope_states, current_lump, self.end)
+                telescope_states = self._save_lump(telescope_states, current_lump, start, end, end)
                 current_lump = self._create_lump(telcode, event_type, event_reason, event_start)
-            elif event_start > self.end:
+            elif event_start > end:
                 if current_lump['telescope']:
-                    telescope_states = self._save_lump(telescope_states, current_lump, self.end)
+                    telescope_states = self._save_lump(telescope_states, current_lump, start, end, end)
                     current_lump = {'telescope': None}
-            elif event_start < self.start:
+            elif event_start < start:
                 current_lump = self._create_lump(telcode, event_type, event_reason, event_start)
             else:
                 if current_lump['telescope']:
                     if event_type != current_lump['event_type'] or event_reason != current_lump['event_reason']:
-                        telescope_states = self._save_lump(telescope_states, current_lump, min(self.end, event_start))
+                        telescope_states = self._save_lump(
+                            telescope_states, current_lump, start, end, min(end, event_start)
+                        )
                         current_lump = self._create_lump(telcode, event_type, event_reason, event_start)
                 else:
                     current_lump = self._create_lump(telcode, event_type, event_reason, event_start)
 
         if current_lump['telescope']:
             # We have a final current lump we were in, so save it
-            self._save_lump(telescope_states, current_lump, self.end)
+            self._save_lump(telescope_states, current_lump, start, end, end)
 
         return telescope_states
 
-    def _save_lump(self, telescope_states, lump, end):
-        lump['end'] = min(self.end, end)
-        lump['start'] = max(self.start, lump['start'])
+    @staticmethod
+    def _save_lump(telescope_states, lump, start, end, lump_end):
+        lump['end'] = min(end, lump_end)
+        lump['start'] = max(start, lump['start'])
         telkey = lump['telescope']
         lump['telescope'] = str(lump['telescope'])
         if telkey not in telescope_states:
@@ -203,6 +297,21 @@ class TelescopeStates(object):
         )
 
 
+def _day_start(day):
+    return timezone.datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+
+
+def _clip_lumps(lumps, start, end):
+    """Get copies of the lumps clipped to between start and end, leaving out the lumps outside of them."""
+    clipped_lumps = []
+    for lump in lumps:
+        lump_start = max(lump['start'], start)
+        lump_end = min(lump['end'], end)
+        if lump_start < lump_end:
+            clipped_lumps.append(dict(lump, start=lump_start, end=lump_end))
+    return clipped_lumps
+
+
 def filter_telescope_states_by_intervals(telescope_states, sites_intervals, start, end):
     filtered_states = {}
     for telescope_key, events in telescope_states.items():
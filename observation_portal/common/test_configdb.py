@@ -0,0 +1,447 @@
+from django.test import TestCase, override_settings
+from django.core.cache import caches
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest.mock import patch
+import os
+import tempfile
+import threading
+import time
+import copy
+import json
+import responses
+
+from observation_portal.common.configdb import (
+    configdb, configdb_changed, ConfigDB, ConfigDBSnapshot, ConfigDBException, TelescopeKey
+)
+from observation_portal.common.fields import LazyChoiceField
+from observation_portal.observations.filters import ObservationFilter
+from observation_portal.observations.models import Observation
+from observation_portal.test_runner import CONFIGDB_TEST_FILE
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        'LOCATION': 'unique-snowflake'
+    },
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'test-configdb-cache'
+    }
+}
+
+
+def get_test_site_data():
+    with open(CONFIGDB_TEST_FILE) as input_file:
+        return json.loads(input_file.read())['results']
+
+
+class TestConfigDBSnapshot(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.snapshot = ConfigDBSnapshot(get_test_site_data(), 'abc')
+
+    def test_snapshot_indexes_instruments_by_type(self):
+        instrument_codes = [i['code'] for i in self.snapshot.get_instruments_of_type('1m0-scicam-sbig')]
+        self.assertEqual(instrument_codes, ['xx01', 'xx06', 'xx08', 'xx03', 'xx11'])
+        self.assertEqual(self.snapshot.get_instruments_of_type('NOT-AN-INSTRUMENT'), [])
+
+    def test_snapshot_indexes_instruments_by_code(self):
+        instruments = self.snapshot.get_instruments_with_code('XX03')
+        self.assertEqual(len(instruments), 1)
+        self.assertEqual(instruments[0]['telescope_key'], TelescopeKey('tst', 'domb', '1m0a'))
+        self.assertEqual(instruments[0]['telescope_name'], '1 meter')
+
+    def test_snapshot_indexes_instruments_by_telescope(self):
+        telescope_key = self.snapshot.get_telescope_key('TST', 'DOMB', '1M0A')
+        self.assertEqual(telescope_key, TelescopeKey('tst', 'domb', '1m0a'))
+        instrument_codes = {i['code'] for i in self.snapshot.instruments_by_telescope[telescope_key]}
+        self.assertEqual(instrument_codes, {'xx03', 'nres02'})
+
+    def test_snapshot_missing_keys_are_not_added(self):
+        self.snapshot.instruments_by_type.get('NOT-AN-INSTRUMENT', [])
+        self.assertIsNone(self.snapshot.get_telescope_key('abc', 'doma', '1m0a'))
+        self.assertNotIn('NOT-AN-INSTRUMENT', self.snapshot.instruments_by_type)
+
+    def test_snapshot_of_empty_data(self):
+        snapshot = ConfigDBSnapshot({})
+        self.assertEqual(snapshot.instruments, [])
+        self.assertEqual(snapshot.sites, {})
+
+
+class TestConfigDBSnapshotDiff(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.snapshot = ConfigDBSnapshot(get_test_site_data())
+        self.site_data = get_test_site_data()
+        self.telescope = self.site_data[0]['enclosure_set'][0]['telescope_set'][0]
+
+    def test_no_changes(self):
+        diff = ConfigDBSnapshot(self.site_data).diff(self.snapshot)
+        self.assertFalse(diff)
+        self.assertEqual(diff.sites, set())
+
+    def test_instrument_state_change(self):
+        self.telescope['instrument_set'][0]['state'] = 'DISABLED'
+        diff = ConfigDBSnapshot(self.site_data).diff(self.snapshot)
+        self.assertEqual(diff.instrument_types, {'1M0-SCICAM-SBIG'})
+        self.assertEqual(diff.telescopes, set())
+        self.assertEqual(diff.overheads, set())
+        self.assertEqual(diff.sites, {'tst'})
+
+    def test_overhead_change(self):
+        self.telescope['instrument_set'][0]['science_camera']['camera_type']['fixed_overhead_per_exposure'] += 1
+        diff = ConfigDBSnapshot(self.site_data).diff(self.snapshot)
+        self.assertEqual(diff.overheads, {'1M0-SCICAM-SBIG'})
+        self.assertEqual(diff.instrument_types, set())
+
+    def test_telescope_change(self):
+        self.telescope['horizon'] += 5
+        diff = ConfigDBSnapshot(self.site_data).diff(self.snapshot)
+        self.assertEqual(diff.telescopes, {TelescopeKey('tst', 'doma', '1m0a')})
+        self.assertEqual(diff.instrument_types, {'1M0-SCICAM-SBIG'})
+        self.assertEqual(diff.overheads, {'1M0-SCICAM-SBIG'})
+
+    def test_removed_telescope(self):
+        self.site_data[0]['enclosure_set'][0]['telescope_set'].pop(1)
+        diff = ConfigDBSnapshot(self.site_data).diff(self.snapshot)
+        self.assertEqual(diff.telescopes, {TelescopeKey('tst', 'doma', '2m0a')})
+        self.assertEqual(diff.instrument_types, {'2M0-FLOYDS-SCICAM'})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TestConfigDBSnapshotRefresh(TestCase):
+    def setUp(self):
+        super().setUp()
+        caches['locmem'].clear()
+
+    def test_snapshot_is_reused_while_data_version_is_unchanged(self):
+        configdb = ConfigDB()
+        snapshot = configdb.get_snapshot()
+        self.assertIsNotNone(snapshot.version)
+        self.assertIs(configdb.get_snapshot(), snapshot)
+
+    def test_snapshot_is_rebuilt_when_data_version_changes(self):
+        configdb = ConfigDB()
+        snapshot = configdb.get_snapshot()
+        caches['locmem'].set('sites.version', 'new-version')
+        new_snapshot = configdb.get_snapshot()
+        self.assertIsNot(new_snapshot, snapshot)
+        self.assertEqual(new_snapshot.version, 'new-version')
+
+    def test_lookups_match_configdb_data(self):
+        configdb = ConfigDB()
+        self.assertTrue(configdb.is_valid_instrument_type('1m0-scicam-sbig'))
+        self.assertFalse(configdb.is_valid_instrument('xx06'))
+        self.assertEqual(configdb.get_guider_for_instrument_name('XX03'), 'ef03')
+        self.assertEqual(configdb.get_instrument_names('1M0-SCICAM-SBIG', 'tst', 'doma', '1m0a'), {'xx01', 'xx08'})
+        self.assertEqual(
+            configdb.get_telescopes_per_instrument_type('1M0-SCICAM-SBIG', only_schedulable=True),
+            {TelescopeKey('tst', 'doma', '1m0a'), TelescopeKey('tst', 'domb', '1m0a')}
+        )
+
+    def test_overheads_are_memoized_per_snapshot(self):
+        configdb = ConfigDB()
+        request_overheads = configdb.get_request_overheads('1M0-SCICAM-SBIG')
+        self.assertIs(configdb.get_request_overheads('1m0-scicam-sbig'), request_overheads)
+        with patch.object(ConfigDB, '_get_exposure_overhead', return_value=10.0) as mock_exposure_overhead:
+            configdb.get_exposure_overhead('1M0-SCICAM-SBIG', 1, '')
+            configdb.get_exposure_overhead('1M0-SCICAM-SBIG', 1, '')
+            self.assertEqual(mock_exposure_overhead.call_count, 1)
+            configdb.get_exposure_overhead('1M0-SCICAM-SBIG', 2, '')
+            self.assertEqual(mock_exposure_overhead.call_count, 2)
+
+    def test_instrument_types_at_location(self):
+        configdb = ConfigDB()
+        self.assertEqual(
+            configdb.get_instrument_types({'site': 'tst', 'enclosure': 'domb', 'telescope': '1m0a'}),
+            {'1M0-SCICAM-SBIG', '1M0-NRES-SCICAM'}
+        )
+        self.assertEqual(configdb.get_instrument_types({'telescope_class': '2m0'}), {'2M0-FLOYDS-SCICAM'})
+        self.assertEqual(configdb.get_instrument_types({'site': 'abc'}), set())
+
+    def test_instrument_types_are_memoized_per_location(self):
+        configdb = ConfigDB()
+        snapshot = configdb.get_snapshot()
+        with patch.object(ConfigDBSnapshot, 'get_instrument_locations',
+                          wraps=snapshot.get_instrument_locations) as mock_instrument_locations:
+            instrument_types = configdb.get_instrument_types({'site': 'TST'}, only_schedulable=True)
+            instrument_types.add('NOT-AN-INSTRUMENT')
+            self.assertNotIn('NOT-AN-INSTRUMENT', configdb.get_instrument_types({'site': 'tst'}, only_schedulable=True))
+            self.assertEqual(mock_instrument_locations.call_count, 1)
+            configdb.get_instrument_types({'site': 'tst'})
+            self.assertEqual(mock_instrument_locations.call_count, 2)
+
+    def test_instrument_types_per_telescope_are_memoized(self):
+        configdb = ConfigDB()
+        telescope_key = TelescopeKey('tst', 'domb', '1m0a')
+        instrument_types = configdb.get_instrument_types_per_telescope({'enclosure': 'domb'})
+        instrument_types[telescope_key].append('NOT-AN-INSTRUMENT')
+        with patch.object(ConfigDBSnapshot, 'get_instrument_locations') as mock_instrument_locations:
+            self.assertEqual(
+                set(configdb.get_instrument_types_per_telescope({'enclosure': 'domb'})[telescope_key]),
+                {'1M0-SCICAM-SBIG', '1M0-NRES-SCICAM'}
+            )
+            self.assertFalse(mock_instrument_locations.called)
+
+    def test_active_instrument_index(self):
+        configdb = ConfigDB()
+        instrument_index = configdb.get_active_instrument_index()
+        telescope_instruments = instrument_index['telescopes'][TelescopeKey('tst', 'doma', '1m0a')]
+        self.assertEqual(telescope_instruments['types'], {'1m0-scicam-sbig'})
+        self.assertNotIn('xx06', telescope_instruments['names'])
+        self.assertEqual(telescope_instruments['names_by_type']['1m0-scicam-sbig'], {'xx01', 'xx08'})
+        self.assertEqual(instrument_index['guiders']['xx03']['default'], 'ef03')
+        self.assertIs(configdb.get_active_instrument_index(), instrument_index)
+
+    def test_instrument_lookups_do_not_modify_index(self):
+        configdb = ConfigDB()
+        configdb.get_instrument_names('1M0-SCICAM-SBIG', 'tst', 'doma', '1m0a').pop()
+        configdb.get_instruments_at_location('tst', 'doma', '1m0a')['names'].clear()
+        self.assertEqual(configdb.get_instrument_names('1M0-SCICAM-SBIG', 'tst', 'doma', '1m0a'), {'xx01', 'xx08'})
+        self.assertEqual(configdb.get_instruments_at_location('tst', 'doma', '1m0a')['names'], {'xx01', 'xx08'})
+
+    def test_guider_lookups(self):
+        configdb = ConfigDB()
+        self.assertTrue(configdb.is_valid_guider_for_instrument_name('XX03', 'EF03'))
+        self.assertFalse(configdb.is_valid_guider_for_instrument_name('xx03', 'ef01'))
+        self.assertFalse(configdb.is_valid_guider_for_instrument_name('xx06', 'ef06'))
+        with self.assertRaises(ConfigDBException):
+            configdb.get_guider_for_instrument_name('xx06')
+
+    def test_memoized_overheads_are_invalidated_when_data_version_changes(self):
+        configdb = ConfigDB()
+        request_overheads = configdb.get_request_overheads('1M0-SCICAM-SBIG')
+        caches['locmem'].set('sites.version', 'new-version')
+        new_request_overheads = configdb.get_request_overheads('1M0-SCICAM-SBIG')
+        self.assertIsNot(new_request_overheads, request_overheads)
+        self.assertEqual(new_request_overheads, request_overheads)
+
+
+class ConfigDBStubHandler(BaseHTTPRequestHandler):
+    status = 200
+    etag = '"abc"'
+    content = None
+    requests_served = 0
+    not_modified_served = 0
+
+    def do_GET(self):
+        ConfigDBStubHandler.requests_served += 1
+        if self.status == 200 and self.headers.get('If-None-Match') == self.etag:
+            ConfigDBStubHandler.not_modified_served += 1
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(self.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', self.etag)
+        self.end_headers()
+        if self.content is not None:
+            self.wfile.write(self.content)
+            return
+        with open(CONFIGDB_TEST_FILE, 'rb') as input_file:
+            self.wfile.write(input_file.read())
+
+    def log_message(self, format, *args):
+        pass
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TestConfigDBRefresh(TestCase):
+    def setUp(self):
+        super().setUp()
+        caches['locmem'].clear()
+        ConfigDBStubHandler.status = 200
+        ConfigDBStubHandler.etag = '"abc"'
+        ConfigDBStubHandler.content = None
+        ConfigDBStubHandler.requests_served = 0
+        ConfigDBStubHandler.not_modified_served = 0
+        self.server = HTTPServer(('127.0.0.1', 0), ConfigDBStubHandler)
+        self.server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.server_thread.start()
+        self.configdb_url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        responses.add_passthru(self.configdb_url)
+
+    def tearDown(self):
+        ConfigDB.stop_background_refresh()
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def test_refresh_falls_back_on_last_good_data(self):
+        with self.settings(CONFIGDB_URL=self.configdb_url):
+            data = ConfigDB.refresh_configdb_data('sites')
+            ConfigDBStubHandler.status = 500
+            with patch('observation_portal.common.configdb.logger') as mock_logger:
+                stale_data = ConfigDB.refresh_configdb_data('sites')
+        self.assertEqual(stale_data, data)
+        self.assertTrue(mock_logger.warning.called)
+        self.assertEqual(ConfigDBStubHandler.requests_served, 2)
+
+    def test_refresh_without_previous_data_raises(self):
+        ConfigDBStubHandler.status = 500
+        with self.settings(CONFIGDB_URL=self.configdb_url):
+            with self.assertRaises(ConfigDBException):
+                ConfigDB.refresh_configdb_data('sites')
+
+    def test_background_refresh_renews_cached_data(self):
+        with self.settings(CONFIGDB_URL=self.configdb_url, CONFIGDB_BACKGROUND_REFRESH=True,
+                           CONFIGDB_REFRESH_INTERVAL=0.05):
+            ConfigDB().get_site_data()
+            self.assertEqual(ConfigDBStubHandler.requests_served, 1)
+            for _ in range(100):
+                if ConfigDBStubHandler.requests_served > 1:
+                    break
+                time.sleep(0.05)
+            # Data is served from the cache kept up to date by the refresher
+            ConfigDB().get_site_data()
+        self.assertGreater(ConfigDBStubHandler.requests_served, 1)
+
+    def test_refresh_with_unchanged_data_uses_conditional_request(self):
+        with self.settings(CONFIGDB_URL=self.configdb_url):
+            data = ConfigDB.refresh_configdb_data('sites')
+            version = caches['locmem'].get('sites.version')
+            caches['locmem'].delete('sites')
+            self.assertEqual(ConfigDB.refresh_configdb_data('sites'), data)
+        self.assertEqual(ConfigDBStubHandler.requests_served, 2)
+        self.assertEqual(ConfigDBStubHandler.not_modified_served, 1)
+        self.assertEqual(caches['locmem'].get('sites.version'), version)
+
+    def test_refresh_uses_data_from_shared_cache(self):
+        shared_caches = dict(LOCMEM_CACHES, default={
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'test-configdb-shared-cache'
+        })
+        with self.settings(CONFIGDB_URL=self.configdb_url, CACHES=shared_caches):
+            caches['default'].clear()
+            data = ConfigDB.refresh_configdb_data('sites')
+            # Another process without any data in its local cache
+            caches['locmem'].clear()
+            self.assertEqual(ConfigDB.refresh_configdb_data('sites'), data)
+        self.assertEqual(ConfigDBStubHandler.requests_served, 1)
+
+    def test_refresh_renews_shared_data_older_than_max_age(self):
+        shared_caches = dict(LOCMEM_CACHES, default={
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'test-configdb-shared-cache'
+        })
+        with self.settings(CONFIGDB_URL=self.configdb_url, CACHES=shared_caches):
+            caches['default'].clear()
+            data = ConfigDB.refresh_configdb_data('sites')
+            # Recently fetched shared data is reused
+            self.assertEqual(ConfigDB.refresh_configdb_data('sites', max_age=60), data)
+            self.assertEqual(ConfigDBStubHandler.requests_served, 1)
+            record = caches['default'].get('configdb.sites')
+            record['fetched'] -= 120
+            caches['default'].set('configdb.sites', record)
+            self.assertEqual(ConfigDB.refresh_configdb_data('sites', max_age=60), data)
+            self.assertEqual(ConfigDBStubHandler.requests_served, 2)
+            # The shared copy was renewed
+            self.assertGreater(caches['default'].get('configdb.sites')['fetched'], record['fetched'])
+
+    def test_refresh_with_changed_data_sends_signal(self):
+        site_data = get_test_site_data()
+        site_data[0]['enclosure_set'][0]['telescope_set'][0]['instrument_set'][0]['state'] = 'DISABLED'
+        received = []
+
+        def receiver(sender, diff, **kwargs):
+            received.append(diff)
+
+        configdb_changed.connect(receiver)
+        try:
+            with self.settings(CONFIGDB_URL=self.configdb_url):
+                ConfigDB.refresh_configdb_data('sites')
+                # Refreshing unchanged data does not send the signal
+                ConfigDB.refresh_configdb_data('sites')
+                self.assertEqual(received, [])
+                ConfigDBStubHandler.etag = '"def"'
+                ConfigDBStubHandler.content = json.dumps({'results': site_data}).encode()
+                ConfigDB.refresh_configdb_data('sites')
+        finally:
+            configdb_changed.disconnect(receiver)
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0].instrument_types, {'1M0-SCICAM-SBIG'})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TestConfigDBSnapshotFile(TestCase):
+    def setUp(self):
+        super().setUp()
+        caches['locmem'].clear()
+        snapshot_file, self.snapshot_file_path = tempfile.mkstemp(suffix='.json')
+        os.close(snapshot_file)
+        self.site_data = get_test_site_data()
+        self.write_snapshot_file(self.site_data)
+
+    def tearDown(self):
+        os.remove(self.snapshot_file_path)
+        super().tearDown()
+
+    def write_snapshot_file(self, site_data, mtime=1000000000):
+        with open(self.snapshot_file_path, 'w') as snapshot_file:
+            json.dump({'results': site_data}, snapshot_file)
+        os.utime(self.snapshot_file_path, (mtime, mtime))
+
+    def test_sites_data_is_loaded_from_file(self):
+        with self.settings(CONFIGDB_SNAPSHOT_FILE=self.snapshot_file_path):
+            with patch('observation_portal.common.configdb.requests.get') as mock_get:
+                self.assertEqual(ConfigDB().get_site_data(), self.site_data)
+                self.assertTrue(ConfigDB().is_valid_instrument_type('1M0-SCICAM-SBIG'))
+        self.assertFalse(mock_get.called)
+
+    def test_unchanged_file_is_not_read_again(self):
+        with self.settings(CONFIGDB_SNAPSHOT_FILE=self.snapshot_file_path):
+            data = ConfigDB.refresh_configdb_data('sites')
+            with patch('observation_portal.common.configdb.open', create=True) as mock_open:
+                self.assertEqual(ConfigDB.refresh_configdb_data('sites'), data)
+        self.assertFalse(mock_open.called)
+
+    def test_changed_file_is_reloaded(self):
+        with self.settings(CONFIGDB_SNAPSHOT_FILE=self.snapshot_file_path):
+            configdb = ConfigDB()
+            snapshot = configdb.get_snapshot()
+            self.assertTrue(configdb.is_valid_instrument_type('2M0-FLOYDS-SCICAM'))
+            for enclosure in self.site_data[0]['enclosure_set']:
+                for telescope in enclosure['telescope_set']:
+                    for instrument in telescope['instrument_set']:
+                        if instrument['science_camera']['camera_type']['code'] == '2M0-FLOYDS-SCICAM':
+                            instrument['state'] = 'DISABLED'
+            self.write_snapshot_file(self.site_data, mtime=1000000010)
+            # Expire the cached data as would happen after the check interval
+            caches['locmem'].delete_many(['sites', 'sites.version'])
+            self.assertIsNot(configdb.get_snapshot(), snapshot)
+            self.assertFalse(configdb.is_valid_instrument_type('2M0-FLOYDS-SCICAM'))
+
+    def test_broken_file_falls_back_on_last_good_data(self):
+        with self.settings(CONFIGDB_SNAPSHOT_FILE=self.snapshot_file_path):
+            data = ConfigDB.refresh_configdb_data('sites')
+            with open(self.snapshot_file_path, 'w') as snapshot_file:
+                snapshot_file.write('{"results": [')
+            with patch('observation_portal.common.configdb.logger') as mock_logger:
+                self.assertEqual(ConfigDB.refresh_configdb_data('sites'), data)
+        self.assertTrue(mock_logger.warning.called)
+
+
+class TestLazyConfigDBChoices(TestCase):
+    def test_choices_are_only_retrieved_when_used(self):
+        with patch.object(ConfigDB, 'get_site_tuples', return_value=[('tst', 'tst')]) as mock_site_tuples:
+            field = LazyChoiceField(choices=lambda: configdb.get_site_tuples())
+            copied_field = copy.deepcopy(field)
+            self.assertFalse(mock_site_tuples.called)
+            self.assertEqual(copied_field.to_internal_value('tst'), 'tst')
+            self.assertEqual(mock_site_tuples.call_count, 1)
+            self.assertEqual(list(copied_field.choices), ['tst'])
+            self.assertEqual(mock_site_tuples.call_count, 1)
+
+    def test_choices_are_retrieved_when_representing_values(self):
+        with patch.object(ConfigDB, 'get_site_tuples', return_value=[('tst', 'tst')]) as mock_site_tuples:
+            field = LazyChoiceField(choices=lambda: configdb.get_site_tuples())
+            self.assertFalse(mock_site_tuples.called)
+            self.assertEqual(field.to_representation('tst'), 'tst')
+            self.assertEqual(mock_site_tuples.call_count, 1)
+
+    def test_filter_choices_are_only_retrieved_when_used(self):
+        with patch.object(ConfigDB, 'get_site_tuples', return_value=[('tst', 'tst')]) as mock_site_tuples:
+            observation_filter = ObservationFilter(data={'site': ['tst']}, queryset=Observation.objects.none())
+            self.assertFalse(mock_site_tuples.called)
+            self.assertTrue(observation_filter.is_valid())
+            self.assertTrue(mock_site_tuples.called)
@@ -0,0 +1,156 @@
+from django.test import TestCase, override_settings
+from django.core.cache import caches
+from django.utils import timezone
+from unittest.mock import patch, call
+from datetime import datetime
+
+from observation_portal.common.downtimedb import DowntimeDB, DowntimeDBException, DowntimeStore, _parse_downtime_date
+from observation_portal.common.test_configdb import LOCMEM_CACHES
+
+
+def get_downtime(start, end, telescope='1m0a', observatory='doma', site='tst'):
+    return {'start': start, 'end': end, 'site': site, 'observatory': observatory, 'telescope': telescope,
+            'reason': 'Whatever'}
+
+
+class TestDowntimeStore(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = DowntimeStore([
+            get_downtime('2016-10-05T00:00:00Z', '2016-10-06T00:00:00Z'),
+            get_downtime('2016-10-01T00:00:00Z', '2016-10-02T00:00:00Z'),
+            get_downtime('2016-10-01T12:00:00Z', '2016-10-03T00:00:00Z'),
+            get_downtime('2016-10-01T00:00:00Z', '2016-10-10T00:00:00Z', telescope='2m0a'),
+        ])
+
+    def test_overlapping_downtime_is_merged(self):
+        self.assertEqual(self.store.get_intervals('1m0a.doma.tst'), [
+            (datetime(2016, 10, 1, tzinfo=timezone.utc), datetime(2016, 10, 3, tzinfo=timezone.utc)),
+            (datetime(2016, 10, 5, tzinfo=timezone.utc), datetime(2016, 10, 6, tzinfo=timezone.utc)),
+        ])
+        self.assertEqual(set(self.store.resources), {'1m0a.doma.tst', '2m0a.doma.tst'})
+
+    def test_only_downtime_overlapping_window_is_returned(self):
+        intervals = self.store.get_intervals(
+            '1m0a.doma.tst', datetime(2016, 10, 4, tzinfo=timezone.utc), datetime(2016, 10, 8, tzinfo=timezone.utc)
+        )
+        self.assertEqual(intervals, [
+            (datetime(2016, 10, 5, tzinfo=timezone.utc), datetime(2016, 10, 6, tzinfo=timezone.utc))
+        ])
+        intervals = self.store.get_intervals(
+            '1m0a.doma.tst', datetime(2016, 10, 3, tzinfo=timezone.utc), datetime(2016, 10, 5, tzinfo=timezone.utc)
+        )
+        self.assertEqual(intervals, [])
+
+    def test_naive_window_returns_naive_downtime(self):
+        intervals = self.store.get_intervals('1m0a.doma.tst', datetime(2016, 10, 4), datetime(2016, 10, 8))
+        self.assertEqual(intervals, [(datetime(2016, 10, 5), datetime(2016, 10, 6))])
+
+    def test_unknown_resource_has_no_downtime(self):
+        self.assertEqual(self.store.get_intervals('1m0a.domb.tst'), [])
+        self.assertTrue(self.store.get_intervalset('1m0a.domb.tst').is_empty())
+
+
+class TestParseDowntimeDate(TestCase):
+    def test_dates_in_downtime_format_are_parsed(self):
+        self.assertEqual(
+            _parse_downtime_date('2016-10-05T13:14:15Z'), datetime(2016, 10, 5, 13, 14, 15, tzinfo=timezone.utc)
+        )
+
+    def test_dates_not_matching_the_fast_path_fall_back_to_strptime(self):
+        self.assertEqual(
+            _parse_downtime_date('2016-10-5T13:14:15Z'), datetime(2016, 10, 5, 13, 14, 15, tzinfo=timezone.utc)
+        )
+
+    def test_invalid_dates_are_rejected(self):
+        with self.assertRaises(ValueError):
+            _parse_downtime_date('2016-13-05T13:14:15Z')
+        with self.assertRaises(ValueError):
+            _parse_downtime_date('2016-10-05 13:14:15')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TestDowntimeDB(TestCase):
+    def setUp(self):
+        super().setUp()
+        caches['locmem'].clear()
+        DowntimeDB._store = None
+
+    def tearDown(self):
+        DowntimeDB._store = None
+        super().tearDown()
+
+    @patch('observation_portal.common.downtimedb.DowntimeDB._get_downtime_data')
+    def test_store_is_reused_until_data_changes(self, downtime_data):
+        downtime_data.return_value = [get_downtime('2016-10-01T00:00:00Z', '2016-10-02T00:00:00Z')]
+        store = DowntimeDB.get_downtime_store()
+        self.assertIs(DowntimeDB.get_downtime_store(), store)
+        self.assertEqual(downtime_data.call_count, 1)
+        # The data is checked again once the cached version expires, but unchanged data keeps the same store
+        caches['locmem'].clear()
+        self.assertIs(DowntimeDB.get_downtime_store(), store)
+        downtime_data.return_value = [get_downtime('2016-10-01T00:00:00Z', '2016-10-03T00:00:00Z')]
+        caches['locmem'].clear()
+        self.assertIsNot(DowntimeDB.get_downtime_store(), store)
+
+    @patch('observation_portal.common.downtimedb.DowntimeDB._get_downtime_data')
+    def test_previous_store_is_used_when_downtimedb_is_down(self, downtime_data):
+        downtime_data.return_value = [get_downtime('2016-10-01T00:00:00Z', '2016-10-02T00:00:00Z')]
+        store = DowntimeDB.get_downtime_store()
+        caches['locmem'].clear()
+        downtime_data.side_effect = DowntimeDBException('down')
+        with patch('observation_portal.common.downtimedb.logger'):
+            self.assertIs(DowntimeDB.get_downtime_store(), store)
+            self.assertEqual(list(DowntimeDB.get_downtime_intervals().keys()), ['1m0a.doma.tst'])
+
+
+SYNC_CACHES = dict(LOCMEM_CACHES, default={
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'test-downtimedb-sync-cache'
+})
+
+
+@override_settings(CACHES=SYNC_CACHES, DOWNTIMEDB_INCREMENTAL_SYNC=True, DOWNTIMEDB_FULL_SYNC_INTERVAL=3600)
+class TestDowntimeDBIncrementalSync(TestCase):
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+        self.records = {
+            1: dict(get_downtime('2016-10-01T00:00:00Z', '2016-10-02T00:00:00Z'), id=1,
+                    modified='2016-09-01T00:00:00Z'),
+            2: dict(get_downtime('2016-10-05T00:00:00Z', '2016-10-06T00:00:00Z'), id=2,
+                    modified='2016-09-02T00:00:00Z'),
+        }
+        self.queries = []
+
+    def get_downtime_data(self, modified_after=None):
+        self.queries.append(modified_after)
+        return [
+            record for record in self.records.values() if not modified_after or record['modified'] > modified_after
+        ]
+
+    def test_only_modified_records_are_fetched_after_first_sync(self):
+        with patch.object(DowntimeDB, '_get_downtime_data', side_effect=self.get_downtime_data):
+            self.assertEqual(DowntimeDB._sync_downtime_data(), [self.records[1], self.records[2]])
+            self.records[1] = dict(self.records[1], end='2016-10-03T00:00:00Z', modified='2016-09-03T00:00:00Z')
+            self.records[3] = dict(get_downtime('2016-10-08T00:00:00Z', '2016-10-09T00:00:00Z'), id=3,
+                                   modified='2016-09-04T00:00:00Z')
+            self.assertEqual(DowntimeDB._sync_downtime_data(), [self.records[1], self.records[2], self.records[3]])
+        self.assertEqual(self.queries, [None, '2016-09-02T00:00:00Z'])
+
+    def test_full_resync_removes_deleted_records(self):
+        with patch.object(DowntimeDB, '_get_downtime_data', side_effect=self.get_downtime_data):
+            DowntimeDB._sync_downtime_data()
+            del self.records[2]
+            self.assertEqual(len(DowntimeDB._sync_downtime_data()), 2)
+            with self.settings(DOWNTIMEDB_FULL_SYNC_INTERVAL=-1):
+                self.assertEqual(DowntimeDB._sync_downtime_data(), [self.records[1]])
+        self.assertEqual(self.queries, [None, '2016-09-02T00:00:00Z', None])
+
+    def test_records_without_modification_times_are_always_fetched_in_full(self):
+        for record in self.records.values():
+            del record['modified']
+        with patch.object(DowntimeDB, '_get_downtime_data', return_value=list(self.records.values())) as mock_data:
+            DowntimeDB._sync_downtime_data()
+            DowntimeDB._sync_downtime_data()
+        self.assertEqual(mock_data.call_args_list, [call(), call()])
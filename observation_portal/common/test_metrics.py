@@ -0,0 +1,120 @@
+from django.test import TestCase, override_settings
+from django.core.cache import caches
+from django.contrib.auth.models import User
+from django.urls import reverse
+from mixer.backend.django import mixer
+from prometheus_client import REGISTRY
+from unittest.mock import patch
+import requests
+
+from observation_portal.common.configdb import ConfigDB
+from observation_portal.common.downtimedb import DowntimeDB, DowntimeDBException
+from observation_portal.common.test_configdb import LOCMEM_CACHES
+
+
+def get_sample_value(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TestConfigDBMetrics(TestCase):
+    def setUp(self):
+        super().setUp()
+        caches['locmem'].clear()
+
+    def test_fetches_and_cache_lookups_are_counted(self):
+        fetches = get_sample_value(
+            'observation_portal_fetches_total', service='configdb', resource='sites', result='ok'
+        )
+        fetch_durations = get_sample_value(
+            'observation_portal_fetch_duration_seconds_count', service='configdb', resource='sites'
+        )
+        misses = get_sample_value(
+            'observation_portal_cache_requests_total', service='configdb', resource='sites', result='miss'
+        )
+        hits = get_sample_value(
+            'observation_portal_cache_requests_total', service='configdb', resource='sites', result='hit'
+        )
+        ConfigDB().get_site_data()
+        ConfigDB().get_site_data()
+        self.assertEqual(
+            get_sample_value('observation_portal_fetches_total', service='configdb', resource='sites', result='ok'),
+            fetches + 1
+        )
+        self.assertEqual(
+            get_sample_value('observation_portal_fetch_duration_seconds_count', service='configdb', resource='sites'),
+            fetch_durations + 1
+        )
+        self.assertGreater(
+            get_sample_value('observation_portal_fetch_payload_bytes_sum', service='configdb', resource='sites'), 0
+        )
+        self.assertEqual(
+            get_sample_value(
+                'observation_portal_cache_requests_total', service='configdb', resource='sites', result='miss'
+            ),
+            misses + 1
+        )
+        self.assertEqual(
+            get_sample_value(
+                'observation_portal_cache_requests_total', service='configdb', resource='sites', result='hit'
+            ),
+            hits + 1
+        )
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TestDowntimeDBMetrics(TestCase):
+    def setUp(self):
+        super().setUp()
+        caches['locmem'].clear()
+
+    def test_fallback_on_last_good_data_is_counted(self):
+        fallbacks = get_sample_value('observation_portal_stale_fallbacks_total', service='downtimedb',
+                                     resource='downtime')
+        with patch.object(DowntimeDB, '_get_downtime_data', return_value=[]):
+            DowntimeDB.get_downtime_intervals()
+        caches['locmem'].clear()
+        with patch.object(DowntimeDB, '_get_downtime_data', side_effect=DowntimeDBException('down')):
+            with patch('observation_portal.common.downtimedb.logger'):
+                DowntimeDB.get_downtime_intervals()
+        self.assertEqual(
+            get_sample_value('observation_portal_stale_fallbacks_total', service='downtimedb', resource='downtime'),
+            fallbacks + 1
+        )
+
+    def test_fetch_errors_are_counted(self):
+        errors = get_sample_value('observation_portal_fetches_total', service='downtimedb', resource='downtime',
+                                  result='error')
+        with patch('observation_portal.common.downtimedb.requests.get',
+                   side_effect=requests.exceptions.ConnectionError()):
+            with self.assertRaises(DowntimeDBException):
+                DowntimeDB._get_downtime_data()
+        self.assertEqual(
+            get_sample_value('observation_portal_fetches_total', service='downtimedb', resource='downtime',
+                             result='error'),
+            errors + 1
+        )
+
+
+class TestMetricsView(TestCase):
+    def test_metrics_are_exposed_to_staff(self):
+        self.client.force_login(mixer.blend(User, is_staff=True))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'observation_portal_fetches_total', response.content)
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.1'])
+    def test_metrics_are_exposed_to_allowed_addresses(self):
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'observation_portal_fetches_total', response.content)
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.1'])
+    def test_anonymous_access_is_rejected(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 403)
+
+    def test_non_staff_access_is_rejected(self):
+        self.client.force_login(mixer.blend(User, is_staff=False))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 403)
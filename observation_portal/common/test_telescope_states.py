@@ -1,14 +1,16 @@
 from observation_portal.common.telescope_states import (TelescopeStates, get_telescope_availability_per_day,
                                               combine_telescope_availabilities_by_site_and_class)
-from observation_portal.common.configdb import TelescopeKey
+from observation_portal.common.configdb import TelescopeKey, configdb
 from observation_portal.common import rise_set_utils
 
 from time_intervals.intervals import Intervals
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.core.cache import caches
 from datetime import datetime, timedelta
 from django.utils import timezone
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
 import json
+import numpy as np
 
 
 class TelescopeStatesFakeInput(TestCase):
@@ -224,6 +226,38 @@ class TestTelescopeStates(TelescopeStatesFakeInput):
         self.assertAlmostEqual(total_expected_availability, combined_telescope_availability[combined_key][0][1])
 
 
+class TestTelescopeStatesScroll(TelescopeStatesFakeInput):
+    # The unpatched method, since the fake input patches it
+    get_es_data = TelescopeStates._get_es_data
+
+    @patch('observation_portal.common.telescope_states.ES_QUERY_SIZE', 3)
+    def test_datums_are_read_one_page_at_a_time(self):
+        pages = [self.es_output[i:i + 3] for i in range(0, len(self.es_output), 3)]
+        with patch.object(TelescopeStates, '_get_es_data', self.get_es_data):
+            telescope_states = TelescopeStates(datetime(2016, 10, 1), datetime(2016, 10, 2))
+            telescope_states.es = MagicMock()
+            telescope_states.es.search.return_value = {
+                'hits': {'hits': pages[0], 'total': len(self.es_output)}, '_scroll_id': 'scroll'
+            }
+            telescope_states.es.scroll.side_effect = [
+                {'hits': {'hits': page}, '_scroll_id': 'scroll'} for page in pages[1:]
+            ]
+            event_data = telescope_states._get_es_data(
+                ['tst'], ['1m0a'], telescope_states.start, telescope_states.end
+            )
+            self.assertEqual(next(event_data), self.es_output[0])
+            self.assertFalse(telescope_states.es.scroll.called)
+            self.assertEqual(list(event_data), self.es_output[1:])
+            self.assertEqual(telescope_states.es.scroll.call_count, len(pages) - 1)
+            telescope_states.es.clear_scroll.assert_called_once_with(scroll_id='scroll')
+
+            telescope_states.es.scroll.side_effect = [
+                {'hits': {'hits': page}, '_scroll_id': 'scroll'} for page in pages[1:]
+            ]
+            streamed_states = telescope_states.get()
+        self.assertEqual(streamed_states, TelescopeStates(datetime(2016, 10, 1), datetime(2016, 10, 2)).get())
+
+
 class TelescopeStatesFromFile(TestCase):
     def setUp(self):
         self.configdb_null_patcher = patch('observation_portal.common.configdb.ConfigDB._get_configdb_data')
@@ -380,6 +414,50 @@ class TestTelescopeStatesFromFile(TelescopeStatesFromFile):
 
                 previous_event = event
 
+    def test_states_queried_concurrently_by_site_match_single_query(self):
+        self.mock_es.side_effect = lambda sites, telescopes, start, end: [
+            event for event in self.es_output if event['_source']['site'] in sites
+        ]
+        telescope_states = TelescopeStates(self.start, self.end).get()
+        self.assertEqual(self.mock_es.call_count, 1)
+        self.mock_es.reset_mock()
+        with self.settings(TELESCOPE_STATES_QUERY_THREADS=4):
+            concurrent_telescope_states = TelescopeStates(self.start, self.end)
+            self.assertEqual(concurrent_telescope_states.get(), telescope_states)
+        self.assertEqual(self.mock_es.call_count, len(concurrent_telescope_states.sites))
+        self.assertTrue(all(len(call[0][0]) == 1 for call in self.mock_es.call_args_list))
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-telescope-states'},
+        'locmem': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+    })
+    def test_past_states_are_served_from_cache(self):
+        caches['default'].clear()
+        telescope_states = TelescopeStates(self.start, self.short_end).get()
+        self.assertEqual(self.mock_es.call_count, 1)
+        self.assertEqual(TelescopeStates(self.start, self.short_end).get(), telescope_states)
+        self.assertEqual(self.mock_es.call_count, 1)
+
+        # Only the days that are not already cached are queried, and the lumps still span days
+        extended_telescope_states = TelescopeStates(self.start, self.end).get()
+        self.assertEqual(self.mock_es.call_count, 2)
+        self.assertEqual(self.mock_es.call_args[0][2:], (self.short_end, self.end))
+        caches['default'].clear()
+        self.assertEqual(TelescopeStates(self.start, self.end).get(), extended_telescope_states)
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-telescope-states'},
+        'locmem': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+    })
+    def test_current_day_states_are_not_cached(self):
+        caches['default'].clear()
+        start = timezone.now() - timedelta(days=2)
+        TelescopeStates(start, timezone.now()).get()
+        self.assertLessEqual(self.mock_es.call_args[0][2], start)
+        TelescopeStates(start, timezone.now()).get()
+        self.assertEqual(self.mock_es.call_count, 2)
+        self.assertGreater(self.mock_es.call_args[0][2], start)
+
 
 class TestRiseSetUtils(TestCase):
     def setUp(self):
@@ -393,6 +471,79 @@ class TestRiseSetUtils(TestCase):
         end = timezone.datetime(year=2017, month=5, day=6, tzinfo=timezone.utc)
         self.assertTrue(rise_set_utils.get_site_rise_set_intervals(start=start, end=end, site_code='tst'))
 
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-dark-intervals'},
+        'locmem': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+    })
+    def test_get_site_rise_set_intervals_uses_dark_interval_table(self):
+        caches['default'].clear()
+        start = timezone.datetime(year=2017, month=5, day=5, hour=13, tzinfo=timezone.utc)
+        end = start + timedelta(days=3, hours=2)
+        site_detail = configdb.get_sites_with_instrument_type_and_location(site_code='tst')['tst']
+        visibility = rise_set_utils.get_rise_set_visibility(start, end, site_detail)
+        intervals = rise_set_utils.get_site_rise_set_intervals(start=start, end=end, site_code='tst')
+        self.assertEqual(intervals, visibility.get_dark_intervals())
+        with patch.object(rise_set_utils, 'get_rise_set_visibility') as mock_visibility:
+            self.assertEqual(
+                rise_set_utils.get_site_rise_set_intervals(start=start, end=end, site_code='tst'), intervals
+            )
+            rise_set_utils.get_site_rise_set_intervals(start=start + timedelta(hours=5), end=end, site_code='tst')
+        self.assertFalse(mock_visibility.called)
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-dark-intervals'},
+        'locmem': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+    })
+    def test_precomputed_dark_intervals_cover_range(self):
+        caches['default'].clear()
+        first_day = timezone.datetime(year=2017, month=5, day=1).date()
+        rise_set_utils.precompute_site_dark_intervals(first_day, first_day + timedelta(days=9))
+        with patch.object(rise_set_utils, 'get_rise_set_visibility') as mock_visibility:
+            intervals_by_day = rise_set_utils.get_site_dark_intervals_by_day(
+                'tst', first_day, first_day + timedelta(days=9)
+            )
+        self.assertFalse(mock_visibility.called)
+        self.assertEqual(len(intervals_by_day), 10)
+        for day, intervals in intervals_by_day.items():
+            for start, end in intervals:
+                self.assertEqual(start.date(), day)
+                self.assertTrue(end.date() == day or end == rise_set_utils._get_utc_day_start(day + timedelta(days=1)))
+
+    def test_visibilities_are_reused_for_the_same_site_and_window(self):
+        start = timezone.datetime(year=2017, month=5, day=5, tzinfo=timezone.utc)
+        end = start + timedelta(days=1)
+        site_detail = configdb.get_sites_with_instrument_type_and_location(site_code='tst')['tst']
+        rise_set_site = rise_set_utils.get_rise_set_site(site_detail)
+        visibility = rise_set_utils.get_rise_set_visibility(start, end, site_detail)
+        self.assertIs(rise_set_utils.get_rise_set_site(dict(site_detail)), rise_set_site)
+        self.assertIs(visibility.site, rise_set_site)
+        self.assertIs(rise_set_utils.get_rise_set_visibility(start, end, dict(site_detail)), visibility)
+        self.assertIsNot(
+            rise_set_utils.get_rise_set_visibility(start, end + timedelta(days=1), site_detail), visibility
+        )
+        self.assertIsNot(
+            rise_set_utils.get_rise_set_visibility(
+                start, end, dict(site_detail, zenith_blind_spot=site_detail['zenith_blind_spot'] + 1)
+            ),
+            visibility
+        )
+
+    def test_rise_set_targets_are_reused_until_the_target_changes(self):
+        target = {'type': 'ICRS', 'name': 'Target', 'ra': 34.4, 'dec': 20, 'proper_motion_ra': 0.0,
+                  'proper_motion_dec': 0.0, 'parallax': 0, 'epoch': 2000, 'extra_params': {'v_magnitude': 12}}
+        rise_set_target = rise_set_utils.get_rise_set_target(target)
+        self.assertIs(rise_set_utils.get_rise_set_target(dict(target, extra_params={})), rise_set_target)
+        moved_target = rise_set_utils.get_rise_set_target(dict(target, ra=35.4))
+        self.assertIsNot(moved_target, rise_set_target)
+        self.assertAlmostEqual(moved_target['ra'].in_degrees(), 35.4)
+
+    def test_downsampled_airmasses_keep_the_minimum_of_each_bucket(self):
+        times = np.arange(10)
+        airmasses = np.array([1.5, 1.2, 1.3, 1.1, 1.4, 2.0, 1.9, 1.0, 1.6, 1.7])
+        downsampled_times, downsampled_airmasses = rise_set_utils._downsample_keeping_minima(times, airmasses, 3)
+        self.assertEqual(downsampled_times.tolist(), [3, 4, 7])
+        self.assertEqual(downsampled_airmasses.tolist(), [1.1, 1.4, 1.0])
+
     def test_get_largest_rise_set_interval_only_uses_one_site(self):
         configdb_patcher = patch(
             'observation_portal.common.configdb.ConfigDB.get_sites_with_instrument_type_and_location'
@@ -5,6 +5,7 @@ from django.db import transaction
 from django.utils.translation import ugettext as _
 
 from observation_portal.common.configdb import configdb
+from observation_portal.common.fields import LazyChoiceField
 from observation_portal.observations.models import Observation, ConfigurationStatus, Summary
 from observation_portal.requestgroups.serializers import (RequestSerializer, RequestGroupSerializer,
                                                           ConfigurationSerializer, TargetSerializer)
@@ -144,9 +145,9 @@ class ScheduleSerializer(serializers.ModelSerializer):
     request = ObserveRequestSerializer()
     proposal = serializers.CharField(write_only=True)
     name = serializers.CharField(write_only=True)
-    site = serializers.ChoiceField(choices=configdb.get_site_tuples())
-    enclosure = serializers.ChoiceField(choices=configdb.get_enclosure_tuples())
-    telescope = serializers.ChoiceField(choices=configdb.get_telescope_tuples())
+    site = LazyChoiceField(choices=lambda: configdb.get_site_tuples())
+    enclosure = LazyChoiceField(choices=lambda: configdb.get_enclosure_tuples())
+    telescope = LazyChoiceField(choices=lambda: configdb.get_telescope_tuples())
     state = serializers.ReadOnlyField()
 
     class Meta:
@@ -176,9 +177,11 @@ class ScheduleSerializer(serializers.ModelSerializer):
         if data['end'] <= data['start']:
             raise serializers.ValidationError(_("End time must be after start time"))
 
-        # Validate the site/obs/tel is a valid combination with the instrument class requested
-        allowable_instruments = configdb.get_instruments_at_location(
-            data['site'], data['enclosure'], data['telescope']
+        # Validate the site/obs/tel is a valid combination with the instrument class requested. The instruments and
+        # guiders of all configurations are looked up in an index that is only built once per ConfigDB snapshot.
+        telescope_key = configdb.get_snapshot().get_telescope_key(data['site'], data['enclosure'], data['telescope'])
+        allowable_instruments = configdb.get_active_instrument_index()['telescopes'].get(
+            telescope_key, {'names': set(), 'types': set(), 'names_by_type': {}}
         )
         for configuration in data['request']['configurations']:
             if configuration['instrument_type'].lower() not in allowable_instruments['types']:
@@ -186,8 +189,8 @@ class ScheduleSerializer(serializers.ModelSerializer):
                     configuration['instrument_type'], data['site'], data['enclosure'], data['telescope']
                 )))
             if not configuration.get('instrument_name', ''):
-                instrument_names = configdb.get_instrument_names(
-                    configuration['instrument_type'], data['site'], data['enclosure'], data['telescope']
+                instrument_names = set(
+                    allowable_instruments['names_by_type'].get(configuration['instrument_type'].lower(), ())
                 )
                 if len(instrument_names) > 1:
                     raise serializers.ValidationError(_(
@@ -5,7 +5,8 @@ from django.utils import timezone
 
 from observation_portal.requestgroups.models import Request
 from observation_portal.common.rise_set_utils import (
-    get_filtered_rise_set_intervals_by_site, get_site_rise_set_intervals
+    get_filtered_rise_set_intervals_by_site, get_filtered_rise_set_intervals_by_site_for_requests,
+    get_site_rise_set_intervals
 )
 from observation_portal.common.configdb import configdb
 
@@ -126,13 +127,27 @@ class Pressure(object):
                     n_telescopes += sum([1 for t in self._telescopes(instrument_type) if t.site == site])
         return n_telescopes
 
-    def _visible_intervals(self, request):
+    def _rise_set_intervals_by_request(self):
+        # The intervals of all the requests are got together, so that the solar and lunar computations for each site
+        # are shared by all of the targets whose intervals are not cached yet
+        requests = list(self.requests)
+        intervals_by_site_by_request = get_filtered_rise_set_intervals_by_site_for_requests(
+            [request.as_dict() for request in requests], self.site or ''
+        )
+        return {
+            request.id: intervals_by_site for request, intervals_by_site in zip(requests, intervals_by_site_by_request)
+        }
+
+    def _visible_intervals(self, request, intervals_by_site=None):
         visible_intervals = {}
         for site in self.sites:
             if not request.location.site or request.location.site == site['code']:
-                intervals = get_filtered_rise_set_intervals_by_site(
-                    request.as_dict(), site['code']
-                ).get(site['code'], [])
+                if intervals_by_site is None:
+                    intervals = get_filtered_rise_set_intervals_by_site(
+                        request.as_dict(), site['code']
+                    ).get(site['code'], [])
+                else:
+                    intervals = intervals_by_site.get(site['code'], [])
                 for r, s in intervals:
                     effective_rise = max(r, self.now)
                     if s > self.now and (s-effective_rise).seconds >= request.duration:
@@ -152,8 +167,9 @@ class Pressure(object):
         quarter_hour_bins = [{} for x in range(0, 24 * 4)]
         bin_start_times = self._time_bins()
 
+        intervals_by_request = self._rise_set_intervals_by_request()
         for request in self.requests:
-            site_intervals = self._visible_intervals(request)
+            site_intervals = self._visible_intervals(request, intervals_by_request[request.id])
             total_time_visible = self._time_visible(site_intervals)
             instrument_type = request.configurations.all()[0].instrument_type
 
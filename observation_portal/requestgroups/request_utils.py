@@ -1,11 +1,9 @@
 from datetime import timedelta
-from rise_set.angle import Angle
-from rise_set.astrometry import calculate_airmass_at_times
 import requests
 
 from observation_portal.common.configdb import configdb, ConfigDB
 from observation_portal.common.telescope_states import TelescopeStates, filter_telescope_states_by_intervals
-from observation_portal.common.rise_set_utils import get_rise_set_target, get_filtered_rise_set_intervals_by_site
+from observation_portal.common.rise_set_utils import get_airmasses_by_site, get_filtered_rise_set_intervals_by_site
 from observation_portal.requestgroups.target_helpers import TARGET_TYPE_HELPER_MAP
 
 # TODO: Use configuration types from configdb
@@ -81,7 +79,35 @@ def date_range_from_interval(start_time, end_time, dt=timedelta(minutes=15)):
         time += dt
 
 
-def get_airmasses_for_request_at_sites(request_dict, is_staff=False):
+def get_airmass_options(query_params):
+    """Get the options of an airmass response from the resolution, max_points and compact query parameters.
+
+    Raises a ValueError if any of them are invalid.
+    """
+    options = {}
+    if query_params.get('resolution'):
+        resolution = int(query_params['resolution'])
+        if resolution < 1:
+            raise ValueError('resolution must be a positive number of minutes')
+        options['resolution'] = timedelta(minutes=resolution)
+    if query_params.get('max_points'):
+        max_points = int(query_params['max_points'])
+        if max_points < 1:
+            raise ValueError('max_points must be a positive number')
+        options['max_points'] = max_points
+    if query_params.get('compact'):
+        compact = query_params['compact'].lower()
+        if compact not in ('true', 'false'):
+            raise ValueError('compact must be true or false')
+        options['compact'] = compact == 'true'
+    return options
+
+
+def get_airmasses_for_request_at_sites(request_dict, is_staff=False, **airmass_options):
+    """Get the airmasses of the target of a request at each site it is visible from.
+
+    The airmass_options are passed on to get_airmasses_by_site, see get_airmass_options.
+    """
     # TODO: Change to work with multiple instrument types and multiple constraints and multiple targets
     data = {'airmass_data': {}}
     instrument_type = request_dict['configurations'][0]['instrument_type']
@@ -98,25 +124,13 @@ def get_airmasses_for_request_at_sites(request_dict, is_staff=False):
             telescope_code=request_dict['location'].get('telescope'),
             only_schedulable=only_schedulable
         )
-        rs_target = get_rise_set_target(target)
-        for site_id, site_details in site_data.items():
-            night_times = []
-            site_lat = Angle(degrees=site_details['latitude'])
-            site_lon = Angle(degrees=site_details['longitude'])
-            site_alt = site_details['altitude']
-            intervals = get_filtered_rise_set_intervals_by_site(request_dict, site_id, is_staff=is_staff).get(site_id, [])
-            for interval in intervals:
-                night_times.extend(
-                    [time for time in date_range_from_interval(interval[0], interval[1], dt=timedelta(minutes=10))])
-
-            if len(night_times) > 0:
-                if site_id not in data:
-                    data['airmass_data'][site_id] = {}
-                data['airmass_data'][site_id]['times'] = [time.strftime('%Y-%m-%dT%H:%M') for time in night_times]
-                data['airmass_data'][site_id]['airmasses'] = calculate_airmass_at_times(
-                    night_times, rs_target, site_lat, site_lon, site_alt
-                )
-                data['airmass_limit'] = constraints['max_airmass']
+        intervals_by_site = {
+            site_id: get_filtered_rise_set_intervals_by_site(request_dict, site_id, is_staff=is_staff).get(site_id, [])
+            for site_id in site_data
+        }
+        data['airmass_data'] = get_airmasses_by_site(target, intervals_by_site, site_data, **airmass_options)
+        if data['airmass_data']:
+            data['airmass_limit'] = constraints['max_airmass']
 
     return data
 
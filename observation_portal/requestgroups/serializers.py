@@ -19,6 +19,7 @@ from observation_portal.requestgroups.models import DraftRequestGroup
 from observation_portal.common.state_changes import debit_ipp_time, TimeAllocationError, validate_ipp
 from observation_portal.requestgroups.target_helpers import TARGET_TYPE_HELPER_MAP
 from observation_portal.common.configdb import configdb, ConfigDB, ConfigDBException
+from observation_portal.common.fields import LazyChoiceField
 from observation_portal.requestgroups.duration_utils import (
     get_request_duration, get_request_duration_sum, get_total_duration_dict, OVERHEAD_ALLOWANCE,
     get_instrument_configuration_duration, get_num_exposures, get_semester_in
@@ -463,10 +464,10 @@ class ConfigurationSerializer(serializers.ModelSerializer):
 
 
 class LocationSerializer(serializers.ModelSerializer):
-    site = serializers.ChoiceField(choices=configdb.get_site_tuples(), required=False)
-    enclosure = serializers.ChoiceField(choices=configdb.get_enclosure_tuples(), required=False)
-    telescope = serializers.ChoiceField(choices=configdb.get_telescope_tuples(), required=False)
-    telescope_class = serializers.ChoiceField(choices=configdb.get_telescope_class_tuples(), required=True)
+    site = LazyChoiceField(choices=lambda: configdb.get_site_tuples(), required=False)
+    enclosure = LazyChoiceField(choices=lambda: configdb.get_enclosure_tuples(), required=False)
+    telescope = LazyChoiceField(choices=lambda: configdb.get_telescope_tuples(), required=False)
+    telescope_class = LazyChoiceField(choices=lambda: configdb.get_telescope_class_tuples(), required=True)
 
     class Meta:
         model = Location
@@ -478,7 +479,7 @@ class LocationSerializer(serializers.ModelSerializer):
         if 'telescope' in data and 'enclosure' not in data:
             raise serializers.ValidationError(_("Must specify an enclosure with a telescope."))
 
-        site_data_dict = {site['code']: site for site in configdb.get_site_data()}
+        site_data_dict = configdb.get_snapshot().sites
         if 'site' in data:
             if data['site'] not in site_data_dict:
                 msg = _('Site {} not valid. Valid choices: {}').format(data['site'], ', '.join(site_data_dict.keys()))
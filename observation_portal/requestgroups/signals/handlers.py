@@ -4,6 +4,8 @@ from django.db.models.signals import pre_save, post_save
 from observation_portal.requestgroups.models import RequestGroup, Request
 from observation_portal.common.state_changes import on_request_state_change, on_requestgroup_state_change
 from observation_portal.proposals.notifications import requestgroup_notifications
+from observation_portal.common.configdb import configdb, configdb_changed
+from observation_portal.requestgroups.tasks import invalidate_pending_request_caches
 
 
 @receiver(pre_save, sender=RequestGroup)
@@ -29,3 +31,20 @@ def cb_request_pre_save(sender, instance, *args, **kwargs):
 @receiver(post_save, sender=RequestGroup)
 def cb_requestgroup_send_notifications(sender, instance, *args, **kwargs):
     requestgroup_notifications(instance)
+
+
+@receiver(configdb_changed)
+def cb_configdb_changed_invalidate_caches(sender, diff, *args, **kwargs):
+    # This is called from the ConfigDB refresher thread, so the pending requests are looked up in a task rather than
+    # with a database connection that would be held by the thread
+    telescopes = set()
+    if diff.instrument_types and diff.sites:
+        telescope_keys = set(diff.telescopes)
+        telescope_keys.update(
+            telescope_key for telescope_key in configdb.get_snapshot().telescopes if telescope_key.site in diff.sites
+        )
+        telescopes = {'.'.join([tk.telescope, tk.enclosure, tk.site]) for tk in telescope_keys}
+    if diff.overheads or telescopes:
+        invalidate_pending_request_caches.send(
+            sorted(diff.overheads), sorted(diff.instrument_types), sorted(telescopes)
+        )
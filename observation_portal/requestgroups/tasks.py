@@ -1,7 +1,13 @@
 import dramatiq
 import logging
+from datetime import timedelta
+from django.utils import timezone
+from django.core.cache import cache
 
 from observation_portal.common.state_changes import update_request_states_for_window_expiration
+from observation_portal.common.rise_set_utils import precompute_site_dark_intervals
+from observation_portal.proposals.models import Semester
+from observation_portal.requestgroups.models import Request
 
 logger = logging.getLogger(__name__)
 
@@ -10,3 +16,38 @@ logger = logging.getLogger(__name__)
 def expire_requests():
     logger.info('Expiring requests')
     update_request_states_for_window_expiration()
+
+
+@dramatiq.actor()
+def update_site_dark_intervals():
+    # Keep the table of site dark intervals filled in through the end of the next semester
+    logger.info('Updating site dark intervals')
+    today = timezone.now().date()
+    semesters = Semester.objects.filter(end__gte=timezone.now()).order_by('start')[:2]
+    last_day = max([semester.end.date() for semester in semesters], default=today + timedelta(days=365))
+    precompute_site_dark_intervals(today - timedelta(days=1), last_day)
+
+
+@dramatiq.actor()
+def invalidate_pending_request_caches(overheads, instrument_types, telescopes):
+    # Only pending requests are invalidated, the cached values of other requests expire on their own
+    logger.info('Invalidating cached values of pending requests after ConfigDB changes')
+    pending_requests = Request.objects.filter(state='PENDING')
+    if overheads:
+        requests = pending_requests.filter(configurations__instrument_type__in=overheads).values_list(
+            'id', 'request_group_id'
+        ).distinct()
+        cache_keys = set()
+        for request_id, request_group_id in requests:
+            cache_keys.add('request_duration_{}'.format(request_id))
+            cache_keys.add('requestgroup_duration_{}'.format(request_group_id))
+        cache.delete_many(cache_keys)
+    if instrument_types and telescopes:
+        request_ids = pending_requests.filter(configurations__instrument_type__in=instrument_types).values_list(
+            'id', flat=True
+        ).distinct()
+        # The rise_set intervals are cached by the site details they are computed from, so only the intervals with
+        # downtime removed, which are cached by request, need to be removed
+        cache.delete_many([
+            '{}.{}.frsi'.format(request_id, telescope) for request_id in request_ids for telescope in telescopes
+        ])
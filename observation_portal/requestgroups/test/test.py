@@ -1,7 +1,10 @@
 from django.utils import timezone
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django_dramatiq.test import DramatiqTestCase
+from django.core.cache import cache
 from mixer.backend.django import mixer
 from datetime import datetime
+from unittest.mock import patch
 import math
 
 from observation_portal.requestgroups.models import (
@@ -9,8 +12,9 @@ from observation_portal.requestgroups.models import (
     AcquisitionConfig, GuidingConfig
 )
 from observation_portal.proposals.models import Proposal, TimeAllocation, Semester
-from observation_portal.common.configdb import ConfigDBException
+from observation_portal.common.configdb import ConfigDBException, ConfigDBDiff, TelescopeKey, configdb_changed
 from observation_portal.common.test_helpers import SetTimeMixin
+from observation_portal.requestgroups.tasks import invalidate_pending_request_caches
 from observation_portal.requestgroups.duration_utils import PER_CONFIGURATION_STARTUP_TIME, PER_CONFIGURATION_GAP
 
 
@@ -452,3 +456,53 @@ class TestRequestDuration(SetTimeMixin, TestCase):
         with self.assertRaises(ConfigDBException) as context:
             _ = self.configuration_expose.duration
             self.assertTrue('not found in configdb' in context.exception)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-configdb-changed'},
+    'locmem': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-configdb-changed-locmem'}
+})
+class TestConfigDBChangedInvalidation(DramatiqTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.request = mixer.blend(Request, state='PENDING')
+        mixer.blend(Configuration, request=self.request, instrument_type='1M0-SCICAM-SBIG')
+        self.other_request = mixer.blend(Request, state='PENDING')
+        mixer.blend(Configuration, request=self.other_request, instrument_type='2M0-FLOYDS-SCICAM')
+        for request in [self.request, self.other_request]:
+            cache.set('request_duration_{}'.format(request.id), 100)
+            cache.set('requestgroup_duration_{}'.format(request.request_group.id), {})
+            cache.set('{}.1m0a.doma.tst.frsi'.format(request.id), {})
+
+    def test_changed_overheads_invalidate_durations(self):
+        configdb_changed.send(sender=None, diff=ConfigDBDiff(overheads={'1M0-SCICAM-SBIG'}))
+        self.broker.join('default')
+        self.worker.join()
+        self.assertIsNone(cache.get('request_duration_{}'.format(self.request.id)))
+        self.assertIsNone(cache.get('requestgroup_duration_{}'.format(self.request.request_group.id)))
+        self.assertIsNotNone(cache.get('{}.1m0a.doma.tst.frsi'.format(self.request.id)))
+        self.assertIsNotNone(cache.get('request_duration_{}'.format(self.other_request.id)))
+
+    def test_changed_instrument_types_invalidate_filtered_intervals(self):
+        configdb_changed.send(sender=None, diff=ConfigDBDiff(
+            telescopes={TelescopeKey('tst', 'doma', '1m0a')}, instrument_types={'1M0-SCICAM-SBIG'}, sites={'tst'}
+        ))
+        self.broker.join('default')
+        self.worker.join()
+        self.assertIsNone(cache.get('{}.1m0a.doma.tst.frsi'.format(self.request.id)))
+        self.assertIsNotNone(cache.get('request_duration_{}'.format(self.request.id)))
+        self.assertIsNotNone(cache.get('{}.1m0a.doma.tst.frsi'.format(self.other_request.id)))
+
+    def test_requests_that_are_not_pending_are_left_alone(self):
+        self.request.state = 'COMPLETED'
+        self.request.save()
+        configdb_changed.send(sender=None, diff=ConfigDBDiff(overheads={'1M0-SCICAM-SBIG'}))
+        self.broker.join('default')
+        self.worker.join()
+        self.assertIsNotNone(cache.get('request_duration_{}'.format(self.request.id)))
+
+    def test_pending_requests_are_not_queried_by_the_sender_of_the_signal(self):
+        with patch.object(invalidate_pending_request_caches, 'send') as mock_send, self.assertNumQueries(0):
+            configdb_changed.send(sender=None, diff=ConfigDBDiff(overheads={'1M0-SCICAM-SBIG'}))
+        mock_send.assert_called_once_with(['1M0-SCICAM-SBIG'], [], [])
@@ -11,12 +11,15 @@ import observation_portal.observations.signals.handlers  # noqa
 from observation_portal.requestgroups import serializers
 from observation_portal.requestgroups import views
 from observation_portal.common import state_changes
+from observation_portal.common import rise_set_utils
+from observation_portal.common.downtimedb import DowntimeDB
 
 from observation_portal.requestgroups.contention import Pressure
 from observation_portal.accounts.models import Profile
 from observation_portal.accounts.test_utils import blend_user
 
 from django.urls import reverse
+from django.test import override_settings
 from django.contrib.auth.models import User
 from django.core import cache
 from dateutil.parser import parse as datetime_parser
@@ -1917,6 +1920,13 @@ class TestGetRequestApi(APITestCase):
         result = self.client.get(reverse('api:requests-detail', args=(request.id,)))
         self.assertEqual(result.json()['observation_note'], request.observation_note)
 
+    def test_request_airmass_bad_options(self):
+        request = mixer.blend(Request, request_group=self.request_group)
+        self.client.force_login(self.user)
+        result = self.client.get(reverse('api:requests-airmass', args=(request.id,)) + '?resolution=0')
+        self.assertEqual(result.status_code, 400)
+        self.assertEqual(result.json(), {'errors': ['resolution must be a positive number of minutes']})
+
     def test_get_request_detail_unauthenticated(self):
         request = mixer.blend(Request, request_group=self.request_group, observation_note='testobsnote')
         result = self.client.get(reverse('api:requests-detail', args=(request.id,)))
@@ -2080,6 +2090,41 @@ class TestAirmassApi(SetTimeMixin, APITestCase):
         self.assertIn('tst', response.json()['airmass_data'])
         self.assertTrue(response.json()['airmass_data']['tst']['times'])
 
+    def test_airmass_downsampled_compact(self):
+        full_response = self.client.post(reverse('api:airmass'), data=self.request)
+        response = self.client.post(reverse('api:airmass') + '?max_points=50&compact=true', data=self.request)
+        airmass_data = response.json()['airmass_data']['tst']
+        self.assertLessEqual(len(airmass_data['times']), 50)
+        self.assertEqual(len(airmass_data['times']), len(airmass_data['airmasses']))
+        self.assertTrue(all(isinstance(time, int) for time in airmass_data['times']))
+        self.assertEqual(airmass_data['times'], sorted(airmass_data['times']))
+        # The airmasses are calculated at a coarser resolution, but the lowest airmasses are kept when downsampling
+        self.assertAlmostEqual(
+            min(airmass_data['airmasses']), min(full_response.json()['airmass_data']['tst']['airmasses']), delta=0.05
+        )
+
+    def test_airmass_resolution(self):
+        response = self.client.post(reverse('api:airmass') + '?resolution=60', data=self.request)
+        times = [datetime.strptime(time, '%Y-%m-%dT%H:%M') for time in response.json()['airmass_data']['tst']['times']]
+        self.assertTrue(times)
+        self.assertTrue(all(
+            (later - earlier) >= timedelta(minutes=60) for earlier, later in zip(times, times[1:])
+        ))
+
+    def test_airmass_bad_options(self):
+        response = self.client.post(reverse('api:airmass') + '?max_points=0', data=self.request)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'errors': ['max_points must be a positive number']})
+        response = self.client.post(reverse('api:airmass') + '?compact=yes', data=self.request)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'errors': ['compact must be true or false']})
+
+    def test_airmass_not_compact(self):
+        response = self.client.post(reverse('api:airmass') + '?compact=false', data=self.request)
+        times = response.json()['airmass_data']['tst']['times']
+        self.assertTrue(times)
+        self.assertTrue(all(isinstance(time, str) for time in times))
+
 
 @patch('observation_portal.common.state_changes.modify_ipp_time_from_requests')
 class TestCancelRequestGroupApi(SetTimeMixin, APITestCase):
@@ -2427,6 +2472,29 @@ class TestPressure(APITestCase):
         response = self.client.get(reverse('api:pressure'))
         self.assertNotIn('All Proposals', response.json()['pressure_data'][0])
 
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-pressure'},
+        'locmem': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-pressure-2'}
+    })
+    @patch('observation_portal.common.downtimedb.DowntimeDB._get_downtime_data', return_value=[])
+    def test_pressure_intervals_are_not_recomputed(self, downtime_data):
+        cache.caches['default'].clear()
+        cache.caches['locmem'].clear()
+        DowntimeDB._store = None
+        self.addCleanup(setattr, DowntimeDB, '_store', None)
+        request = Request.objects.first()
+        request.windows.update(start=self.now - timedelta(days=1), end=self.now + timedelta(days=2))
+        Location.objects.filter(request=request).update(telescope_class='1m0', site='', enclosure='', telescope='')
+        Target.objects.filter(configuration__request=request).update(ra=22, dec=-33)
+        Constraints.objects.filter(configuration__request=request).update(max_airmass=2.0, min_lunar_distance=30.0)
+        with patch.object(rise_set_utils, 'get_rise_set_intervals_for_targets',
+                          wraps=rise_set_utils.get_rise_set_intervals_for_targets) as mock_intervals:
+            pressure_data = Pressure().data()['pressure_data']
+        self.assertTrue(mock_intervals.called)
+        with patch.object(rise_set_utils, 'get_rise_set_intervals_for_targets') as mock_intervals:
+            self.assertEqual(Pressure().data()['pressure_data'], pressure_data)
+        self.assertFalse(mock_intervals.called)
+
     def test_get_site_data_should_get_one_site(self):
         pressure = Pressure(site='tst')
         self.assertEqual(len(pressure.sites), 1)
@@ -2569,7 +2637,7 @@ class TestPressure(APITestCase):
         ]
         self.assertEqual(Pressure()._anonymize(data), expected)
 
-    @patch('observation_portal.requestgroups.contention.get_filtered_rise_set_intervals_by_site')
+    @patch('observation_portal.requestgroups.contention.get_filtered_rise_set_intervals_by_site_for_requests')
     def test_binned_pressure_by_hours_from_now_should_be_gtzero_pressure(self, mock_intervals):
         requestgroup = mixer.blend(RequestGroup, observation_type=RequestGroup.NORMAL)
         request = mixer.blend(Request, request_group=requestgroup, state='PENDING', duration=120*60)  # 2 hour duration.
@@ -2582,9 +2650,9 @@ class TestPressure(APITestCase):
         mixer.blend(Constraints, configuration=conf)
         mixer.blend(Target, configuration=conf)
 
-        mock_intervals.return_value = {'tst': [
+        mock_intervals.return_value = [{'tst': [
             [self.now + timedelta(hours=2), self.now + timedelta(hours=6)],
-        ]}
+        ]}]
         p = Pressure()
         p.requests = [request]
         sum_of_pressure = sum(sum(time.values()) for i, time in enumerate(p._binned_pressure_by_hours_from_now()))
@@ -1,16 +1,25 @@
 from django.utils import timezone
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.core.cache import caches
 from mixer.backend.django import mixer
-from datetime import datetime
+from datetime import datetime, timedelta
 from unittest.mock import patch
+from concurrent.futures.process import BrokenProcessPool
+from rise_set.angle import Angle
+from rise_set.astrometry import calculate_airmass_at_times
 
 from observation_portal.requestgroups.request_utils import (get_airmasses_for_request_at_sites, get_telescope_states_for_request,
                                                             get_filtered_rise_set_intervals_by_site)
+from observation_portal.common.rise_set_utils import (get_rise_set_intervals_by_site,
+                                                      get_filtered_rise_set_intervals_by_site_for_requests)
 from observation_portal.requestgroups.models import (Request, Configuration, Target, RequestGroup, Window, Location,
                                                      Constraints, InstrumentConfig, AcquisitionConfig, GuidingConfig)
 from observation_portal.proposals.models import Proposal, TimeAllocation, Semester
 from observation_portal.common.test_telescope_states import TelescopeStatesFakeInput
 from observation_portal.common.test_helpers import SetTimeMixin
+from observation_portal.common.downtimedb import DowntimeDB
+from observation_portal.common.configdb import configdb
+from observation_portal.common import rise_set_utils
 
 
 class BaseSetupRequest(SetTimeMixin, TestCase):
@@ -291,6 +300,218 @@ class TestRequestIntervals(BaseSetupRequest):
         self.assertEqual(intervals, truth_intervals)
 
 
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-filtered-intervals'},
+    'locmem': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-filtered-intervals-2'}
+})
+class TestCachedRequestIntervals(BaseSetupRequest):
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+        caches['locmem'].clear()
+        DowntimeDB._store = None
+
+    def tearDown(self):
+        DowntimeDB._store = None
+        super().tearDown()
+
+    @patch('observation_portal.common.downtimedb.DowntimeDB._get_downtime_data', return_value=[])
+    def test_filtered_intervals_are_reused(self, downtime_data):
+        intervals = get_filtered_rise_set_intervals_by_site(self.request.as_dict())
+        with patch.object(rise_set_utils, 'get_rise_set_intervals_by_site') as mock_rise_set_intervals:
+            self.assertEqual(get_filtered_rise_set_intervals_by_site(self.request.as_dict()), intervals)
+        self.assertFalse(mock_rise_set_intervals.called)
+
+    @patch('observation_portal.common.downtimedb.DowntimeDB._get_downtime_data')
+    def test_filtered_intervals_are_recomputed_for_telescopes_with_changed_downtime(self, downtime_data):
+        downtime_data.return_value = [{'start': '2016-10-01T22:00:00Z', 'end': '2016-10-03T00:00:00Z', 'site': 'tst',
+                                       'observatory': 'domb', 'telescope': '1m0a', 'reason': 'Whatever'}]
+        get_filtered_rise_set_intervals_by_site(self.request.as_dict())
+        downtime_data.return_value = downtime_data.return_value + [
+            {'start': '2016-10-01T22:00:00Z', 'end': '2016-10-03T00:00:00Z', 'site': 'tst', 'observatory': 'doma',
+             'telescope': '1m0a', 'reason': 'Whatever'},
+            {'start': '2017-10-01T22:00:00Z', 'end': '2017-10-03T00:00:00Z', 'site': 'tst', 'observatory': 'domb',
+             'telescope': '1m0a', 'reason': 'Outside of the request windows'}
+        ]
+        # Expire the downtime so that the changes are picked up
+        caches['locmem'].clear()
+        with patch.object(rise_set_utils, 'filter_out_downtime_from_intervalsets',
+                          wraps=rise_set_utils.filter_out_downtime_from_intervalsets) as mock_filter_out_downtime:
+            intervals = get_filtered_rise_set_intervals_by_site(self.request.as_dict()).get('tst', [])
+        self.assertEqual(list(mock_filter_out_downtime.call_args[0][0].keys()), ['1m0a.doma.tst'])
+        self.assertIn(
+            (datetime(2016, 10, 1, 19, 13, 14, 944205, tzinfo=timezone.utc),
+             datetime(2016, 10, 1, 22, 0, 0, tzinfo=timezone.utc)),
+            intervals
+        )
+        self.assertNotIn(datetime(2016, 10, 2, 3, 19, 9, 181040, tzinfo=timezone.utc), [i[1] for i in intervals])
+
+    def test_rise_set_intervals_are_shared_between_requests_with_the_same_target(self):
+        intervals = get_rise_set_intervals_by_site(self.request.as_dict())
+        unsaved_request = self.request.as_dict()
+        del unsaved_request['id']
+        with patch.object(rise_set_utils, 'get_rise_set_visibility') as mock_visibility:
+            self.assertEqual(get_rise_set_intervals_by_site(unsaved_request), intervals)
+        self.assertFalse(mock_visibility.called)
+
+    def test_rise_set_intervals_are_computed_only_for_uncached_days(self):
+        get_rise_set_intervals_by_site(self.request.as_dict())
+        request = self.request.as_dict()
+        request['windows'].append({'start': datetime(2016, 10, 10, tzinfo=timezone.utc),
+                                   'end': datetime(2016, 10, 11, tzinfo=timezone.utc)})
+        with patch.object(rise_set_utils, 'get_rise_set_visibility',
+                          wraps=rise_set_utils.get_rise_set_visibility) as mock_visibility:
+            get_rise_set_intervals_by_site(request)
+        self.assertEqual(mock_visibility.call_count, 1)
+        self.assertEqual(mock_visibility.call_args[0][0], datetime(2016, 10, 10, tzinfo=timezone.utc))
+
+    def test_overlapping_windows_compute_each_day_once(self):
+        request = self.request.as_dict()
+        request['windows'] = [
+            {'start': datetime(2016, 10, 1, 12, tzinfo=timezone.utc),
+             'end': datetime(2016, 10, 3, tzinfo=timezone.utc)},
+            {'start': datetime(2016, 10, 2, tzinfo=timezone.utc),
+             'end': datetime(2016, 10, 4, tzinfo=timezone.utc)}
+        ]
+        with patch.object(rise_set_utils, 'get_rise_set_visibility',
+                          wraps=rise_set_utils.get_rise_set_visibility) as mock_visibility:
+            intervals = get_rise_set_intervals_by_site(request)['tst']
+        self.assertEqual(mock_visibility.call_count, 1)
+        self.assertEqual(mock_visibility.call_args[0][0:2], (
+            datetime(2016, 10, 1, tzinfo=timezone.utc), datetime(2016, 10, 4, tzinfo=timezone.utc)
+        ))
+        first_window_intervals = [i for i in intervals if i[1] <= datetime(2016, 10, 3, tzinfo=timezone.utc)]
+        self.assertGreaterEqual(first_window_intervals[0][0], datetime(2016, 10, 1, 12, tzinfo=timezone.utc))
+
+    def test_rise_set_intervals_computed_in_process_pool_match_in_process(self):
+        request = self.request.as_dict()
+        request['windows'].append({'start': datetime(2016, 10, 20, tzinfo=timezone.utc),
+                                   'end': datetime(2016, 10, 22, tzinfo=timezone.utc)})
+        intervals = get_rise_set_intervals_by_site(request)
+        caches['default'].clear()
+        try:
+            with self.settings(RISE_SET_PROCESS_POOL_WORKERS=2):
+                self.assertEqual(get_rise_set_intervals_by_site(request), intervals)
+                self.assertIsNotNone(rise_set_utils._process_pool)
+        finally:
+            rise_set_utils._reset_process_pool()
+
+    @patch('observation_portal.common.rise_set_utils.logger')
+    def test_rise_set_intervals_are_computed_in_process_if_process_pool_is_broken(self, mock_logger):
+        request = self.request.as_dict()
+        request['windows'].append({'start': datetime(2016, 10, 20, tzinfo=timezone.utc),
+                                   'end': datetime(2016, 10, 22, tzinfo=timezone.utc)})
+        intervals = get_rise_set_intervals_by_site(request)
+        caches['default'].clear()
+        with patch.object(rise_set_utils, '_get_process_pool') as mock_pool:
+            mock_pool.return_value.map.side_effect = BrokenProcessPool()
+            self.assertEqual(get_rise_set_intervals_by_site(request), intervals)
+        self.assertTrue(mock_pool.return_value.map.called)
+        self.assertTrue(mock_logger.warning.called)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-batch-intervals'},
+    'locmem': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-batch-intervals-2'}
+})
+class TestBatchRequestIntervals(BaseSetupRequest):
+    # rise_set only refines its rise and set times once, which leaves them up to about a minute and a half from where
+    # the constraints are crossed, so the batch intervals are expected to match rise_set to within two minutes
+    tolerance = timedelta(minutes=2)
+
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+        caches['locmem'].clear()
+        DowntimeDB._store = None
+
+    def tearDown(self):
+        DowntimeDB._store = None
+        super().tearDown()
+
+    @patch('observation_portal.common.downtimedb.DowntimeDB._get_downtime_data', return_value=[])
+    def test_batch_intervals_match_intervals_of_each_request(self, downtime_data):
+        requests = [self.request.as_dict(), self.request.as_dict()]
+        requests[1]['configurations'][0]['target']['dec'] = 10
+        batch_intervals = get_filtered_rise_set_intervals_by_site_for_requests(requests)
+        self.assertEqual(len(batch_intervals), 2)
+        for request, intervals_by_site in zip(requests, batch_intervals):
+            truth_intervals = get_filtered_rise_set_intervals_by_site(request).get('tst', [])
+            intervals = intervals_by_site.get('tst', [])
+            self.assertEqual(len(intervals), len(truth_intervals))
+            for interval, truth_interval in zip(intervals, truth_intervals):
+                self.assertLessEqual(abs(interval[0] - truth_interval[0]), self.tolerance)
+                self.assertLessEqual(abs(interval[1] - truth_interval[1]), self.tolerance)
+
+    def test_batch_intervals_match_rise_set_for_targets_at_real_sites(self):
+        site_details = {
+            'lsc': {'latitude': -30.1673833333, 'longitude': -70.8047888889, 'horizon': 15.0, 'altitude': 2198.0,
+                    'ha_limit_pos': 4.6, 'ha_limit_neg': -4.6, 'zenith_blind_spot': 0.0},
+            'ogg': {'latitude': 20.7069444444, 'longitude': -156.258055556, 'horizon': 15.0, 'altitude': 3055.0,
+                    'ha_limit_pos': 4.6, 'ha_limit_neg': -4.6, 'zenith_blind_spot': 0.0},
+            'coj': {'latitude': -31.272932, 'longitude': 149.070648, 'horizon': 15.0, 'altitude': 1116.0,
+                    'ha_limit_pos': 4.6, 'ha_limit_neg': -4.6, 'zenith_blind_spot': 0.0},
+            'tfn': {'latitude': 28.3003, 'longitude': -16.5117, 'horizon': 15.0, 'altitude': 2330.0,
+                    'ha_limit_pos': 4.5, 'ha_limit_neg': -4.5, 'zenith_blind_spot': 0.0}
+        }
+        # (ra, dec, max_airmass, min_lunar_distance)
+        targets = [(22, -33, 1.6, 30), (83.63, 22.01, 2.0, 30), (201.37, -43.02, 2.0, 15), (279.23, 38.78, 3.0, 0),
+                   (350, 0, 1.8, 45)]
+        request = self.request.as_dict()
+        configuration = request['configurations'][0]
+        window = request['windows'][0]
+        for site, site_detail in site_details.items():
+            for ra, dec, max_airmass, min_lunar_distance in targets:
+                configuration['target'].update(ra=ra, dec=dec)
+                configuration['constraints'].update(max_airmass=max_airmass, min_lunar_distance=min_lunar_distance)
+                with patch.object(configdb, 'get_sites_with_instrument_type_and_location',
+                                  return_value={site: site_detail}):
+                    truth_intervals = get_rise_set_intervals_by_site(request)[site]
+                intervals = rise_set_utils.get_rise_set_intervals_for_targets(
+                    [(configuration['target'], configuration['constraints'])], site, window['start'], window['end'],
+                    site_detail
+                )[0]
+                self.assertEqual(len(intervals), len(truth_intervals))
+                for interval, truth_interval in zip(intervals, truth_intervals):
+                    self.assertLessEqual(abs(interval[0] - truth_interval[0]), self.tolerance)
+                    self.assertLessEqual(abs(interval[1] - truth_interval[1]), self.tolerance)
+
+    @patch('observation_portal.common.downtimedb.DowntimeDB._get_downtime_data', return_value=[])
+    def test_batch_intervals_computes_sidereal_time_once_per_night(self, downtime_data):
+        requests = [self.request.as_dict() for _ in range(5)]
+        with patch.object(rise_set_utils, 'calc_apparent_sidereal_time',
+                          wraps=rise_set_utils.calc_apparent_sidereal_time) as mock_sidereal_time:
+            get_filtered_rise_set_intervals_by_site_for_requests(requests, 'tst')
+        # One call per night in the week long window
+        self.assertEqual(mock_sidereal_time.call_count, 8)
+
+    @patch('observation_portal.common.downtimedb.DowntimeDB._get_downtime_data', return_value=[])
+    def test_batch_intervals_are_reused(self, downtime_data):
+        requests = [self.request.as_dict(), self.request.as_dict()]
+        requests[1]['configurations'][0]['target']['dec'] = 10
+        del requests[1]['id']
+        batch_intervals = get_filtered_rise_set_intervals_by_site_for_requests(requests)
+        with patch.object(rise_set_utils, 'get_rise_set_intervals_for_targets') as mock_intervals:
+            self.assertEqual(get_filtered_rise_set_intervals_by_site_for_requests(requests), batch_intervals)
+        self.assertFalse(mock_intervals.called)
+
+    @patch('observation_portal.common.downtimedb.DowntimeDB._get_downtime_data', return_value=[])
+    def test_batch_intervals_use_cached_rise_set_intervals(self, downtime_data):
+        saved_request = self.request.as_dict()
+        unsaved_request = self.request.as_dict()
+        unsaved_request['configurations'][0]['target']['dec'] = 10
+        del unsaved_request['id']
+        truth_intervals = [
+            get_filtered_rise_set_intervals_by_site(saved_request),
+            get_filtered_rise_set_intervals_by_site(unsaved_request)
+        ]
+        with patch.object(rise_set_utils, 'get_rise_set_intervals_for_targets') as mock_intervals:
+            self.assertEqual(
+                get_filtered_rise_set_intervals_by_site_for_requests([saved_request, unsaved_request]), truth_intervals
+            )
+        self.assertFalse(mock_intervals.called)
+
+
 class TestRequestAirmass(BaseSetupRequest):
     def test_airmass_calculation(self):
         airmasses = get_airmasses_for_request_at_sites(self.request.as_dict())
@@ -303,6 +524,28 @@ class TestRequestAirmass(BaseSetupRequest):
             if atime > expected_null_range[0] and atime < expected_null_range[1]:
                 self.fail("Should not get airmass ({}) within range {}".format(atime, expected_null_range))
 
+    def test_airmass_calculation_matches_rise_set(self):
+        airmasses = get_airmasses_for_request_at_sites(self.request.as_dict())['airmass_data']['tst']
+        times = [datetime.strptime(airmass_time, '%Y-%m-%dT%H:%M') for airmass_time in airmasses['times'][:20]]
+        site_detail = configdb.get_sites_with_instrument_type_and_location(site_code='tst')['tst']
+        truth_airmasses = calculate_airmass_at_times(
+            times, rise_set_utils.get_rise_set_target(self.configuration.target.as_dict()),
+            Angle(degrees=site_detail['latitude']), Angle(degrees=site_detail['longitude']), site_detail['altitude']
+        )
+        for airmass, truth_airmass in zip(airmasses['airmasses'], truth_airmasses):
+            self.assertAlmostEqual(airmass, truth_airmass, delta=0.02)
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-airmasses'},
+        'locmem': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+    })
+    def test_airmasses_are_cached(self):
+        caches['default'].clear()
+        airmasses = get_airmasses_for_request_at_sites(self.request.as_dict())
+        with patch.object(rise_set_utils, '_calculate_sidereal_airmasses') as mock_airmasses:
+            self.assertEqual(get_airmasses_for_request_at_sites(self.request.as_dict()), airmasses)
+        self.assertFalse(mock_airmasses.called)
+
     def test_airmass_calculation_empty(self):
         self.location.site = 'cpt'
         self.location.save()
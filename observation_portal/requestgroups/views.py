@@ -19,7 +19,7 @@ from observation_portal.common.telescope_states import (
     TelescopeStates, get_telescope_availability_per_day, combine_telescope_availabilities_by_site_and_class,
     ElasticSearchException
 )
-from observation_portal.requestgroups.request_utils import get_airmasses_for_request_at_sites
+from observation_portal.requestgroups.request_utils import get_airmasses_for_request_at_sites, get_airmass_options
 from observation_portal.requestgroups.models import RequestGroup, Request
 from observation_portal.requestgroups.serializers import RequestSerializer
 from observation_portal.requestgroups.filters import RequestGroupFilter
@@ -172,10 +172,14 @@ class AirmassView(APIView):
     permission_classes = (AllowAny,)
 
     def post(self, request):
+        try:
+            airmass_options = get_airmass_options(request.query_params)
+        except ValueError as exc:
+            return Response({'errors': [str(exc)]}, status=400)
         serializer = RequestSerializer(data=request.data)
         if serializer.is_valid():
             return Response(get_airmasses_for_request_at_sites(
-                serializer.validated_data, is_staff=request.user.is_staff
+                serializer.validated_data, is_staff=request.user.is_staff, **airmass_options
             ))
         else:
             return Response(serializer.errors)
@@ -22,7 +22,7 @@ from observation_portal.requestgroups.duration_utils import (
 )
 from observation_portal.common.state_changes import InvalidStateChange, TERMINAL_REQUEST_STATES
 from observation_portal.requestgroups.request_utils import (
-    get_airmasses_for_request_at_sites, get_telescope_states_for_request
+    get_airmasses_for_request_at_sites, get_telescope_states_for_request, get_airmass_options
 )
 from observation_portal.common.mixins import ListAsDictMixin
 
@@ -234,7 +234,13 @@ class RequestViewSet(ListAsDictMixin, viewsets.ReadOnlyModelViewSet):
 
     @action(detail=True)
     def airmass(self, request, pk=None):
-        return Response(get_airmasses_for_request_at_sites(self.get_object().as_dict(), is_staff=request.user.is_staff))
+        try:
+            airmass_options = get_airmass_options(request.query_params)
+        except ValueError as exc:
+            return Response({'errors': [str(exc)]}, status=400)
+        return Response(get_airmasses_for_request_at_sites(
+            self.get_object().as_dict(), is_staff=request.user.is_staff, **airmass_options
+        ))
 
     @action(detail=True)
     def telescope_states(self, request, pk=None):
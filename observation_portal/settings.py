@@ -222,6 +222,24 @@ SERVER_EMAIL = DEFAULT_FROM_EMAIL
 ELASTICSEARCH_URL = os.getenv('ELASTICSEARCH_URL', 'http://elasticsearchdev.lco.gtn')
 CONFIGDB_URL = os.getenv('CONFIGDB_URL', 'http://configdbdev.lco.gtn')
 DOWNTIMEDB_URL = os.getenv('DOWNTIMEDB_URL', 'http://downtimedb.lco.gtn')
+# Refresh cached ConfigDB data in a background thread of each process instead of within requests
+CONFIGDB_BACKGROUND_REFRESH = os.getenv('CONFIGDB_BACKGROUND_REFRESH', 'false').lower() == 'true'
+CONFIGDB_REFRESH_INTERVAL = int(os.getenv('CONFIGDB_REFRESH_INTERVAL', 600))  # seconds
+# Cache alias used to share fetched ConfigDB data between processes, set to an empty string to disable
+CONFIGDB_SHARED_CACHE = os.getenv('CONFIGDB_SHARED_CACHE', 'default')
+# Load the ConfigDB sites data from a local JSON file instead of from ConfigDB, reloading it when the file changes
+CONFIGDB_SNAPSHOT_FILE = os.getenv('CONFIGDB_SNAPSHOT_FILE', '')
+CONFIGDB_SNAPSHOT_FILE_CHECK_INTERVAL = int(os.getenv('CONFIGDB_SNAPSHOT_FILE_CHECK_INTERVAL', 5))  # seconds
+# Only fetch the DowntimeDB records modified since the last sync, keeping a copy of all records in a shared cache
+DOWNTIMEDB_INCREMENTAL_SYNC = os.getenv('DOWNTIMEDB_INCREMENTAL_SYNC', 'false').lower() == 'true'
+DOWNTIMEDB_FULL_SYNC_INTERVAL = int(os.getenv('DOWNTIMEDB_FULL_SYNC_INTERVAL', 3600))  # seconds
+DOWNTIMEDB_SYNC_CACHE = os.getenv('DOWNTIMEDB_SYNC_CACHE', 'default')
+# Number of worker processes used to compute rise_set intervals in parallel, set to 0 to compute them in-process
+RISE_SET_PROCESS_POOL_WORKERS = int(os.getenv('RISE_SET_PROCESS_POOL_WORKERS', 0))
+# Number of threads used to query the telescope states of each site concurrently, set to 0 to query all sites at once
+TELESCOPE_STATES_QUERY_THREADS = int(os.getenv('TELESCOPE_STATES_QUERY_THREADS', 0))
+# Comma separated addresses allowed to scrape the /metrics/ endpoint without logging in, staff users are always allowed
+METRICS_ALLOWED_IPS = [ip.strip() for ip in os.getenv('METRICS_ALLOWED_IPS', '').split(',') if ip.strip()]
 
 REST_FRAMEWORK = {
     'TEST_REQUEST_DEFAULT_FORMAT': 'json',
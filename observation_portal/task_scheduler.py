@@ -1,7 +1,7 @@
 from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.triggers.cron import CronTrigger
 
-from observation_portal.requestgroups.tasks import expire_requests
+from observation_portal.requestgroups.tasks import expire_requests, update_site_dark_intervals
 from observation_portal.observations.tasks import delete_old_observations
 from observation_portal.accounts.tasks import expire_access_tokens
 from observation_portal.proposals.tasks import time_allocation_reminder
@@ -25,4 +25,8 @@ def run():
         time_allocation_reminder.send,
         CronTrigger.from_crontab('0 0 1 * *')  # monthly
     )
+    scheduler.add_job(
+        update_site_dark_intervals.send,
+        CronTrigger.from_crontab('30 0 * * *')
+    )
     scheduler.start()